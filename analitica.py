@@ -0,0 +1,322 @@
+import argparse
+import logging
+import os
+import threading
+import time
+from itertools import chain
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import and_, case, delete, distinct, func, insert, select as select_core
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db import get_async_session, get_session
+from etag import MARCAS, condicional_tablas
+from models import (
+    CargaProfesor, DistribucionNotas, EstadoAnalitica, Estudiante, Historial, Materia, Matricula,
+    MatriculaProfesorLink, Profesor, ResumenMateria, ResumenSemestre, ahora,
+)
+from paginacion import Paginacion, obtener_paginacion, paginar_rapido
+from metricas import RutaMedida
+
+
+# Segundos entre revisiones del trabajo programado (0 = solo reconstrucción manual o por consola).
+ANALITICA_INTERVALO_S = float(os.getenv("ANALITICA_INTERVALO_S", "300"))
+NOTA_APROBACION = float(os.getenv("NOTA_APROBACION", "3.0"))
+NOTA_MAXIMA = 5.0
+ANCHO_RANGO = 0.5
+PERCENTILES = (0.25, 0.50, 0.75, 0.90)
+# Tablas de las que salen los resúmenes: si ninguna cambió desde la última reconstrucción, no se repite.
+TABLAS_ORIGEN = ("estudiante", "materia", "matricula", "profesor", "matriculaprofesorlink", "historial")
+
+log = logging.getLogger("universidad.analitica")
+
+router = APIRouter(prefix="/analitica", tags=["Analítica"], route_class=RutaMedida)
+
+
+# --- cálculo vectorizado ---
+
+def percentiles_por_grupo(grupos: np.ndarray, valores: np.ndarray, cuantiles: Sequence[float] = PERCENTILES) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Percentiles (interpolación lineal, como np.percentile) de `valores` para cada grupo en una sola pasada:
+    se ordena por (grupo, valor) y cada percentil es una posición dentro del tramo de su grupo.
+    Devuelve las claves de grupo ordenadas y una matriz grupos x cuantiles.
+    """
+    orden = np.lexsort((valores, grupos))
+    grupos, valores = grupos[orden], valores[orden]
+    claves, inicios, conteos = np.unique(grupos, return_index=True, return_counts=True)
+    posiciones = inicios[:, None] + np.asarray(cuantiles)[None, :] * (conteos[:, None] - 1)
+    bajo = np.floor(posiciones).astype(np.int64)
+    alto = np.ceil(posiciones).astype(np.int64)
+    return claves, valores[bajo] + (valores[alto] - valores[bajo]) * (posiciones - bajo)
+
+
+def histograma_por_grupo(grupos: np.ndarray, valores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Conteo por rango de ANCHO_RANGO entre 0 y NOTA_MAXIMA para cada grupo con un solo bincount.
+    La nota máxima cae en el último rango. Devuelve las claves y una matriz grupos x rangos.
+    """
+    rangos = int(round(NOTA_MAXIMA / ANCHO_RANGO))
+    claves, indices = np.unique(grupos, return_inverse=True)
+    rango = np.clip((valores / ANCHO_RANGO).astype(np.int64), 0, rangos - 1)
+    conteos = np.bincount(indices * rangos + rango, minlength=len(claves) * rangos)
+    return claves, conteos.reshape(len(claves), rangos)
+
+
+def _filas_distribucion(ambito: str, claves: np.ndarray, conteos: np.ndarray) -> List[dict]:
+    return [
+        {"ambito": ambito, "clave": int(clave), "desde": indice * ANCHO_RANGO, "hasta": (indice + 1) * ANCHO_RANGO, "cantidad": int(cantidad)}
+        for clave, fila in zip(claves, conteos)
+        for indice, cantidad in enumerate(fila)
+    ]
+
+
+# --- reconstrucción ---
+
+def marca_origen(session: Session) -> str:
+    filas = session.execute(select_core(MARCAS.c.tabla, MARCAS.c.version).where(MARCAS.c.tabla.in_(TABLAS_ORIGEN))).all()
+    versiones = dict(filas)
+    return ".".join(str(versiones.get(tabla, 0)) for tabla in TABLAS_ORIGEN)
+
+
+def _leer_resumenes(session: Session):
+    """
+    Fase de lectura: agregados por GROUP BY en SQL y las notas (materia, semestre, nota) para NumPy.
+    """
+    activa = Matricula.active == True
+    nota = Matricula.nota_final
+    aprobada = func.sum(case((nota >= NOTA_APROBACION, 1), else_=0))
+
+    materias = session.execute(
+        select_core(
+            Materia.id, Materia.nombre, Materia.codigo,
+            func.count(Matricula.id), func.count(nota), func.coalesce(aprobada, 0), func.avg(nota), func.min(nota), func.max(nota),
+        )
+        .select_from(Materia)
+        .outerjoin(Matricula, and_(Matricula.materia_id == Materia.id, activa))
+        .where(Materia.active == True)
+        .group_by(Materia.id)
+    ).all()
+
+    profesores = session.execute(
+        select_core(
+            Profesor.id, Profesor.nombre, func.count(Matricula.id),
+            func.count(distinct(Matricula.materia_id)), func.count(distinct(Matricula.estudiante_id)), func.avg(nota),
+        )
+        .select_from(Profesor)
+        .outerjoin(MatriculaProfesorLink, MatriculaProfesorLink.profesor_id == Profesor.id)
+        .outerjoin(Matricula, and_(Matricula.id == MatriculaProfesorLink.matricula_id, activa))
+        .where(Profesor.active == True)
+        .group_by(Profesor.id)
+    ).all()
+
+    # Por semestre, tres agregados separados: con un solo LEFT JOIN estudiante-matrícula SQLite recorre
+    # las matrículas activas por cada estudiante.
+    del_semestre = and_(Estudiante.active == True, Estudiante.semestre.is_not(None))
+    semestres = session.execute(
+        select_core(Estudiante.semestre, func.count()).where(del_semestre).group_by(Estudiante.semestre)
+    ).all()
+    matriculas_semestre = {
+        fila[0]: fila[1:] for fila in session.execute(
+            select_core(Estudiante.semestre, func.count(Matricula.id), func.count(nota), func.avg(nota))
+            .select_from(Matricula)
+            .join(Estudiante, Estudiante.id == Matricula.estudiante_id)
+            .where(activa, del_semestre)
+            .group_by(Estudiante.semestre)
+        ).all()
+    }
+    ponderados = dict(session.execute(
+        select_core(Estudiante.semestre, func.avg(Historial.promedio_ponderado))
+        .join(Historial, Historial.estudiante_id == Estudiante.id)
+        .where(del_semestre)
+        .group_by(Estudiante.semestre)
+    ).all())
+
+    notas = session.execute(
+        select_core(Matricula.materia_id, func.coalesce(Estudiante.semestre, -1), nota)
+        .join(Estudiante, Estudiante.id == Matricula.estudiante_id)
+        .where(activa, nota.is_not(None), Matricula.materia_id.is_not(None), Estudiante.active == True)
+    ).all()
+    # fromiter sobre los valores planos: np.array sobre objetos Row los inspecciona uno por uno y es ~50x más lento.
+    arreglo = np.fromiter(chain.from_iterable(notas), dtype=np.float64, count=3 * len(notas)).reshape(-1, 3)
+    return materias, profesores, semestres, matriculas_semestre, ponderados, arreglo
+
+
+def reconstruir_analitica(session: Session, forzar: bool = False) -> EstadoAnalitica:
+    """
+    Reconstruye todos los resúmenes si alguna tabla de origen cambió (o con `forzar`).
+    La lectura y la escritura van en transacciones separadas: así un escritor concurrente nunca invalida
+    la instantánea de lectura, y los resúmenes quedan marcados con la marca leída al comenzar.
+    """
+    inicio = time.perf_counter()
+    marca = marca_origen(session)
+    estado = session.get(EstadoAnalitica, 1)
+    if estado is not None and estado.marca == marca and not forzar:
+        return estado
+
+    materias, profesores, semestres, matriculas_semestre, ponderados, notas = _leer_resumenes(session)
+    session.rollback()
+
+    materia_nota, semestre_nota, valores = notas[:, 0].astype(np.int64), notas[:, 1].astype(np.int64), notas[:, 2]
+    percentiles_materia = dict(zip(*percentiles_por_grupo(materia_nota, valores))) if len(valores) else {}
+    con_semestre = semestre_nota >= 0
+    percentiles_semestre = dict(zip(*percentiles_por_grupo(semestre_nota[con_semestre], valores[con_semestre], (0.5,)))) if con_semestre.any() else {}
+
+    resumen_materias = []
+    for materia_id, nombre, codigo, activas, con_nota, aprobadas, promedio, minimo, maximo in materias:
+        cuantiles = percentiles_materia.get(materia_id)
+        resumen_materias.append({
+            "id": materia_id, "nombre": nombre, "codigo": codigo, "matriculas_activas": activas, "con_nota": con_nota,
+            "aprobadas": aprobadas, "promedio": promedio, "minimo": minimo, "maximo": maximo,
+            **{f"p{int(q * 100)}": (float(cuantiles[i]) if cuantiles is not None else None) for i, q in enumerate(PERCENTILES)},
+        })
+    resumen_semestres = []
+    for semestre, estudiantes in semestres:
+        activas, con_nota, promedio = matriculas_semestre.get(semestre, (0, 0, None))
+        resumen_semestres.append({
+            "semestre": semestre, "estudiantes": estudiantes, "matriculas_activas": activas, "con_nota": con_nota, "promedio": promedio,
+            "p50": float(percentiles_semestre[semestre][0]) if semestre in percentiles_semestre else None,
+            "promedio_ponderado": ponderados.get(semestre),
+        })
+    carga_profesores = [
+        {"id": profesor_id, "nombre": nombre, "matriculas": total, "materias": cantidad_materias, "estudiantes": cantidad_estudiantes, "promedio_notas": promedio}
+        for profesor_id, nombre, total, cantidad_materias, cantidad_estudiantes, promedio in profesores
+    ]
+    distribucion = []
+    if len(valores):
+        distribucion += _filas_distribucion("global", *histograma_por_grupo(np.zeros(len(valores), dtype=np.int64), valores))
+        distribucion += _filas_distribucion("materia", *histograma_por_grupo(materia_nota, valores))
+        distribucion += _filas_distribucion("semestre", *histograma_por_grupo(semestre_nota[con_semestre], valores[con_semestre]))
+
+    conexion = session.connection()
+    for modelo, filas in ((ResumenMateria, resumen_materias), (ResumenSemestre, resumen_semestres), (CargaProfesor, carga_profesores), (DistribucionNotas, distribucion)):
+        conexion.execute(delete(modelo))
+        if filas:
+            conexion.execute(insert(modelo), filas)
+    estado = session.get(EstadoAnalitica, 1) or EstadoAnalitica(id=1)
+    estado.marca = marca
+    estado.generado = ahora()
+    estado.duracion_ms = round((time.perf_counter() - inicio) * 1000, 3)
+    estado.notas = len(valores)
+    session.add(estado)
+    session.commit()
+    session.refresh(estado)
+    return estado
+
+
+class ProgramadorAnalitica:
+    """
+    Hilo que cada `intervalo` segundos reconstruye los resúmenes si cambiaron las tablas de origen.
+    Con varios workers cada uno lo ejecuta: la marca evita reconstruir si nada cambió, pero los workers que
+    revisan a la vez ven la misma marca vieja y reconstruyen todos (el resultado es el mismo).
+    """
+
+    def __init__(self, intervalo: float = ANALITICA_INTERVALO_S):
+        self.intervalo = intervalo
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def iniciar(self, engine):
+        if self.intervalo <= 0:
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, args=(engine,), name="analitica", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join()
+            self._hilo = None
+
+    def _bucle(self, engine):
+        while not self._detener.is_set():
+            try:
+                with Session(engine) as session:
+                    reconstruir_analitica(session)
+            except Exception:
+                log.exception("Falló la reconstrucción programada de la analítica.")
+            self._detener.wait(self.intervalo)
+
+
+programador_analitica = ProgramadorAnalitica()
+
+
+# --- endpoints (solo leen los resúmenes) ---
+
+@router.get("/estado", response_model=EstadoAnalitica, summary="Fecha y marca de la última reconstrucción")
+async def estado_analitica(session: AsyncSession = Depends(get_async_session)):
+    estado = await session.get(EstadoAnalitica, 1)
+    if estado is None:
+        raise HTTPException(status_code=404, detail="La analítica todavía no se ha generado.")
+    return estado
+
+
+@router.post("/reconstruir", response_model=EstadoAnalitica, summary="Reconstruir los resúmenes ahora")
+def reconstruir(forzar: bool = False, session: Session = Depends(get_session)):
+    """
+    Reconstruye los resúmenes si cambió alguna tabla de origen desde la última vez (o siempre con `forzar=true`).
+    """
+    return reconstruir_analitica(session, forzar)
+
+
+@router.get("/materias", response_model=List[ResumenMateria], summary="Matrículas y notas por materia")
+async def resumen_materias(request: Request, response: Response, session: AsyncSession = Depends(get_async_session), paginacion: Paginacion = Depends(obtener_paginacion)):
+    sin_cambios = await condicional_tablas(request, response, session, "resumenmateria")
+    if sin_cambios is not None:
+        return sin_cambios
+    return await paginar_rapido(session, ResumenMateria, [], paginacion, response)
+
+
+@router.get("/materias/{materia_id}", response_model=ResumenMateria, summary="Resumen de una materia")
+async def resumen_materia(materia_id: int, request: Request, response: Response, session: AsyncSession = Depends(get_async_session)):
+    sin_cambios = await condicional_tablas(request, response, session, "resumenmateria")
+    if sin_cambios is not None:
+        return sin_cambios
+    resumen = await session.get(ResumenMateria, materia_id)
+    if not resumen:
+        raise HTTPException(status_code=404, detail="Materia sin resumen (inactiva, inexistente o aún no procesada).")
+    return resumen
+
+
+@router.get("/semestres", response_model=List[ResumenSemestre], summary="Promedios por semestre")
+async def resumen_semestres(request: Request, response: Response, session: AsyncSession = Depends(get_async_session)):
+    sin_cambios = await condicional_tablas(request, response, session, "resumensemestre")
+    if sin_cambios is not None:
+        return sin_cambios
+    return (await session.exec(select(ResumenSemestre).order_by(ResumenSemestre.semestre))).all()
+
+
+@router.get("/profesores", response_model=List[CargaProfesor], summary="Carga de matrículas por profesor")
+async def carga_profesores(request: Request, response: Response, session: AsyncSession = Depends(get_async_session), paginacion: Paginacion = Depends(obtener_paginacion)):
+    sin_cambios = await condicional_tablas(request, response, session, "cargaprofesor")
+    if sin_cambios is not None:
+        return sin_cambios
+    return await paginar_rapido(session, CargaProfesor, [], paginacion, response)
+
+
+@router.get("/distribucion", response_model=List[DistribucionNotas], summary="Histograma de notas")
+async def distribucion_notas(
+    request: Request, response: Response, session: AsyncSession = Depends(get_async_session),
+    ambito: str = Query(default="global", pattern="^(global|materia|semestre)$"),
+    clave: int = Query(default=0, description="ID de la materia o número de semestre (0 para global)"),
+):
+    sin_cambios = await condicional_tablas(request, response, session, "distribucionnotas")
+    if sin_cambios is not None:
+        return sin_cambios
+    return (await session.exec(
+        select(DistribucionNotas).where(DistribucionNotas.ambito == ambito, DistribucionNotas.clave == clave).order_by(DistribucionNotas.desde)
+    )).all()
+
+
+if __name__ == "__main__":
+    from db import create_db_and_tables, engine
+
+    parser = argparse.ArgumentParser(description="Reconstruye los resúmenes de analítica (para programar con cron).")
+    parser.add_argument("--forzar", action="store_true", help="Reconstruir aunque las tablas de origen no hayan cambiado")
+    args = parser.parse_args()
+
+    create_db_and_tables()
+    with Session(engine) as session:
+        estado = reconstruir_analitica(session, args.forzar)
+    print(f"Analítica generada {estado.generado} ({estado.notas} notas, {estado.duracion_ms} ms), marca {estado.marca}")
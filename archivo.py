@@ -0,0 +1,212 @@
+import logging
+import os
+import threading
+from datetime import timedelta
+from typing import Optional, Tuple
+from fastapi import APIRouter, Depends, Query, Response
+from sqlalchemy import and_, delete, exists, insert, or_, select, union_all
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from cache import cache_catalogo
+from db import get_session
+from models import (
+    ListaEspera, Materia, MateriaArchivada, Matricula, MatriculaArchivada, MatriculaProfesorLink,
+    MatriculaProfesorLinkArchivado, Profesor, ProfesorArchivado, ResumenArchivo, ahora,
+)
+from paginacion import Paginacion, columnas_proyectadas, responder_pagina
+from metricas import RutaMedida
+
+
+# Días que una fila dada de baja sigue en su tabla antes de pasar al archivo.
+ARCHIVO_EDAD_DIAS = float(os.getenv("ARCHIVO_EDAD_DIAS", "30"))
+# Filas por transacción (una consulta IN por lote; SQLite antiguo admite 999 parámetros por sentencia).
+ARCHIVO_LOTE = int(os.getenv("ARCHIVO_LOTE", "500"))
+# Segundos entre pasadas del trabajo programado (0 = solo por el endpoint).
+ARCHIVO_INTERVALO_S = float(os.getenv("ARCHIVO_INTERVALO_S", "3600"))
+
+ARCHIVOS = {Matricula: MatriculaArchivada, Profesor: ProfesorArchivado, Materia: MateriaArchivada}
+ENLACES = MatriculaProfesorLink.__table__
+ENLACES_ARCHIVADOS = MatriculaProfesorLinkArchivado.__table__
+
+log = logging.getLogger("universidad.archivo")
+
+router = APIRouter(prefix="/archivo", tags=["Archivo"], route_class=RutaMedida)
+
+
+def _archivables(modelo) -> list:
+    """
+    Condiciones de las filas que pueden salir de la tabla viva, además de la edad de la baja.
+    Una materia sale cuando ninguna matrícula ni solicitud en espera la referencia, y un profesor
+    cuando ningún enlace lo hace: las matrículas dadas de baja se archivan antes que ellos.
+    """
+    tabla = modelo.__table__
+    condiciones = [tabla.c.active == False]
+    if modelo is Materia:
+        condiciones.append(~exists().where(Matricula.materia_id == tabla.c.id))
+        condiciones.append(~exists().where(ListaEspera.materia_id == tabla.c.id))
+    elif modelo is Profesor:
+        condiciones.append(~exists().where(ENLACES.c.profesor_id == tabla.c.id))
+    return condiciones
+
+
+def _mover_lote(session: Session, modelo, corte) -> Tuple[int, int, int]:
+    """
+    Mueve al archivo hasta ARCHIVO_LOTE filas dadas de baja antes de `corte` (con los enlaces de las matrículas)
+    en una transacción. Las filas salen con DELETE ... RETURNING y se insertan tal cual se borraron, así una fila
+    reactivada o movida por otro proceso mientras tanto nunca se duplica.
+    Devuelve (IDs elegidos, filas movidas, enlaces movidos).
+    """
+    tabla, archivo = modelo.__table__, ARCHIVOS[modelo].__table__
+    condiciones = _archivables(modelo) + [or_(tabla.c.updated_at.is_(None), tabla.c.updated_at < corte)]
+    conexion = session.connection()
+    ids = conexion.execute(
+        select(tabla.c.id).where(*condiciones).order_by(tabla.c.id).limit(ARCHIVO_LOTE).with_for_update()
+    ).scalars().all()
+    if not ids:
+        return 0, 0, 0
+
+    elegidas = and_(tabla.c.id.in_(ids), *condiciones)
+    enlaces = []
+    if modelo is Matricula:
+        # Los enlaces primero: mientras existan, la matrícula sigue referenciada.
+        enlaces = conexion.execute(
+            delete(ENLACES).where(ENLACES.c.matricula_id.in_(select(tabla.c.id).where(elegidas))).returning(*ENLACES.c)
+        ).mappings().all()
+    filas = conexion.execute(delete(tabla).where(elegidas).returning(*tabla.c)).mappings().all()
+    if filas:
+        momento = ahora()
+        conexion.execute(insert(archivo), [{**fila, "archivado": momento} for fila in filas])
+    if enlaces:
+        conexion.execute(insert(ENLACES_ARCHIVADOS), [dict(enlace) for enlace in enlaces])
+    session.commit()
+    return len(ids), len(filas), len(enlaces)
+
+
+def archivar(session: Session, edad_dias: float = ARCHIVO_EDAD_DIAS) -> ResumenArchivo:
+    """
+    Mueve al archivo las matrículas, profesores y materias dados de baja hace más de `edad_dias`, en lotes
+    de ARCHIVO_LOTE filas con una transacción corta cada uno. Las tablas vivas quedan solo con filas activas
+    y bajas recientes.
+    """
+    corte = ahora() - timedelta(days=edad_dias)
+    resumen = ResumenArchivo()
+    # Primero las matrículas: al salir liberan a las materias y profesores que referenciaban.
+    for modelo, campo in ((Matricula, "matriculas"), (Profesor, "profesores"), (Materia, "materias")):
+        while True:
+            elegidas, movidas, enlaces = _mover_lote(session, modelo, corte)
+            setattr(resumen, campo, getattr(resumen, campo) + movidas)
+            resumen.enlaces += enlaces
+            if elegidas < ARCHIVO_LOTE:
+                break
+    # Las entradas por ID de la cache también guardan materias y profesores dados de baja.
+    if resumen.profesores:
+        cache_catalogo.invalidar("profesor")
+    if resumen.materias:
+        cache_catalogo.invalidar("materia")
+    return resumen
+
+
+def desarchivar(session: Session, modelo, entidad_id: int) -> bool:
+    """
+    Devuelve a su tabla la fila archivada (sigue dada de baja). Con una matrícula vuelven sus enlaces
+    y, dados de baja, su materia y los profesores de esos enlaces si también se archivaron después.
+    Devuelve False si la fila no estaba archivada. Lanza IntegrityError si otra fila ocupa ahora su lugar
+    (mismo código de materia, o mismo estudiante y materia). La transacción queda abierta.
+    """
+    tabla, archivo = modelo.__table__, ARCHIVOS[modelo].__table__
+    conexion = session.connection()
+    filas = conexion.execute(
+        delete(archivo).where(archivo.c.id == entidad_id).returning(*[archivo.c[nombre] for nombre in tabla.columns.keys()])
+    ).mappings().all()
+    if not filas:
+        return False
+
+    enlaces = []
+    if modelo is Matricula:
+        for materia_id in sorted({fila["materia_id"] for fila in filas if fila["materia_id"] is not None}):
+            desarchivar(session, Materia, materia_id)
+        enlaces = conexion.execute(
+            delete(ENLACES_ARCHIVADOS).where(ENLACES_ARCHIVADOS.c.matricula_id == entidad_id).returning(*ENLACES_ARCHIVADOS.c)
+        ).mappings().all()
+        for profesor_id in sorted({enlace["profesor_id"] for enlace in enlaces}):
+            desarchivar(session, Profesor, profesor_id)
+    conexion.execute(insert(tabla), [dict(fila) for fila in filas])
+    if enlaces:
+        conexion.execute(insert(ENLACES), [dict(enlace) for enlace in enlaces])
+    return True
+
+
+async def paginar_eliminados(session: AsyncSession, modelo, paginacion: Paginacion, response: Response):
+    """
+    Listado de bajas: las recientes, que siguen en la tabla viva, y las archivadas, en una sola página
+    ordenada por ID. Es un UNION ALL de dos consultas por cursor, cada una limitada al tamaño de la página.
+    Admite `fields` igual que los demás listados.
+    """
+    tabla, archivo = modelo.__table__, ARCHIVOS[modelo].__table__
+    if paginacion.fields:
+        nombres = [columna.name for columna in columnas_proyectadas(modelo, paginacion.fields)]
+    else:
+        nombres = list(tabla.columns.keys())
+
+    def rama(origen, *condiciones):
+        consulta = select(*[origen.c[nombre] for nombre in nombres]).where(*condiciones)
+        if paginacion.after_id is not None:
+            consulta = consulta.where(origen.c.id > paginacion.after_id)
+        return select(consulta.order_by(origen.c.id).limit(paginacion.limit + 1).subquery())
+
+    bajas = union_all(rama(tabla, tabla.c.active == False), rama(archivo)).subquery()
+    filas = (await session.execute(select(bajas).order_by(bajas.c.id).limit(paginacion.limit + 1))).all()
+    # Las claves de las columnas del UNION son etiquetas de SQLAlchemy (subclase de str) que orjson no acepta.
+    items = [dict(zip(nombres, fila)) for fila in filas[:paginacion.limit]]
+    siguiente = filas[paginacion.limit - 1].id if len(filas) > paginacion.limit else None
+    return responder_pagina(items, siguiente, paginacion, response)
+
+
+class ProgramadorArchivo:
+    """
+    Hilo que cada `intervalo` segundos archiva las bajas antiguas.
+    Con varios workers cada uno lo ejecuta; el DELETE ... RETURNING hace que cada fila se mueva una sola vez.
+    """
+
+    def __init__(self, intervalo: float = ARCHIVO_INTERVALO_S):
+        self.intervalo = intervalo
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def iniciar(self, engine):
+        if self.intervalo <= 0:
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, args=(engine,), name="archivo", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join()
+            self._hilo = None
+
+    def _bucle(self, engine):
+        while not self._detener.wait(self.intervalo):
+            try:
+                with Session(engine) as session:
+                    resumen = archivar(session)
+                if any(resumen.model_dump().values()):
+                    log.info("Archivo: %s", resumen)
+            except Exception:
+                log.exception("Falló el archivo programado de bajas.")
+
+
+programador_archivo = ProgramadorArchivo()
+
+
+@router.post("/ejecutar", response_model=ResumenArchivo, summary="Archivar ahora las bajas antiguas")
+def ejecutar_archivo(
+    edad_dias: float = Query(default=ARCHIVO_EDAD_DIAS, ge=0, description="Antigüedad mínima de la baja, en días"),
+    session: Session = Depends(get_session),
+):
+    """
+    Mueve al archivo las matrículas, profesores y materias dados de baja hace más de `edad_dias`
+    y devuelve cuántas filas se movieron.
+    """
+    return archivar(session, edad_dias)
@@ -0,0 +1,364 @@
+"""
+Benchmark reproducible de la API: siembra una universidad sintética en una base SQLite temporal
+y mide cada endpoint en proceso (ASGI, sin red) y sobre uvicorn real (127.0.0.1).
+
+Por endpoint reporta peticiones por segundo, latencias p50/p95/p99, errores y consultas SQL por petición
+(medidas en proceso, una petición a la vez, para poder atribuir cada consulta a su petición).
+
+Uso:
+  python benchmark.py ejecutar --estudiantes 2000 --concurrencia 20 --salida resultados.json
+  python benchmark.py comparar base.json resultados.json --umbral 0.2
+  python benchmark.py arranque --workers 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+# La base de datos temporal debe definirse antes de importar db.
+_directorio = tempfile.mkdtemp(prefix="benchmark_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_directorio}/benchmark.db")
+os.environ.setdefault("CALIFICACIONES_DIARIO", f"{_directorio}/calificaciones_diario")
+os.environ.setdefault("CERTIFICADOS_CACHE", f"{_directorio}/certificados_cache")
+os.environ.setdefault("SERVIDOR_CACHE_COMPARTIDA", f"{_directorio}/cache_compartida")
+# Sin reconstrucciones de analítica en segundo plano durante las mediciones.
+os.environ.setdefault("ANALITICA_INTERVALO_S", "0")
+os.environ.setdefault("DB_PERFIL", "produccion")
+
+import httpx
+from sqlalchemy import event, insert
+from sqlmodel import Session
+from db import async_engine, create_db_and_tables, engine
+from models import Estudiante, Historial, Materia, Matricula, MatriculaProfesorLink, Profesor
+from promedios import recalcular_promedios
+
+
+DIRECTORIO_PROYECTO = os.path.dirname(os.path.abspath(__file__))
+
+
+def sembrar(estudiantes: int, materias: int, profesores: int, matriculas_por_estudiante: int, semilla: int) -> dict:
+    """
+    Inserta la universidad sintética con inserciones masivas. La misma semilla produce los mismos datos.
+    """
+    azar = random.Random(semilla)
+    create_db_and_tables()
+    with Session(engine) as session:
+        session.execute(insert(Estudiante), [
+            {"nombre": f"Estudiante {i}", "cedula": f"{10000000 + i}", "correo": f"estudiante{i}@uni.edu", "semestre": i % 10 + 1, "active": i % 50 != 0}
+            for i in range(1, estudiantes + 1)
+        ])
+        session.execute(insert(Materia), [
+            {"nombre": f"Materia {i}", "codigo": f"MAT-{i}", "creditos": i % 5 + 1, "active": True}
+            for i in range(1, materias + 1)
+        ])
+        session.execute(insert(Profesor), [
+            {"nombre": f"Profesor {i}", "especialidad": f"Área {i % 12}", "active": True}
+            for i in range(1, profesores + 1)
+        ])
+
+        matriculas, enlaces = [], []
+        for estudiante_id in range(1, estudiantes + 1):
+            for materia_id in azar.sample(range(1, materias + 1), min(matriculas_por_estudiante, materias)):
+                matriculas.append({
+                    "estudiante_id": estudiante_id,
+                    "materia_id": materia_id,
+                    "nota_final": round(azar.uniform(0, 5), 1) if azar.random() < 0.8 else None,
+                    "fecha_registro": date(2024, 1, 15) + timedelta(days=azar.randrange(365)),
+                    "active": azar.random() < 0.95,
+                })
+        session.execute(insert(Matricula), matriculas)
+        for matricula_id in range(1, len(matriculas) + 1):
+            for profesor_id in azar.sample(range(1, profesores + 1), min(azar.randint(1, 2), profesores)):
+                enlaces.append({"matricula_id": matricula_id, "profesor_id": profesor_id})
+        session.execute(insert(MatriculaProfesorLink), enlaces)
+        session.execute(insert(Historial), [{"estudiante_id": i} for i in range(1, estudiantes + 1)])
+        session.commit()
+        recalcular_promedios(session)
+
+    return {
+        "estudiantes": estudiantes,
+        "materias": materias,
+        "profesores": profesores,
+        "matriculas": len(matriculas),
+        "enlaces_profesor": len(enlaces),
+    }
+
+
+def escenarios(tamano: dict):
+    """
+    Un escenario por endpoint de cada router: (nombre, método, generador de (ruta, json)).
+    Los IDs se eligen al azar dentro de la universidad sembrada.
+    """
+    e, m, p, mt = tamano["estudiantes"], tamano["materias"], tamano["profesores"], tamano["matriculas"]
+    r = random.Random(7)
+    return [
+        ("GET /estudiantes/", "GET", lambda: (f"/estudiantes/estudiantes/?after_id={r.randrange(e)}&limit=50", None)),
+        ("GET /estudiantes/?semestre", "GET", lambda: (f"/estudiantes/estudiantes/?semestre={r.randint(1, 10)}&limit=50", None)),
+        ("GET /estudiantes/eliminados", "GET", lambda: ("/estudiantes/estudiantes/eliminados?limit=50", None)),
+        ("GET /estudiantes/{id}", "GET", lambda: (f"/estudiantes/estudiantes/{r.randint(1, e)}", None)),
+        ("GET /estudiantes/cedula/{cedula}", "GET", lambda: (f"/estudiantes/estudiantes/cedula/{10000000 + r.randint(1, e)}", None)),
+        ("GET /estudiantes/correo/{correo}", "GET", lambda: (f"/estudiantes/estudiantes/correo/estudiante{r.randint(1, e)}@uni.edu", None)),
+        ("GET /materias/", "GET", lambda: (f"/materias/materias/?creditos={r.randint(1, 5)}&limit=50", None)),
+        ("GET /materias/{id}", "GET", lambda: (f"/materias/materias/{r.randint(1, m)}", None)),
+        ("GET /materias/codigo/{codigo}", "GET", lambda: (f"/materias/materias/codigo/MAT-{r.randint(1, m)}", None)),
+        ("GET /profesores/", "GET", lambda: ("/profesores/profesores/?limit=50", None)),
+        ("GET /profesores/{id}", "GET", lambda: (f"/profesores/profesores/{r.randint(1, p)}", None)),
+        ("GET /matriculas/", "GET", lambda: (f"/matriculas/matriculas/?after_id={r.randrange(mt)}&limit=50", None)),
+        ("GET /matriculas/{id}", "GET", lambda: (f"/matriculas/matriculas/{r.randint(1, mt)}", None)),
+        ("GET /historiales/estudiante/{id}", "GET", lambda: (f"/historiales/historiales/estudiante/{r.randint(1, e)}", None)),
+        ("GET /reporte/estudiante/{id}", "GET", lambda: (f"/reporte/estudiante/{r.randint(1, e)}", None)),
+        ("GET /reporte/profesores", "GET", lambda: ("/reporte/profesores", None)),
+        ("PUT /matriculas/{id}", "PUT", lambda: (
+            f"/matriculas/matriculas/{r.randint(1, mt)}",
+            {"estudiante_id": 0, "materia_id": 0, "nota_final": round(r.uniform(0, 5), 1), "fecha_registro": "2024-06-01"},
+        )),
+    ]
+
+
+async def medir(cliente: httpx.AsyncClient, metodo: str, generar, peticiones: int, concurrencia: int) -> dict:
+    semaforo = asyncio.Semaphore(concurrencia)
+    latencias, errores = [], 0
+
+    async def una():
+        nonlocal errores
+        ruta, cuerpo = generar()
+        async with semaforo:
+            inicio = time.perf_counter()
+            respuesta = await cliente.request(metodo, ruta, json=cuerpo)
+            await respuesta.aread()
+            latencias.append(time.perf_counter() - inicio)
+            errores += respuesta.status_code >= 500
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(una() for _ in range(peticiones)))
+    total = time.perf_counter() - inicio
+
+    cuantiles = statistics.quantiles(latencias, n=100) if len(latencias) > 1 else latencias * 99
+    return {
+        "peticiones": peticiones,
+        "errores": errores,
+        "peticiones_por_segundo": round(peticiones / total, 1),
+        "p50_ms": round(cuantiles[49] * 1000, 2),
+        "p95_ms": round(cuantiles[94] * 1000, 2),
+        "p99_ms": round(cuantiles[98] * 1000, 2),
+    }
+
+
+async def contar_consultas(cliente: httpx.AsyncClient, metodo: str, generar, muestras: int) -> float:
+    """
+    Promedio de consultas SQL por petición, de a una petición por vez.
+    """
+    contador = [0]
+
+    def contar(*_):
+        contador[0] += 1
+
+    motores = (engine, async_engine.sync_engine)
+    for motor in motores:
+        event.listen(motor, "before_cursor_execute", contar)
+    try:
+        for _ in range(muestras):
+            ruta, cuerpo = generar()
+            await cliente.request(metodo, ruta, json=cuerpo)
+    finally:
+        for motor in motores:
+            event.remove(motor, "before_cursor_execute", contar)
+    return round(contador[0] / muestras, 2)
+
+
+async def correr(cliente: httpx.AsyncClient, modo: str, tamano: dict, args, consultas: dict) -> list:
+    resultados = []
+    for nombre, metodo, generar in escenarios(tamano):
+        await medir(cliente, metodo, generar, min(50, args.peticiones), args.concurrencia)  # calentamiento
+        if modo == "proceso":
+            consultas[nombre] = await contar_consultas(cliente, metodo, generar, 20)
+        resultado = {"modo": modo, "endpoint": nombre, **await medir(cliente, metodo, generar, args.peticiones, args.concurrencia)}
+        resultado["consultas_por_peticion"] = consultas.get(nombre)
+        print(json.dumps(resultado, ensure_ascii=False))
+        resultados.append(resultado)
+    return resultados
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as conexion:
+        conexion.bind(("127.0.0.1", 0))
+        return conexion.getsockname()[1]
+
+
+async def correr_uvicorn(tamano: dict, args, consultas: dict) -> list:
+    """
+    Levanta `uvicorn main:app` en un subproceso sobre la misma base sembrada y lo mide por HTTP local.
+    """
+    puerto = _puerto_libre()
+    servidor = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(puerto), "--log-level", "warning"],
+        cwd=DIRECTORIO_PROYECTO, env=os.environ.copy(),
+    )
+    try:
+        limites = httpx.Limits(max_connections=args.concurrencia)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{puerto}", limits=limites, timeout=60) as cliente:
+            for _ in range(100):
+                try:
+                    await cliente.get("/")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError("uvicorn no respondió")
+            return await correr(cliente, "uvicorn", tamano, args, consultas)
+    finally:
+        servidor.terminate()
+        servidor.wait()
+
+
+async def ejecutar(args):
+    import main
+
+    tamano = sembrar(args.estudiantes, args.materias, args.profesores, args.matriculas_por_estudiante, args.semilla)
+    print(json.dumps({"universidad": tamano}, ensure_ascii=False))
+
+    consultas, resultados = {}, []
+    if args.modo in ("proceso", "ambos"):
+        transporte = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://benchmark") as cliente:
+            resultados += await correr(cliente, "proceso", tamano, args, consultas)
+    if args.modo in ("uvicorn", "ambos"):
+        resultados += await correr_uvicorn(tamano, args, consultas)
+
+    if args.salida:
+        configuracion = {clave: valor for clave, valor in vars(args).items() if clave not in ("salida", "comando")}
+        with open(args.salida, "w", encoding="utf-8") as archivo:
+            json.dump({"configuracion": configuracion, "universidad": tamano, "resultados": resultados}, archivo, ensure_ascii=False, indent=2)
+
+
+async def _esperar_servidor(cliente: httpx.AsyncClient, servidor: subprocess.Popen, inicio: float) -> float:
+    """
+    Segundos desde `inicio` hasta que el servidor responde `GET /`.
+    """
+    while servidor.poll() is None:
+        try:
+            await cliente.get("/")
+            return time.perf_counter() - inicio
+        except httpx.TransportError:
+            await asyncio.sleep(0.02)
+    raise RuntimeError(f"El servidor terminó con código {servidor.returncode} antes de responder")
+
+
+async def arranque(args):
+    """
+    Mide cada forma de levantar la API con `--workers` procesos sobre la misma base sembrada: segundos hasta
+    la primera respuesta y, por cada GET de `escenarios`, la latencia de su primera petición y la mediana
+    de las siguientes. Las peticiones van por una sola conexión, así las atiende un mismo worker.
+    """
+    tamano = sembrar(args.estudiantes, args.materias, args.profesores, args.matriculas_por_estudiante, args.semilla)
+    print(json.dumps({"universidad": tamano}, ensure_ascii=False))
+    workers = str(args.workers)
+    modos = {
+        "uvicorn --workers": [sys.executable, "-m", "uvicorn", "main:app", "--workers", workers],
+        "servidor.py --sin-calentar": [sys.executable, "servidor.py", "--workers", workers, "--sin-calentar"],
+        "servidor.py": [sys.executable, "servidor.py", "--workers", workers],
+    }
+    for modo, comando in modos.items():
+        puerto = _puerto_libre()
+        inicio = time.perf_counter()
+        servidor = subprocess.Popen(
+            comando + ["--host", "127.0.0.1", "--port", str(puerto)],
+            cwd=DIRECTORIO_PROYECTO, env=os.environ.copy(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{puerto}", timeout=60) as cliente:
+                segundos = await _esperar_servidor(cliente, servidor, inicio)
+                primeras, estables = [], []
+                for nombre, metodo, generar in escenarios(tamano):
+                    if metodo != "GET":
+                        continue
+                    latencias = []
+                    for _ in range(1 + args.repeticiones):
+                        ruta, _cuerpo = generar()
+                        comienzo = time.perf_counter()
+                        await cliente.get(ruta)
+                        latencias.append((time.perf_counter() - comienzo) * 1000)
+                    primeras.append(latencias[0])
+                    estables.append(statistics.median(latencias[1:]))
+                    print(json.dumps({"modo": modo, "endpoint": nombre, "primera_ms": round(latencias[0], 2), "mediana_ms": round(estables[-1], 2)}, ensure_ascii=False))
+                print(json.dumps({
+                    "modo": modo,
+                    "workers": args.workers,
+                    "arranque_s": round(segundos, 2),
+                    "primera_total_ms": round(sum(primeras), 1),
+                    "mediana_total_ms": round(sum(estables), 1),
+                    # Mediana por endpoint de (primera - mediana): no la domina un solo endpoint lento y ruidoso.
+                    "penalizacion_primera_ms": round(statistics.median(p - e for p, e in zip(primeras, estables)), 2),
+                }, ensure_ascii=False))
+        finally:
+            servidor.terminate()
+            servidor.wait()
+
+
+def comparar(args) -> int:
+    """
+    Compara dos archivos de resultados y falla si el p95 o las consultas por petición
+    de algún endpoint empeoraron más que `umbral` (fracción).
+    """
+    with open(args.base, encoding="utf-8") as archivo:
+        base = {(r["modo"], r["endpoint"]): r for r in json.load(archivo)["resultados"]}
+    with open(args.actual, encoding="utf-8") as archivo:
+        actual = {(r["modo"], r["endpoint"]): r for r in json.load(archivo)["resultados"]}
+
+    regresiones = 0
+    for clave in sorted(base.keys() & actual.keys()):
+        for metrica in ("p95_ms", "consultas_por_peticion"):
+            antes, despues = base[clave][metrica], actual[clave][metrica]
+            if not antes or despues is None:
+                continue
+            cambio = (despues - antes) / antes
+            marca = "REGRESIÓN" if cambio > args.umbral else ""
+            regresiones += bool(marca)
+            print(f"{clave[0]:8} {clave[1]:38} {metrica:22} {antes:>9} -> {despues:>9} ({cambio:+.0%}) {marca}")
+    return 1 if regresiones else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subcomandos = parser.add_subparsers(dest="comando", required=True)
+
+    ejecucion = subcomandos.add_parser("ejecutar", help="Siembra la base y mide todos los endpoints")
+    ejecucion.add_argument("--estudiantes", type=int, default=2000)
+    ejecucion.add_argument("--materias", type=int, default=200)
+    ejecucion.add_argument("--profesores", type=int, default=100)
+    ejecucion.add_argument("--matriculas-por-estudiante", type=int, default=6)
+    ejecucion.add_argument("--semilla", type=int, default=42)
+    ejecucion.add_argument("--peticiones", type=int, default=500, help="Peticiones medidas por endpoint")
+    ejecucion.add_argument("--concurrencia", type=int, default=20)
+    ejecucion.add_argument("--modo", choices=("proceso", "uvicorn", "ambos"), default="ambos")
+    ejecucion.add_argument("--salida", help="Archivo JSON con los resultados")
+
+    medicion_arranque = subcomandos.add_parser("arranque", help="Mide el arranque y la primera petición de cada forma de levantar la API")
+    medicion_arranque.add_argument("--estudiantes", type=int, default=2000)
+    medicion_arranque.add_argument("--materias", type=int, default=200)
+    medicion_arranque.add_argument("--profesores", type=int, default=100)
+    medicion_arranque.add_argument("--matriculas-por-estudiante", type=int, default=6)
+    medicion_arranque.add_argument("--semilla", type=int, default=42)
+    medicion_arranque.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    medicion_arranque.add_argument("--repeticiones", type=int, default=20, help="Peticiones tras la primera, por endpoint")
+
+    comparacion = subcomandos.add_parser("comparar", help="Compara dos resultados y falla ante regresiones")
+    comparacion.add_argument("base")
+    comparacion.add_argument("actual")
+    comparacion.add_argument("--umbral", type=float, default=0.2)
+
+    args = parser.parse_args()
+    if args.comando == "ejecutar":
+        asyncio.run(ejecutar(args))
+    elif args.comando == "arranque":
+        asyncio.run(arranque(args))
+    else:
+        sys.exit(comparar(args))
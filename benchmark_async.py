@@ -0,0 +1,102 @@
+"""
+Compara el camino síncrono (Session en el threadpool) con el async (AsyncSession en el event loop)
+ejecutando la misma consulta a alta concurrencia, en proceso y sin red.
+
+Con concurrencia mayor que el threadpool (40 hilos) el camino síncrono se bloquea: los hilos esperan
+una conexión del pool mientras las conexiones las retienen peticiones que esperan un hilo para serializar
+la respuesta. Esas peticiones fallan por DB_POOL_TIMEOUT y se cuentan como errores.
+
+Uso: python benchmark_async.py --peticiones 4000 --concurrencia 200
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+# La base de datos temporal debe definirse antes de importar db.
+_directorio = tempfile.mkdtemp(prefix="bench_async_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_directorio}/bench.db")
+os.environ.setdefault("DB_PERFIL", "produccion")
+os.environ.setdefault("DB_POOL_TIMEOUT", "5")
+
+import httpx
+from fastapi import Depends, FastAPI, HTTPException
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db import create_db_and_tables, engine, get_async_session, get_session
+from models import Materia
+
+
+app = FastAPI()
+
+
+@app.get("/sync/materias/{materia_id}", response_model=Materia)
+def materia_sync(materia_id: int, session: Session = Depends(get_session)):
+    materia = session.get(Materia, materia_id)
+    if not materia:
+        raise HTTPException(status_code=404)
+    return materia
+
+
+@app.get("/async/materias/{materia_id}", response_model=Materia)
+async def materia_async(materia_id: int, session: AsyncSession = Depends(get_async_session)):
+    materia = await session.get(Materia, materia_id)
+    if not materia:
+        raise HTTPException(status_code=404)
+    return materia
+
+
+def sembrar(cantidad: int):
+    create_db_and_tables()
+    with Session(engine) as session:
+        session.add_all([Materia(nombre=f"Materia {i}", codigo=f"BENCH-{i}", creditos=i % 5 + 1) for i in range(cantidad)])
+        session.commit()
+
+
+async def medir(ruta: str, peticiones: int, concurrencia: int, materias: int) -> dict:
+    semaforo = asyncio.Semaphore(concurrencia)
+    latencias = []
+    errores = 0
+    transporte = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+
+    async with httpx.AsyncClient(transport=transporte, base_url="http://bench") as cliente:
+        async def una(i: int):
+            nonlocal errores
+            async with semaforo:
+                inicio = time.perf_counter()
+                respuesta = await cliente.get(f"{ruta}/{i % materias + 1}")
+                latencias.append(time.perf_counter() - inicio)
+                errores += respuesta.status_code != 200
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(una(i) for i in range(peticiones)))
+        total = time.perf_counter() - inicio
+
+    cuantiles = statistics.quantiles(latencias, n=100)
+    return {
+        "ruta": ruta,
+        "errores": errores,
+        "peticiones_por_segundo": round(peticiones / total, 1),
+        "p50_ms": round(cuantiles[49] * 1000, 2),
+        "p95_ms": round(cuantiles[94] * 1000, 2),
+        "p99_ms": round(cuantiles[98] * 1000, 2),
+    }
+
+
+async def principal(args):
+    for ruta in ("/sync/materias", "/async/materias"):
+        await medir(ruta, min(200, args.peticiones), args.concurrencia, args.materias)  # calentamiento
+        print(await medir(ruta, args.peticiones, args.concurrencia, args.materias))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--peticiones", type=int, default=4000)
+    parser.add_argument("--concurrencia", type=int, default=200)
+    parser.add_argument("--materias", type=int, default=1000)
+    args = parser.parse_args()
+
+    sembrar(args.materias)
+    asyncio.run(principal(args))
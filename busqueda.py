@@ -0,0 +1,204 @@
+import logging
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import List, Tuple
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import column, func, literal_column, table
+from sqlalchemy.engine import Engine
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db import get_async_session
+from models import Estudiante, Materia, Profesor
+from metricas import RutaMedida
+
+
+LIMITE_BUSQUEDA = 20
+LIMITE_BUSQUEDA_MAXIMO = 100
+# Prefijos indexados por FTS5: con 2 y 3 letras el autocompletado no recorre el vocabulario completo.
+PREFIJOS_INDEXADOS = "2 3"
+
+log = logging.getLogger("universidad.busqueda")
+
+router = APIRouter(prefix="/busqueda", tags=["Búsqueda"], route_class=RutaMedida)
+
+
+@dataclass(frozen=True)
+class IndiceBusqueda:
+    """
+    Columnas de texto de una tabla que se indexan para la búsqueda por nombre.
+    SQLite: tabla virtual FTS5 de contenido externo (`busqueda_<tabla>`) sincronizada por triggers.
+    PostgreSQL: índice GIN de trigramas sobre las columnas concatenadas, en minúsculas y sin tildes.
+    """
+    modelo: type
+    columnas: Tuple[str, ...]
+
+    @property
+    def tabla(self) -> str:
+        return self.modelo.__tablename__
+
+    @property
+    def tabla_fts(self) -> str:
+        return f"busqueda_{self.tabla}"
+
+    @property
+    def expresion_pg(self) -> str:
+        concatenadas = " || ' ' || ".join(f"coalesce({nombre}, '')" for nombre in self.columnas)
+        return f"f_unaccent(lower({concatenadas}))"
+
+
+INDICES = {
+    "estudiantes": IndiceBusqueda(Estudiante, ("nombre",)),
+    "materias": IndiceBusqueda(Materia, ("nombre", "codigo")),
+    "profesores": IndiceBusqueda(Profesor, ("nombre", "especialidad")),
+}
+
+# Se activa al crear los índices en el arranque; sin ellos la búsqueda responde 503 en vez de recorrer tablas.
+_disponible = False
+
+
+def _ddl_sqlite(indice: IndiceBusqueda) -> List[str]:
+    columnas = ", ".join(indice.columnas)
+    nuevas = ", ".join(f"new.{nombre}" for nombre in indice.columnas)
+    viejas = ", ".join(f"old.{nombre}" for nombre in indice.columnas)
+    fts, tabla = indice.tabla_fts, indice.tabla
+    borrar = f"INSERT INTO {fts}({fts}, rowid, {columnas}) VALUES ('delete', old.id, {viejas});"
+    insertar = f"INSERT INTO {fts}(rowid, {columnas}) VALUES (new.id, {nuevas});"
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {tabla} BEGIN {insertar} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {tabla} BEGIN {borrar} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {columnas} ON {tabla} BEGIN {borrar} {insertar} END",
+    ]
+
+
+def _crear_sqlite(conexion):
+    existentes = {fila[0] for fila in conexion.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for indice in INDICES.values():
+        if indice.tabla_fts not in existentes:
+            conexion.exec_driver_sql(
+                f"CREATE VIRTUAL TABLE {indice.tabla_fts} USING fts5({', '.join(indice.columnas)}, "
+                f"content='{indice.tabla}', content_rowid='id', "
+                f"tokenize='unicode61 remove_diacritics 2', prefix='{PREFIJOS_INDEXADOS}')"
+            )
+            # Base existente: se indexan una sola vez las filas que ya estaban.
+            conexion.exec_driver_sql(f"INSERT INTO {indice.tabla_fts}({indice.tabla_fts}) VALUES ('rebuild')")
+        for sentencia in _ddl_sqlite(indice):
+            conexion.exec_driver_sql(sentencia)
+
+
+def _crear_postgresql(conexion):
+    conexion.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    conexion.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS unaccent")
+    # unaccent() no es IMMUTABLE y no se puede indexar: se envuelve fijando el diccionario.
+    conexion.exec_driver_sql(
+        "CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT "
+        "AS $$ SELECT public.unaccent('public.unaccent', $1) $$"
+    )
+    for indice in INDICES.values():
+        conexion.exec_driver_sql(
+            f"CREATE INDEX IF NOT EXISTS ix_{indice.tabla_fts}_trgm ON {indice.tabla} USING gin (({indice.expresion_pg}) gin_trgm_ops)"
+        )
+
+
+def crear_indices_busqueda(engine: Engine) -> bool:
+    """
+    Crea (si faltan) los índices de búsqueda y sus triggers. Devuelve False, sin interrumpir el arranque,
+    si el motor no los soporta (SQLite sin FTS5, PostgreSQL sin permiso para crear extensiones, otros motores).
+    """
+    global _disponible
+    creadores = {"sqlite": _crear_sqlite, "postgresql": _crear_postgresql}
+    crear = creadores.get(engine.dialect.name)
+    if crear is None:
+        log.warning("La búsqueda por nombre no está soportada para la base de datos '%s'.", engine.dialect.name)
+        return False
+    try:
+        with engine.begin() as conexion:
+            crear(conexion)
+    except Exception:
+        log.exception("No se pudieron crear los índices de búsqueda; GET /busqueda responderá 503.")
+        return False
+    _disponible = True
+    return True
+
+
+def normalizar(texto: str) -> List[str]:
+    """
+    Parte el texto en palabras en minúsculas y sin tildes (igual que el tokenizador del índice).
+    """
+    sin_tildes = "".join(c for c in unicodedata.normalize("NFKD", texto) if not unicodedata.combining(c))
+    return re.findall(r"[^\W_]+", sin_tildes.lower())
+
+
+def consulta_busqueda(indice: IndiceBusqueda, dialecto: str, palabras: List[str], limite: int):
+    """
+    SELECT de las filas activas que contienen todas las palabras (la última como prefijo, para el
+    autocompletado mientras se escribe), ordenadas por relevancia.
+    """
+    modelo = indice.modelo
+    if dialecto == "sqlite":
+        # "ana" "mar"* : cada palabra completa y la última como prefijo; bm25 (rank) ordena.
+        expresion = " ".join(f'"{palabra}"' for palabra in palabras[:-1]) + f' "{palabras[-1]}"*'
+        fts = table(indice.tabla_fts, column("rowid"), column("rank"))
+        # El mejor puntaje se elige dentro de FTS5 (sin unir todas las coincidencias con la tabla) y solo esas
+        # filas se leen; se piden de más para que las dadas de baja no dejen la página corta.
+        mejores = (
+            select(fts.c.rowid, fts.c.rank)
+            .where(literal_column(indice.tabla_fts).op("MATCH")(expresion.strip()))
+            .order_by(fts.c.rank)
+            .limit(limite * 2)
+            .subquery()
+        )
+        return (
+            select(modelo)
+            .join(mejores, mejores.c.rowid == modelo.id)
+            .where(modelo.active == True)
+            .order_by(mejores.c.rank, modelo.id)
+            .limit(limite)
+        )
+
+    texto = literal_column(indice.expresion_pg)
+    return (
+        select(modelo)
+        .where(*[texto.like(f"%{palabra}%") for palabra in palabras], modelo.active == True)
+        .order_by(func.word_similarity(" ".join(palabras), texto).desc(), modelo.id)
+        .limit(limite)
+    )
+
+
+async def buscar(session: AsyncSession, entidad: str, q: str, limit: int):
+    """
+    - Retorna 400 si el texto no tiene ninguna palabra.
+    - Retorna 503 si la base de datos no tiene los índices de búsqueda.
+    """
+    if not _disponible:
+        raise HTTPException(status_code=503, detail="La búsqueda no está disponible en esta base de datos.")
+    palabras = normalizar(q)
+    if not palabras:
+        raise HTTPException(status_code=400, detail="El texto de búsqueda debe contener al menos una letra o número.")
+    statement = consulta_busqueda(INDICES[entidad], session.bind.dialect.name, palabras, limit)
+    return (await session.exec(statement)).all()
+
+
+def _parametros(
+    q: str = Query(..., min_length=1, max_length=100, description="Texto a buscar; la última palabra se toma como prefijo"),
+    limit: int = Query(default=LIMITE_BUSQUEDA, ge=1, le=LIMITE_BUSQUEDA_MAXIMO),
+) -> Tuple[str, int]:
+    return q, limit
+
+
+@router.get("/estudiantes", response_model=List[Estudiante], summary="Buscar estudiantes por nombre")
+async def buscar_estudiantes(parametros: Tuple[str, int] = Depends(_parametros), session: AsyncSession = Depends(get_async_session)):
+    """
+    Búsqueda por nombre sin distinguir mayúsculas ni tildes, ordenada por relevancia (solo activos).
+    """
+    return await buscar(session, "estudiantes", *parametros)
+
+
+@router.get("/materias", response_model=List[Materia], summary="Buscar materias por nombre o código")
+async def buscar_materias(parametros: Tuple[str, int] = Depends(_parametros), session: AsyncSession = Depends(get_async_session)):
+    return await buscar(session, "materias", *parametros)
+
+
+@router.get("/profesores", response_model=List[Profesor], summary="Buscar profesores por nombre o especialidad")
+async def buscar_profesores(parametros: Tuple[str, int] = Depends(_parametros), session: AsyncSession = Depends(get_async_session)):
+    return await buscar(session, "profesores", *parametros)
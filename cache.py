@@ -0,0 +1,233 @@
+import glob
+import hashlib
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from fastapi import APIRouter
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo de archivos se asume un solo proceso.
+    fcntl = None
+
+
+CACHE_TTL_SEGUNDOS = float(os.getenv("CACHE_TTL_SEGUNDOS", "60"))
+CACHE_MAX_ENTRADAS = int(os.getenv("CACHE_MAX_ENTRADAS", "10000"))
+# Directorio del almacén compartido por los procesos de la máquina (vacío = cada proceso usa su memoria).
+# servidor.py lo define al lanzar varios workers.
+CACHE_COMPARTIDA_DIR = os.getenv("CACHE_COMPARTIDA_DIR", "")
+# Escrituras entre dos purgas de las entradas vencidas del almacén compartido.
+_ESCRITURAS_POR_PURGA = 1000
+
+router = APIRouter(prefix="/cache", tags=["Cache"])
+
+
+class BackendLocal:
+    """
+    Almacén en memoria del proceso con expiración (TTL) y desalojo LRU al superar `max_entradas`.
+    Un backend compartido (p. ej. Redis) debe ofrecer los mismos métodos:
+    obtener, guardar, contador e incrementar.
+    """
+
+    def __init__(self, max_entradas: int = CACHE_MAX_ENTRADAS, ttl: float = CACHE_TTL_SEGUNDOS):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._datos: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._contadores: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def obtener(self, clave: str) -> Tuple[bool, Any]:
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return False, None
+            expira, valor = entrada
+            if expira < time.monotonic():
+                del self._datos[clave]
+                return False, None
+            self._datos.move_to_end(clave)
+            return True, valor
+
+    def guardar(self, clave: str, valor: Any, ttl: Optional[float] = None):
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + (self.ttl if ttl is None else ttl), valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def contador(self, clave: str) -> int:
+        with self._lock:
+            return self._contadores.get(clave, 0)
+
+    def incrementar(self, clave: str) -> int:
+        """
+        Contadores sin expiración ni desalojo (se usan para las generaciones de invalidación).
+        """
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + 1
+            return self._contadores[clave]
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+
+class BackendArchivos:
+    """
+    Almacén compartido por los procesos de una máquina (los workers de servidor.py), con la interfaz de
+    `BackendLocal`: un archivo por entrada en `directorio`, escrito de forma atómica (temporal + os.replace).
+    Las entradas vencidas se borran al leerlas y en una purga cada _ESCRITURAS_POR_PURGA escrituras, que
+    además deja como máximo `max_entradas` (las más viejas salen primero). Los contadores se incrementan
+    con un bloqueo de archivo.
+    """
+
+    def __init__(self, directorio: str, max_entradas: int = CACHE_MAX_ENTRADAS, ttl: float = CACHE_TTL_SEGUNDOS):
+        self.directorio = directorio
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._entradas = os.path.join(directorio, "entradas")
+        self._contadores = os.path.join(directorio, "contadores")
+        os.makedirs(self._entradas, exist_ok=True)
+        os.makedirs(self._contadores, exist_ok=True)
+        self._escrituras = 0
+
+    @staticmethod
+    def _nombre(clave: str) -> str:
+        return hashlib.blake2b(clave.encode(), digest_size=16).hexdigest()
+
+    def obtener(self, clave: str) -> Tuple[bool, Any]:
+        ruta = os.path.join(self._entradas, self._nombre(clave))
+        try:
+            with open(ruta, "rb") as archivo:
+                expira, valor = pickle.load(archivo)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return False, None
+        if expira < time.time():
+            _eliminar(ruta)
+            return False, None
+        return True, valor
+
+    def guardar(self, clave: str, valor: Any, ttl: Optional[float] = None):
+        ruta = os.path.join(self._entradas, self._nombre(clave))
+        temporal = f"{ruta}.{uuid.uuid4().hex}.tmp"
+        with open(temporal, "wb") as archivo:
+            pickle.dump((time.time() + (self.ttl if ttl is None else ttl), valor), archivo, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporal, ruta)
+        self._escrituras += 1
+        if self._escrituras % _ESCRITURAS_POR_PURGA == 0:
+            self.purgar()
+
+    def purgar(self):
+        ahora = time.time()
+        vigentes = []
+        for ruta in glob.glob(os.path.join(self._entradas, "*")):
+            try:
+                with open(ruta, "rb") as archivo:
+                    expira, _ = pickle.load(archivo)
+                modificada = os.path.getmtime(ruta)
+            except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+                continue
+            if expira < ahora:
+                _eliminar(ruta)
+            else:
+                vigentes.append((modificada, ruta))
+        for _, ruta in sorted(vigentes)[:max(0, len(vigentes) - self.max_entradas)]:
+            _eliminar(ruta)
+
+    def contador(self, clave: str) -> int:
+        try:
+            with open(os.path.join(self._contadores, self._nombre(clave)), encoding="utf-8") as archivo:
+                return int(archivo.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def incrementar(self, clave: str) -> int:
+        ruta = os.path.join(self._contadores, self._nombre(clave))
+        with open(ruta + ".lock", "a") as bloqueo:
+            if fcntl is not None:
+                fcntl.flock(bloqueo.fileno(), fcntl.LOCK_EX)
+            valor = self.contador(clave) + 1
+            temporal = f"{ruta}.tmp"
+            with open(temporal, "w", encoding="utf-8") as archivo:
+                archivo.write(str(valor))
+            os.replace(temporal, ruta)
+        return valor
+
+    def limpiar(self):
+        for ruta in glob.glob(os.path.join(self._entradas, "*")):
+            _eliminar(ruta)
+
+
+def _eliminar(ruta: str):
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
+
+
+def crear_backend(nombre: str, **opciones):
+    """
+    Backend de un almacén: compartido en CACHE_COMPARTIDA_DIR/<nombre> si está definido, si no en memoria.
+    """
+    if CACHE_COMPARTIDA_DIR:
+        return BackendArchivos(os.path.join(CACHE_COMPARTIDA_DIR, nombre), **opciones)
+    return BackendLocal(**opciones)
+
+
+class CacheCatalogo:
+    """
+    Cache de lectura (read-through) para el catálogo: materias y profesores.
+    Las claves se agrupan por espacio ("materia", "profesor") y cada espacio tiene una generación;
+    invalidar un espacio incrementa su generación, así todas sus entradas (por ID, código o filtros)
+    quedan obsoletas a la vez sin recorrer el almacén, también en un backend compartido.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or crear_backend("catalogo")
+        self.aciertos = 0
+        self.fallos = 0
+        self.invalidaciones = 0
+
+    def clave(self, espacio: str, clave: str) -> str:
+        """
+        Clave completa con la generación vigente. Se calcula una sola vez antes de leer la base de datos
+        y se reutiliza al guardar: si una escritura invalida el espacio mientras tanto,
+        el valor leído queda guardado bajo la generación vieja y nunca se sirve.
+        """
+        return f"{espacio}:{self.backend.contador(f'generacion:{espacio}')}:{clave}"
+
+    def obtener(self, clave: str) -> Tuple[bool, Any]:
+        encontrado, valor = self.backend.obtener(clave)
+        if encontrado:
+            self.aciertos += 1
+        else:
+            self.fallos += 1
+        return encontrado, valor
+
+    def guardar(self, clave: str, valor: Any):
+        self.backend.guardar(clave, valor)
+
+    def invalidar(self, espacio: str):
+        self.backend.incrementar(f"generacion:{espacio}")
+        self.invalidaciones += 1
+
+    def estadisticas(self) -> dict:
+        consultas = self.aciertos + self.fallos
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "invalidaciones": self.invalidaciones,
+            "tasa_aciertos": round(self.aciertos / consultas, 4) if consultas else 0.0,
+        }
+
+
+cache_catalogo = CacheCatalogo()
+
+
+@router.get("/estadisticas", summary="Aciertos y fallos de la cache del catálogo")
+def estadisticas_cache():
+    return cache_catalogo.estadisticas()
@@ -0,0 +1,450 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+from fastapi import APIRouter, Body, HTTPException
+from sqlalchemy import bindparam, update
+from sqlmodel import Session, select
+from models import CalificacionCreate, EstadoAcuse, Matricula, ahora
+from metricas import RutaMedida
+from promedios import recalcular_promedios
+from cambios import ACTUALIZAR, registrar_cambios
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo de archivos se asume un solo proceso.
+    fcntl = None
+
+
+# Disparadores del volcado: lo que ocurra primero entre tamaño del lote y tiempo desde el último volcado.
+CALIFICACIONES_LOTE = int(os.getenv("CALIFICACIONES_LOTE", "500"))
+CALIFICACIONES_INTERVALO_MS = float(os.getenv("CALIFICACIONES_INTERVALO_MS", "200"))
+# Notas en cola a partir de las cuales se rechazan envíos nuevos (503) hasta que el volcado se ponga al día.
+CALIFICACIONES_MAX_PENDIENTES = int(os.getenv("CALIFICACIONES_MAX_PENDIENTES", "100000"))
+CALIFICACIONES_MAX_ACUSES = int(os.getenv("CALIFICACIONES_MAX_ACUSES", "10000"))
+# Directorio del diario: un archivo por proceso con las notas aceptadas y aún no escritas.
+CALIFICACIONES_DIARIO = os.getenv("CALIFICACIONES_DIARIO", "./calificaciones_diario")
+# Horas que se conserva en disco el estado de un acuse (se borran los más viejos al iniciar la cola).
+CALIFICACIONES_ACUSES_HORAS = float(os.getenv("CALIFICACIONES_ACUSES_HORAS", "24"))
+
+# Límite de parámetros por IN (SQLite admite 999 en versiones antiguas).
+_BLOQUE_IN = 500
+
+MATRICULA = Matricula.__table__
+
+_ACTUALIZAR_NOTA = (
+    update(MATRICULA)
+    .where(MATRICULA.c.id == bindparam("m_id"), MATRICULA.c.active == True)
+    .values(nota_final=bindparam("nota"), version=MATRICULA.c.version + 1, updated_at=bindparam("momento"))
+)
+
+log = logging.getLogger("universidad.calificaciones")
+
+router = APIRouter(prefix="/calificaciones", tags=["Calificaciones"], route_class=RutaMedida)
+
+
+def aplicar_calificaciones(session: Session, notas: Dict[int, Optional[float]]) -> Set[int]:
+    """
+    Escribe un lote de notas (matricula_id -> nota) en una sola transacción: un UPDATE executemany
+    y la reconstrucción de los promedios de los estudiantes afectados. Hace commit.
+    Devuelve los IDs rechazados (matrículas inexistentes o dadas de baja), que no se escriben.
+    """
+    ids = list(notas)
+    estudiantes: Dict[int, int] = {}
+    for inicio in range(0, len(ids), _BLOQUE_IN):
+        filas = session.exec(
+            select(Matricula.id, Matricula.estudiante_id).where(Matricula.id.in_(ids[inicio:inicio + _BLOQUE_IN]), Matricula.active == True)
+        ).all()
+        estudiantes.update({matricula_id: estudiante_id for matricula_id, estudiante_id in filas})
+
+    if estudiantes:
+        momento = ahora()
+        session.connection().execute(
+            _ACTUALIZAR_NOTA, [{"m_id": matricula_id, "nota": notas[matricula_id], "momento": momento} for matricula_id in estudiantes]
+        )
+        registrar_cambios(session, Matricula, estudiantes, ACTUALIZAR)
+        recalcular_promedios(session, set(estudiantes.values()))
+    return set(notas) - set(estudiantes)
+
+
+class _Acuse:
+    __slots__ = ("total", "pendientes", "aplicadas", "reemplazadas", "rechazadas")
+
+    def __init__(self, total: int):
+        self.total = total
+        self.pendientes = total
+        self.aplicadas = 0
+        self.reemplazadas = 0
+        self.rechazadas: List[int] = []
+
+
+class ColaCalificaciones:
+    """
+    Cola write-behind de notas. Cada envío se agrega al diario (con fsync) antes de responder, se agrupa
+    por matrícula (la última nota gana y la anterior queda como "reemplazada") y un hilo la vuelca a la
+    base en lotes de hasta `tamano_lote` o cada `intervalo` segundos. Tras cada volcado el diario se
+    reescribe solo con lo que sigue pendiente; al arrancar se reproducen los diarios de procesos caídos.
+    El estado de cada acuse se escribe también en `directorio/acuses` (como el de los trabajos de certificados),
+    así cualquier worker responde el sondeo aunque el envío lo haya recibido otro.
+    """
+
+    def __init__(self, directorio: str = CALIFICACIONES_DIARIO, tamano_lote: int = CALIFICACIONES_LOTE,
+                 intervalo: float = CALIFICACIONES_INTERVALO_MS / 1000):
+        self.directorio = directorio
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._hay_lote = threading.Condition(self._lock)
+        self._volcando = threading.Lock()
+        self._persistiendo = threading.Lock()
+        self._pendientes: Dict[int, Tuple[Optional[float], str]] = {}
+        self._acuses: "OrderedDict[str, _Acuse]" = OrderedDict()
+        # Acuses cuyo estado cambió y todavía no se escribió en disco.
+        self._sucios: Set[str] = set()
+        self._engine = None
+        self._hilo: Optional[threading.Thread] = None
+        self._detener = False
+        self._diario = None
+        self._bloqueo = None
+        self._ruta = ""
+        self.lotes = 0
+        self.escritas = 0
+        self.reemplazadas = 0
+        self.errores = 0
+        self.ultimo_lote_ms = 0.0
+
+    # --- ciclo de vida ---
+
+    def iniciar(self, engine):
+        """
+        Toma el diario de este proceso, incorpora los de procesos que ya no están (sin bloqueo vivo),
+        vuelca lo recuperado y arranca el hilo de volcado.
+        """
+        os.makedirs(self._directorio_acuses(), exist_ok=True)
+        _borrar_anteriores(self._directorio_acuses(), time.time() - CALIFICACIONES_ACUSES_HORAS * 3600)
+        self._engine = engine
+        self._detener = False
+        propio = os.path.join(self.directorio, str(os.getpid()))
+        self._bloqueo = _bloquear(propio + ".lock")
+
+        huerfanos = []
+        for nombre in sorted(os.listdir(self.directorio)):
+            base, extension = os.path.splitext(nombre)
+            if extension != ".jsonl":
+                continue
+            ruta = os.path.join(self.directorio, base)
+            bloqueo = self._bloqueo if ruta == propio else _bloquear(ruta + ".lock")
+            if bloqueo is None:
+                continue  # otro proceso vivo
+            self._reproducir(ruta + ".jsonl")
+            if ruta != propio:
+                huerfanos.append((ruta, bloqueo))
+
+        with self._lock:
+            self._ruta = propio + ".jsonl"
+            self._compactar_diario()
+        # Lo recuperado ya quedó en el diario propio: los huérfanos se pueden borrar.
+        for ruta, bloqueo in huerfanos:
+            _eliminar(ruta + ".jsonl")
+            bloqueo.close()
+            _eliminar(ruta + ".lock")
+
+        self.vaciar()
+        self._hilo = threading.Thread(target=self._bucle, name="cola-calificaciones", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        """
+        Detiene el hilo y hace un último volcado. Si no quedó nada pendiente, borra el diario
+        (el directorio queda: conserva el estado de los acuses).
+        """
+        with self._lock:
+            self._detener = True
+            self._hay_lote.notify()
+        if self._hilo is not None:
+            self._hilo.join()
+            self._hilo = None
+        self.vaciar()
+        with self._lock:
+            if self._diario is not None:
+                self._diario.close()
+                self._diario = None
+            if not self._pendientes:
+                _eliminar(self._ruta)
+        if self._bloqueo is not None:
+            self._bloqueo.close()
+            self._bloqueo = None
+            _eliminar(self._ruta[:-len(".jsonl")] + ".lock")
+
+    def _bucle(self):
+        while True:
+            with self._lock:
+                self._hay_lote.wait_for(lambda: self._detener or len(self._pendientes) >= self.tamano_lote, timeout=self.intervalo)
+                if self._detener:
+                    return
+            self.vaciar()
+
+    # --- envío y consulta ---
+
+    def encolar(self, calificaciones: List[CalificacionCreate]) -> EstadoAcuse:
+        """
+        Registra el envío en el diario y en la cola. Al retornar, las notas sobreviven a una caída del proceso.
+        """
+        acuse_id = uuid.uuid4().hex
+        notas = {calificacion.matricula_id: calificacion.nota_final for calificacion in calificaciones}
+        linea = json.dumps({"acuse": acuse_id, "notas": list(notas.items())}) + "\n"
+        with self._lock:
+            if self._diario is None:
+                raise RuntimeError("La cola de calificaciones no está iniciada.")
+            self._diario.write(linea)
+            self._diario.flush()
+            os.fsync(self._diario.fileno())
+            self._registrar(acuse_id, notas)
+            if len(self._pendientes) >= self.tamano_lote:
+                self._hay_lote.notify()
+            estado = self._estado(acuse_id)
+        self._persistir()
+        return estado
+
+    def consultar(self, acuse_id: str) -> Optional[EstadoAcuse]:
+        """
+        Estado del acuse: de memoria si lo recibió este proceso, si no del disco (lo recibió otro worker).
+        """
+        with self._lock:
+            if acuse_id in self._acuses:
+                return self._estado(acuse_id)
+        if not acuse_id.isalnum():
+            return None
+        try:
+            with open(os.path.join(self._directorio_acuses(), f"{acuse_id}.json"), encoding="utf-8") as archivo:
+                return EstadoAcuse.model_validate_json(archivo.read())
+        except FileNotFoundError:
+            return None
+
+    def en_cola(self) -> int:
+        with self._lock:
+            return len(self._pendientes)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "en_cola": len(self._pendientes),
+                "lotes": self.lotes,
+                "escritas": self.escritas,
+                "reemplazadas": self.reemplazadas,
+                "errores": self.errores,
+                "ultimo_lote_ms": round(self.ultimo_lote_ms, 3),
+                "tamano_lote": self.tamano_lote,
+                "intervalo_ms": self.intervalo * 1000,
+            }
+
+    # --- volcado ---
+
+    def vaciar(self) -> int:
+        """
+        Vuelca a la base todo lo pendiente en lotes de `tamano_lote`. Devuelve las notas escritas o rechazadas.
+        Si un lote falla, sus notas vuelven a la cola (salvo las que otro envío reemplazó mientras tanto).
+        """
+        procesadas = 0
+        with self._volcando:
+            while True:
+                with self._lock:
+                    if not self._pendientes:
+                        if procesadas:
+                            self._compactar_diario()
+                        return procesadas
+                    ids = list(self._pendientes)[:self.tamano_lote]
+                    lote = {matricula_id: self._pendientes.pop(matricula_id) for matricula_id in ids}
+
+                inicio = time.perf_counter()
+                try:
+                    with Session(self._engine) as session:
+                        rechazadas = aplicar_calificaciones(session, {matricula_id: nota for matricula_id, (nota, _) in lote.items()})
+                except Exception:
+                    log.exception("No se pudo volcar un lote de %d calificaciones; se reintentará.", len(lote))
+                    with self._lock:
+                        self.errores += 1
+                        for matricula_id, (nota, acuse_id) in lote.items():
+                            if matricula_id in self._pendientes:
+                                self._reemplazar(acuse_id)
+                            else:
+                                self._pendientes[matricula_id] = (nota, acuse_id)
+                    if procesadas:
+                        self._compactar_diario()
+                    self._persistir()
+                    return procesadas
+
+                with self._lock:
+                    for matricula_id, (_, acuse_id) in lote.items():
+                        acuse = self._acuses.get(acuse_id)
+                        if acuse is None:
+                            continue
+                        self._sucios.add(acuse_id)
+                        acuse.pendientes -= 1
+                        if matricula_id in rechazadas:
+                            acuse.rechazadas.append(matricula_id)
+                        else:
+                            acuse.aplicadas += 1
+                    self.lotes += 1
+                    self.escritas += len(lote) - len(rechazadas)
+                    self.ultimo_lote_ms = (time.perf_counter() - inicio) * 1000
+                self._persistir()
+                procesadas += len(lote)
+
+    def _directorio_acuses(self) -> str:
+        return os.path.join(self.directorio, "acuses")
+
+    def _persistir(self):
+        """
+        Escribe en disco (temporal + os.replace) el estado de los acuses que cambiaron. Las escrituras
+        se serializan para que un estado más viejo nunca pise a uno más nuevo del mismo acuse.
+        """
+        with self._persistiendo:
+            with self._lock:
+                estados = [self._estado(acuse_id) for acuse_id in self._sucios if acuse_id in self._acuses]
+                self._sucios.clear()
+            for estado in estados:
+                ruta = os.path.join(self._directorio_acuses(), f"{estado.acuse_id}.json")
+                temporal = f"{ruta}.tmp"
+                with open(temporal, "w", encoding="utf-8") as archivo:
+                    archivo.write(estado.model_dump_json())
+                os.replace(temporal, ruta)
+
+    # --- internos (con self._lock tomado) ---
+
+    def _registrar(self, acuse_id: str, notas: Dict[int, Optional[float]]):
+        self._acuses[acuse_id] = _Acuse(len(notas))
+        self._sucios.add(acuse_id)
+        while len(self._acuses) > CALIFICACIONES_MAX_ACUSES:
+            descartado, _ = self._acuses.popitem(last=False)
+            self._sucios.discard(descartado)
+            _eliminar(os.path.join(self._directorio_acuses(), f"{descartado}.json"))
+        for matricula_id, nota in notas.items():
+            anterior = self._pendientes.pop(matricula_id, None)
+            if anterior is not None:
+                self._reemplazar(anterior[1])
+            self._pendientes[matricula_id] = (nota, acuse_id)
+
+    def _reemplazar(self, acuse_id: str):
+        self.reemplazadas += 1
+        acuse = self._acuses.get(acuse_id)
+        if acuse is not None:
+            self._sucios.add(acuse_id)
+            acuse.pendientes -= 1
+            acuse.reemplazadas += 1
+
+    def _estado(self, acuse_id: str) -> EstadoAcuse:
+        acuse = self._acuses[acuse_id]
+        return EstadoAcuse(
+            acuse_id=acuse_id,
+            estado="pendiente" if acuse.pendientes else "aplicado",
+            total=acuse.total,
+            pendientes=acuse.pendientes,
+            aplicadas=acuse.aplicadas,
+            reemplazadas=acuse.reemplazadas,
+            rechazadas=list(acuse.rechazadas),
+        )
+
+    def _reproducir(self, ruta: str):
+        """
+        Reincorpora a la cola los envíos de un diario. Una última línea truncada (caída a mitad de
+        escritura) corresponde a un envío que nunca se confirmó y se descarta.
+        """
+        try:
+            with open(ruta, encoding="utf-8") as archivo:
+                lineas = archivo.readlines()
+        except FileNotFoundError:
+            return
+        with self._lock:
+            for linea in lineas:
+                try:
+                    registro = json.loads(linea)
+                except ValueError:
+                    log.warning("Línea inválida en el diario %s; se descarta.", ruta)
+                    continue
+                self._registrar(registro["acuse"], {int(matricula_id): nota for matricula_id, nota in registro["notas"]})
+
+    def _compactar_diario(self):
+        """
+        Reescribe el diario con las notas aún pendientes (agrupadas por acuse) de forma atómica:
+        archivo temporal, fsync y os.replace. Hasta entonces una caída solo hace que se reapliquen notas ya escritas.
+        """
+        por_acuse: Dict[str, list] = {}
+        for matricula_id, (nota, acuse_id) in self._pendientes.items():
+            por_acuse.setdefault(acuse_id, []).append([matricula_id, nota])
+
+        temporal = self._ruta + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as archivo:
+            for acuse_id, notas in por_acuse.items():
+                archivo.write(json.dumps({"acuse": acuse_id, "notas": notas}) + "\n")
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        if self._diario is not None:
+            self._diario.close()
+        os.replace(temporal, self._ruta)
+        self._diario = open(self._ruta, "a", encoding="utf-8")
+
+
+def _bloquear(ruta: str):
+    """
+    Abre y bloquea en exclusiva el archivo de bloqueo de un diario. Devuelve None si otro proceso lo tiene.
+    """
+    archivo = open(ruta, "a")
+    if fcntl is not None:
+        try:
+            fcntl.flock(archivo.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            archivo.close()
+            return None
+    return archivo
+
+
+def _eliminar(ruta: str):
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
+
+
+def _borrar_anteriores(directorio: str, limite: float):
+    for nombre in os.listdir(directorio):
+        ruta = os.path.join(directorio, nombre)
+        try:
+            if os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+        except FileNotFoundError:
+            pass
+
+
+cola_calificaciones = ColaCalificaciones()
+
+
+@router.post("/", response_model=EstadoAcuse, status_code=202, summary="Registrar notas finales (escritura diferida)")
+def registrar_calificaciones(calificaciones: List[CalificacionCreate] = Body(..., min_length=1)):
+    """
+    Acepta un lote de notas `{matricula_id, nota_final}` y responde de inmediato con un `acuse_id`.
+    Las notas quedan en un diario local y se escriben en la base en lotes (ver `GET /calificaciones/{acuse_id}`).
+    - Si una matrícula recibe varias notas antes del volcado, solo se escribe la última.
+    - Las matrículas inexistentes o dadas de baja aparecen en `rechazadas` al aplicarse.
+    - Retorna 503 si la cola está llena.
+    """
+    if cola_calificaciones.en_cola() >= CALIFICACIONES_MAX_PENDIENTES:
+        raise HTTPException(status_code=503, detail="Hay demasiadas calificaciones en cola; intente más tarde.", headers={"Retry-After": "1"})
+    return cola_calificaciones.encolar(calificaciones)
+
+
+@router.get("/estadisticas", summary="Estado de la cola de calificaciones")
+def estadisticas_calificaciones():
+    return cola_calificaciones.estadisticas()
+
+
+@router.get("/{acuse_id}", response_model=EstadoAcuse, summary="Consultar un envío de notas")
+def consultar_calificaciones(acuse_id: str):
+    estado = cola_calificaciones.consultar(acuse_id)
+    if estado is None:
+        raise HTTPException(status_code=404, detail="Acuse no encontrado")
+    return estado
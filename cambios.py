@@ -0,0 +1,277 @@
+import asyncio
+import logging
+import os
+from datetime import timedelta
+from typing import Iterable, List, Optional, Set, Tuple
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import event, func, inspect, insert
+from sqlalchemy.orm import Session as SessionORM
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db import DATABASE_URL, async_engine, get_async_session
+from models import Cambio, Estudiante, Materia, Matricula, Profesor, ahora
+from etag import condicional_tablas
+from metricas import RutaMedida
+from paginacion import CABECERA_CURSOR, LIMITE_MAXIMO, LIMITE_POR_DEFECTO
+
+
+CREAR, ACTUALIZAR, BAJA, ELIMINAR = "crear", "actualizar", "baja", "eliminar"
+
+# Entidades publicadas. El historial no se publica: sus promedios se derivan de las matrículas.
+ENTIDADES = (Estudiante, Materia, Profesor, Matricula)
+TABLAS = {modelo.__tablename__ for modelo in ENTIDADES}
+
+# Cada cuánto la única lectura del proceso busca cambios nuevos para los suscriptores del stream.
+CAMBIOS_INTERVALO_S = float(os.getenv("CAMBIOS_INTERVALO_S", "0.5"))
+# Comentario SSE periódico para que proxies y balanceadores no corten la conexión inactiva.
+CAMBIOS_LATIDO_S = float(os.getenv("CAMBIOS_LATIDO_S", "15"))
+# Eventos pendientes por suscriptor: uno más lento que esto se desconecta y se pone al día al reconectar.
+CAMBIOS_MAX_PENDIENTES = int(os.getenv("CAMBIOS_MAX_PENDIENTES", "10000"))
+CAMBIOS_LOTE = 1000
+# Espera sugerida al navegador antes de reconectar (campo `retry` de SSE).
+CAMBIOS_REINTENTO_MS = 2000
+# En PostgreSQL los IDs de la secuencia no se confirman en orden: solo se entregan los cambios con
+# esta antigüedad, para no saltar uno con ID menor cuya transacción todavía no terminó.
+# SQLite tiene un solo escritor, así que el orden de los IDs es el de confirmación.
+CAMBIOS_MARGEN_S = float(os.getenv("CAMBIOS_MARGEN_S", "0" if DATABASE_URL.startswith("sqlite") else "2"))
+
+CAMBIOS = Cambio.__table__
+
+log = logging.getLogger("universidad.cambios")
+
+router = APIRouter(prefix="/cambios", tags=["Cambios"], route_class=RutaMedida)
+
+
+def registrar_cambios(session: SessionORM, modelo, ids: Iterable[int], operacion: str):
+    """
+    Registra cambios hechos con sentencias masivas (fuera del ORM), en la transacción abierta de la sesión.
+    Las escrituras del ORM se registran solas (ver `_registrar_cambios_orm`).
+    """
+    momento = ahora()
+    filas = [{"tabla": modelo.__tablename__, "entidad_id": entidad_id, "operacion": operacion, "momento": momento} for entidad_id in ids]
+    if filas:
+        session.connection().execute(insert(CAMBIOS), filas)
+
+
+def _operacion_modificacion(objeto) -> str:
+    historia = inspect(objeto).attrs.active.history
+    return BAJA if list(historia.added) == [False] else ACTUALIZAR
+
+
+@event.listens_for(SessionORM, "after_flush")
+def _registrar_cambios_orm(session, flush_context):
+    """
+    Cada flush agrega al registro las entidades publicadas que insertó, modificó o borró
+    (incluidas las matrículas borradas en cascada con su estudiante), en la misma transacción.
+    """
+    momento = ahora()
+    filas = []
+    for objeto in session.new:
+        if isinstance(objeto, ENTIDADES):
+            filas.append((objeto, objeto.id, CREAR))
+    for objeto in session.dirty:
+        if isinstance(objeto, ENTIDADES) and session.is_modified(objeto, include_collections=False):
+            filas.append((objeto, inspect(objeto).identity[0], _operacion_modificacion(objeto)))
+    for objeto in session.deleted:
+        if isinstance(objeto, ENTIDADES):
+            filas.append((objeto, inspect(objeto).identity[0], ELIMINAR))
+    if filas:
+        session.connection().execute(
+            insert(CAMBIOS),
+            [{"tabla": objeto.__tablename__, "entidad_id": entidad_id, "operacion": operacion, "momento": momento} for objeto, entidad_id, operacion in filas],
+        )
+
+
+def _tablas(tabla: Optional[str]) -> Optional[Set[str]]:
+    """
+    - Retorna 400 Bad Request si alguna tabla pedida no se publica.
+    """
+    if not tabla:
+        return None
+    pedidas = {nombre.strip() for nombre in tabla.split(",") if nombre.strip()}
+    desconocidas = pedidas - TABLAS
+    if desconocidas:
+        raise HTTPException(status_code=400, detail=f"Tablas no publicadas: {', '.join(sorted(desconocidas))}. Use: {', '.join(sorted(TABLAS))}")
+    return pedidas
+
+
+async def leer_cambios(session: AsyncSession, desde: int, tablas: Optional[Set[str]] = None, limite: int = CAMBIOS_LOTE) -> List[Cambio]:
+    """
+    Cambios con ID mayor a `desde` en orden de secuencia (recorrido por la clave primaria o por ix_cambio_tabla_id).
+    """
+    statement = select(Cambio).where(Cambio.id > desde)
+    if tablas:
+        statement = statement.where(Cambio.tabla.in_(tablas))
+    if CAMBIOS_MARGEN_S:
+        statement = statement.where(Cambio.momento <= ahora() - timedelta(seconds=CAMBIOS_MARGEN_S))
+    return list((await session.exec(statement.order_by(Cambio.id).limit(limite))).all())
+
+
+async def ultimo_cambio() -> int:
+    async with AsyncSession(async_engine) as session:
+        return (await session.exec(select(func.coalesce(func.max(Cambio.id), 0)))).one()
+
+
+def _evento(cambio: Cambio) -> str:
+    return f"id: {cambio.id}\nevent: cambio\ndata: {cambio.model_dump_json()}\n\n"
+
+
+class _Suscriptor:
+    def __init__(self):
+        self.cola: "asyncio.Queue[Optional[Tuple[int, str, str]]]" = asyncio.Queue()
+        self.desbordado = False
+
+
+class DifusorCambios:
+    """
+    Reparte los cambios nuevos a todos los streams abiertos del proceso con una sola lectura periódica
+    de la tabla (y no una por suscriptor). Cada evento se serializa una vez para todos.
+    La lectura arranca con el primer suscriptor y se detiene cuando no queda ninguno.
+    """
+
+    def __init__(self, intervalo: float = CAMBIOS_INTERVALO_S, max_pendientes: int = CAMBIOS_MAX_PENDIENTES):
+        self.intervalo = intervalo
+        self.max_pendientes = max_pendientes
+        self._suscriptores: Set[_Suscriptor] = set()
+        self._tarea: Optional[asyncio.Task] = None
+        self._listo: Optional[asyncio.Event] = None
+        self._ultimo = 0
+
+    @property
+    def suscriptores(self) -> int:
+        return len(self._suscriptores)
+
+    async def suscribir(self) -> _Suscriptor:
+        suscriptor = _Suscriptor()
+        self._suscriptores.add(suscriptor)
+        if self._tarea is None or self._tarea.done() or self._tarea.get_loop() is not asyncio.get_running_loop():
+            self._listo = asyncio.Event()
+            self._tarea = asyncio.create_task(self._seguir())
+        # Hasta que la lectura compartida fije su posición inicial, la puesta al día del suscriptor podría
+        # terminar antes y dejar un hueco entre ambas.
+        await self._listo.wait()
+        return suscriptor
+
+    def desuscribir(self, suscriptor: _Suscriptor):
+        self._suscriptores.discard(suscriptor)
+
+    async def _seguir(self):
+        # Los suscriptores se ponen al día por su cuenta desde la base: la lectura compartida arranca en el último cambio.
+        while not self._listo.is_set():
+            try:
+                self._ultimo = await ultimo_cambio()
+                self._listo.set()
+            except Exception:
+                log.exception("No se pudo leer el último cambio; se reintenta.")
+                await asyncio.sleep(self.intervalo)
+        while self._suscriptores:
+            try:
+                async with AsyncSession(async_engine) as session:
+                    cambios = await leer_cambios(session, self._ultimo)
+            except Exception:
+                log.exception("No se pudieron leer los cambios; se reintenta.")
+                cambios = []
+            if cambios:
+                self._ultimo = cambios[-1].id
+                self._repartir([(cambio.id, cambio.tabla, _evento(cambio)) for cambio in cambios])
+            if len(cambios) < CAMBIOS_LOTE:
+                await asyncio.sleep(self.intervalo)
+
+    def _repartir(self, eventos: List[Tuple[int, str, str]]):
+        for suscriptor in list(self._suscriptores):
+            if suscriptor.cola.qsize() + len(eventos) > self.max_pendientes:
+                suscriptor.desbordado = True
+                self._suscriptores.discard(suscriptor)
+                suscriptor.cola.put_nowait(None)
+                continue
+            for evento in eventos:
+                suscriptor.cola.put_nowait(evento)
+
+
+difusor_cambios = DifusorCambios()
+
+
+async def _stream(desde: Optional[int], tablas: Optional[Set[str]]):
+    suscriptor = await difusor_cambios.suscribir()
+    try:
+        # Primero se entrega desde la base lo anterior a la suscripción; lo que llegue mientras tanto
+        # queda en la cola y se descarta si ya se envió (IDs <= ultimo).
+        ultimo = await ultimo_cambio() if desde is None else desde
+        while True:
+            async with AsyncSession(async_engine) as session:
+                pendientes = await leer_cambios(session, ultimo, tablas)
+            for cambio in pendientes:
+                yield _evento(cambio)
+            if pendientes:
+                ultimo = pendientes[-1].id
+            if len(pendientes) < CAMBIOS_LOTE:
+                break
+        yield f"retry: {CAMBIOS_REINTENTO_MS}\n\n"
+
+        while True:
+            try:
+                evento = await asyncio.wait_for(suscriptor.cola.get(), CAMBIOS_LATIDO_S)
+            except asyncio.TimeoutError:
+                yield ": latido\n\n"
+                continue
+            if evento is None:
+                # Cliente demasiado lento: se cierra el stream y al reconectar (Last-Event-ID) se pone al día desde la base.
+                return
+            cambio_id, tabla, texto = evento
+            if cambio_id <= ultimo or (tablas and tabla not in tablas):
+                continue
+            ultimo = cambio_id
+            yield texto
+    finally:
+        difusor_cambios.desuscribir(suscriptor)
+
+
+@router.get("/", response_model=List[Cambio], summary="Cambios posteriores a una secuencia")
+async def listar_cambios(
+    request: Request,
+    response: Response,
+    since: int = Query(default=0, ge=0, description="Devuelve los cambios con ID (secuencia) mayor a este valor"),
+    tabla: Optional[str] = Query(default=None, description="Tablas separadas por coma (estudiante, materia, profesor, matricula)"),
+    limit: int = Query(default=LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Altas, modificaciones, bajas lógicas y borrados físicos en orden de secuencia, para que los sistemas
+    externos lean solo lo que cambió. Guardar el `id` del último cambio recibido y usarlo como `since`.
+    Si hay más cambios, la cabecera X-Next-Cursor trae el `since` de la siguiente página.
+    Responde 304 con If-None-Match si no hubo cambios desde la consulta anterior (solo sin CAMBIOS_MARGEN_S).
+    - Retorna 400 Bad Request si alguna tabla no se publica.
+    """
+    tablas = _tablas(tabla)
+    # Con margen, una respuesta puede omitir cambios ya confirmados que aún no cumplen la antigüedad; la marca
+    # de la tabla no cambia cuando la cumplen, así que un 304 los ocultaría hasta la siguiente escritura.
+    if not CAMBIOS_MARGEN_S:
+        sin_cambios = await condicional_tablas(request, response, session, CAMBIOS.name)
+        if sin_cambios is not None:
+            return sin_cambios
+    cambios = await leer_cambios(session, since, tablas, limit + 1)
+    if len(cambios) > limit:
+        response.headers[CABECERA_CURSOR] = str(cambios[limit - 1].id)
+    return cambios[:limit]
+
+
+@router.get("/stream", summary="Stream de cambios (Server-Sent Events)")
+async def stream_cambios(
+    since: Optional[int] = Query(default=None, ge=0, description="Entrega primero los cambios posteriores a esta secuencia; sin valor, solo los nuevos"),
+    tabla: Optional[str] = Query(default=None, description="Tablas separadas por coma (estudiante, materia, profesor, matricula)"),
+    last_event_id: Optional[int] = Header(default=None, ge=0, description="Enviada por el navegador al reconectar; tiene prioridad sobre `since`"),
+):
+    """
+    Stream `text/event-stream` con un evento `cambio` por fila del registro (`id:` es la secuencia).
+    Todos los streams del proceso comparten una sola lectura periódica de la base.
+    Al reconectar con Last-Event-ID se reciben los cambios perdidos antes de los nuevos.
+    - Retorna 400 Bad Request si alguna tabla no se publica.
+    """
+    tablas = _tablas(tabla)
+    desde = last_event_id if last_event_id is not None else since
+    return StreamingResponse(
+        _stream(desde, tablas),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,374 @@
+import asyncio
+import glob
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+import zipfile
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from xml.sax.saxutils import escape
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import FileResponse
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import cm
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db import async_engine, get_async_session
+from etag import condicional
+from models import EstadoTrabajoCertificados, Estudiante, Matricula, ahora
+from metricas import RutaMedida
+
+
+CERTIFICADOS_CACHE = os.getenv("CERTIFICADOS_CACHE", "./certificados_cache")
+CERTIFICADOS_PROCESOS = int(os.getenv("CERTIFICADOS_PROCESOS", str(min(4, os.cpu_count() or 1))))
+# Horas que se conservan el estado y el zip de un trabajo por semestre.
+CERTIFICADOS_TRABAJOS_HORAS = float(os.getenv("CERTIFICADOS_TRABAJOS_HORAS", "24"))
+# Cambiarla invalida todos los PDF en cache (p. ej. al modificar el diseño).
+VERSION_PLANTILLA = "1"
+# Estudiantes que un trabajo por semestre carga y envía a renderizar a la vez.
+LOTE_TRABAJO = 200
+
+log = logging.getLogger("universidad.certificados")
+
+router = APIRouter(prefix="/reporte/certificados", tags=["Reportes"], route_class=RutaMedida)
+
+_procesos: Optional[ProcessPoolExecutor] = None
+# Renderizados en curso por archivo destino: peticiones simultáneas del mismo certificado esperan uno solo.
+_en_curso: Dict[str, asyncio.Future] = {}
+_trabajos_activos = set()
+
+
+def _pool() -> ProcessPoolExecutor:
+    """
+    Pool de procesos creado al primer uso. Se usa "spawn": hacer fork de un servidor con hilos
+    (threadpool, cola de calificaciones) puede heredar locks tomados.
+    """
+    global _procesos
+    if _procesos is None:
+        _procesos = ProcessPoolExecutor(max_workers=CERTIFICADOS_PROCESOS, mp_context=multiprocessing.get_context("spawn"))
+    return _procesos
+
+
+def cerrar_procesos():
+    global _procesos
+    if _procesos is not None:
+        _procesos.shutdown(wait=False, cancel_futures=True)
+        _procesos = None
+
+
+# --- datos y clave de cache ---
+
+def _consulta_certificados():
+    return select(Estudiante).options(
+        selectinload(Estudiante.matriculas).selectinload(Matricula.materia),
+        selectinload(Estudiante.matriculas).selectinload(Matricula.profesores),
+        selectinload(Estudiante.historial),
+    )
+
+
+def datos_certificado(estudiante: Estudiante) -> dict:
+    """
+    Todo lo que se imprime en el certificado, como datos planos (se envían al proceso que renderiza).
+    """
+    historial = estudiante.historial
+    matriculas = sorted((m for m in estudiante.matriculas if m.active), key=lambda m: (m.fecha_registro or date.min, m.id))
+    return {
+        "id": estudiante.id,
+        "nombre": estudiante.nombre,
+        "cedula": estudiante.cedula,
+        "correo": estudiante.correo,
+        "semestre": estudiante.semestre,
+        "nota_promedio": historial.nota_promedio if historial else None,
+        "promedio_ponderado": historial.promedio_ponderado if historial else None,
+        "matriculas": [
+            {
+                "materia": m.materia.nombre if m.materia else "Materia eliminada",
+                "codigo": m.materia.codigo if m.materia else None,
+                "creditos": m.materia.creditos if m.materia else None,
+                "nota_final": m.nota_final,
+                "fecha_registro": m.fecha_registro.isoformat() if m.fecha_registro else None,
+                "profesores": sorted(p.nombre or "" for p in m.profesores),
+            }
+            for m in matriculas
+        ],
+    }
+
+
+def clave_certificado(datos: dict) -> str:
+    """
+    Versión de los datos del certificado: huella del contenido más la versión de la plantilla.
+    Cubre también lo que no tiene columna de versión propia (enlaces matrícula-profesor).
+    """
+    contenido = json.dumps([VERSION_PLANTILLA, datos], sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(contenido.encode(), digest_size=12).hexdigest()
+
+
+# --- renderizado (corre en el pool de procesos) ---
+
+def _numero(valor, decimales: int = 2) -> str:
+    return "—" if valor is None else f"{valor:.{decimales}f}"
+
+
+def renderizar_certificado(datos: dict) -> bytes:
+    estilos = getSampleStyleSheet()
+    buffer = io.BytesIO()
+    documento = SimpleDocTemplate(
+        buffer, pagesize=letter, title=f"Certificado de notas - {datos['nombre'] or datos['id']}",
+        leftMargin=2 * cm, rightMargin=2 * cm, topMargin=2 * cm, bottomMargin=2 * cm,
+    )
+    texto = lambda valor: escape(str(valor)) if valor is not None else "—"
+
+    contenido = [
+        Paragraph("Universidad — Certificado de notas", estilos["Title"]),
+        Paragraph(f"<b>Estudiante:</b> {texto(datos['nombre'])}", estilos["Normal"]),
+        Paragraph(f"<b>Cédula:</b> {texto(datos['cedula'])} &nbsp;&nbsp; <b>Correo:</b> {texto(datos['correo'])}", estilos["Normal"]),
+        Paragraph(f"<b>Semestre:</b> {texto(datos['semestre'])}", estilos["Normal"]),
+        Spacer(1, 0.6 * cm),
+    ]
+
+    filas = [["Materia", "Código", "Créditos", "Nota", "Fecha", "Profesores"]]
+    for matricula in datos["matriculas"]:
+        filas.append([
+            Paragraph(texto(matricula["materia"]), estilos["BodyText"]),
+            texto(matricula["codigo"]),
+            texto(matricula["creditos"]),
+            _numero(matricula["nota_final"], 1),
+            texto(matricula["fecha_registro"]),
+            Paragraph(texto(", ".join(matricula["profesores"]) or None), estilos["BodyText"]),
+        ])
+    tabla = Table(filas, colWidths=[5 * cm, 2.2 * cm, 1.8 * cm, 1.4 * cm, 2.4 * cm, 4.2 * cm], repeatRows=1)
+    tabla.setStyle(TableStyle([
+        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#1f3b63")),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+        ("GRID", (0, 0), (-1, -1), 0.4, colors.grey),
+        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+        ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.white, colors.HexColor("#eef2f7")]),
+    ]))
+    contenido += [
+        tabla if datos["matriculas"] else Paragraph("Sin matrículas activas.", estilos["Italic"]),
+        Spacer(1, 0.6 * cm),
+        Paragraph(f"<b>Promedio:</b> {_numero(datos['nota_promedio'])} &nbsp;&nbsp; "
+                  f"<b>Promedio ponderado:</b> {_numero(datos['promedio_ponderado'])}", estilos["Normal"]),
+    ]
+    documento.build(contenido)
+    return buffer.getvalue()
+
+
+# --- cache en disco ---
+
+def _ruta_certificado(estudiante_id: int, clave: str) -> str:
+    return os.path.join(CERTIFICADOS_CACHE, f"{estudiante_id}-{clave}.pdf")
+
+
+def _guardar_pdf(ruta: str, estudiante_id: int, contenido: bytes):
+    """
+    Escritura atómica (temporal + os.replace) y borrado de las versiones anteriores del mismo estudiante.
+    """
+    os.makedirs(CERTIFICADOS_CACHE, exist_ok=True)
+    temporal = f"{ruta}.{uuid.uuid4().hex}.tmp"
+    with open(temporal, "wb") as archivo:
+        archivo.write(contenido)
+    os.replace(temporal, ruta)
+    for anterior in glob.glob(os.path.join(CERTIFICADOS_CACHE, f"{estudiante_id}-*.pdf")):
+        if anterior != ruta:
+            try:
+                os.remove(anterior)
+            except FileNotFoundError:
+                pass
+
+
+async def _renderizar_y_guardar(datos: dict, ruta: str):
+    bucle = asyncio.get_running_loop()
+    contenido = await bucle.run_in_executor(_pool(), renderizar_certificado, datos)
+    await bucle.run_in_executor(None, _guardar_pdf, ruta, datos["id"], contenido)
+
+
+async def obtener_certificado(datos: dict) -> Tuple[str, bool]:
+    """
+    Ruta del PDF para estos datos, renderizándolo solo si no está en cache.
+    Devuelve (ruta, reutilizado).
+    """
+    ruta = _ruta_certificado(datos["id"], clave_certificado(datos))
+    if os.path.exists(ruta):
+        return ruta, True
+    tarea = _en_curso.get(ruta)
+    if tarea is None:
+        tarea = _en_curso[ruta] = asyncio.ensure_future(_renderizar_y_guardar(datos, ruta))
+        tarea.add_done_callback(lambda _: _en_curso.pop(ruta, None))
+    # shield: si el cliente se desconecta, el renderizado termina igual y queda en cache.
+    await asyncio.shield(tarea)
+    return ruta, False
+
+
+async def certificado_estudiante(session: AsyncSession, estudiante_id: int, request: Request, response: Response):
+    """
+    Respuesta PDF de `/reporte/estudiante/{id}?format=pdf`. El ETag es la clave de cache del certificado.
+    - Retorna 404 Not Found si el estudiante no existe.
+    """
+    estudiante = (await session.exec(_consulta_certificados().where(Estudiante.id == estudiante_id))).first()
+    if not estudiante:
+        raise HTTPException(status_code=404, detail="Estudiante no encontrado.")
+    datos = datos_certificado(estudiante)
+    sin_cambios = condicional(request, response, f'"certificado-{clave_certificado(datos)}"')
+    if sin_cambios is not None:
+        return sin_cambios
+    ruta, _ = await obtener_certificado(datos)
+    return FileResponse(ruta, media_type="application/pdf", filename=f"certificado_{estudiante_id}.pdf", headers=dict(response.headers))
+
+
+# --- trabajos por semestre ---
+
+def _directorio_trabajos() -> str:
+    return os.path.join(CERTIFICADOS_CACHE, "trabajos")
+
+
+def _guardar_estado(estado: EstadoTrabajoCertificados):
+    """
+    El estado vive en disco (no en memoria) para que cualquier worker pueda responder el sondeo.
+    """
+    ruta = os.path.join(_directorio_trabajos(), f"{estado.trabajo_id}.json")
+    temporal = f"{ruta}.tmp"
+    with open(temporal, "w", encoding="utf-8") as archivo:
+        archivo.write(estado.model_dump_json())
+    os.replace(temporal, ruta)
+
+
+def _leer_estado(trabajo_id: str) -> Optional[EstadoTrabajoCertificados]:
+    if not trabajo_id.isalnum():
+        return None
+    try:
+        with open(os.path.join(_directorio_trabajos(), f"{trabajo_id}.json"), encoding="utf-8") as archivo:
+            return EstadoTrabajoCertificados.model_validate_json(archivo.read())
+    except FileNotFoundError:
+        return None
+
+
+def _limpiar_trabajos():
+    limite = time.time() - CERTIFICADOS_TRABAJOS_HORAS * 3600
+    for ruta in glob.glob(os.path.join(_directorio_trabajos(), "*")):
+        try:
+            if os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+        except FileNotFoundError:
+            pass
+
+
+def _empaquetar(rutas: List[Tuple[int, str]], destino: str):
+    """
+    Zip sin compresión (los PDF ya vienen comprimidos). Si un certificado se re-renderizó
+    mientras tanto, se toma la versión vigente del mismo estudiante.
+    """
+    temporal = f"{destino}.tmp"
+    with zipfile.ZipFile(temporal, "w", compression=zipfile.ZIP_STORED) as archivo_zip:
+        for estudiante_id, ruta in rutas:
+            if not os.path.exists(ruta):
+                vigentes = glob.glob(os.path.join(CERTIFICADOS_CACHE, f"{estudiante_id}-*.pdf"))
+                if not vigentes:
+                    continue
+                ruta = vigentes[0]
+            archivo_zip.write(ruta, arcname=f"certificado_{estudiante_id}.pdf")
+    os.replace(temporal, destino)
+
+
+async def _ejecutar_trabajo(estado: EstadoTrabajoCertificados):
+    bucle = asyncio.get_running_loop()
+    rutas: List[Tuple[int, str]] = []
+    try:
+        estado.estado = "en_proceso"
+        await bucle.run_in_executor(None, _guardar_estado, estado)
+        ultimo_id = 0
+        while True:
+            async with AsyncSession(async_engine, expire_on_commit=False) as session:
+                estudiantes = (await session.exec(
+                    _consulta_certificados()
+                    .where(Estudiante.semestre == estado.semestre, Estudiante.active == True, Estudiante.id > ultimo_id)
+                    .order_by(Estudiante.id)
+                    .limit(LOTE_TRABAJO)
+                )).all()
+                lote = [datos_certificado(estudiante) for estudiante in estudiantes]
+            if not lote:
+                break
+            ultimo_id = lote[-1]["id"]
+
+            resultados = await asyncio.gather(*[obtener_certificado(datos) for datos in lote], return_exceptions=True)
+            for datos, resultado in zip(lote, resultados):
+                if isinstance(resultado, BaseException):
+                    estado.errores.append(f"Estudiante {datos['id']}: {resultado}")
+                    continue
+                ruta, reutilizado = resultado
+                rutas.append((datos["id"], ruta))
+                if reutilizado:
+                    estado.reutilizados += 1
+                else:
+                    estado.generados += 1
+            await bucle.run_in_executor(None, _guardar_estado, estado)
+
+        await bucle.run_in_executor(None, _empaquetar, rutas, os.path.join(_directorio_trabajos(), f"{estado.trabajo_id}.zip"))
+        estado.estado = "listo"
+    except Exception as error:
+        log.exception("Falló el trabajo de certificados %s", estado.trabajo_id)
+        estado.estado = "error"
+        estado.errores.append(str(error))
+    estado.terminado = ahora()
+    await bucle.run_in_executor(None, _guardar_estado, estado)
+
+
+@router.post("/semestre/{semestre}", response_model=EstadoTrabajoCertificados, status_code=202, summary="Generar los certificados de un semestre")
+async def generar_certificados_semestre(semestre: int, session: AsyncSession = Depends(get_async_session)):
+    """
+    Inicia en segundo plano la generación de los certificados de los estudiantes activos del semestre
+    y devuelve el `trabajo_id` para consultar el avance. Los certificados sin cambios salen de la cache.
+    - Retorna 404 si el semestre no tiene estudiantes activos.
+    """
+    total = (await session.exec(
+        select(func.count()).where(Estudiante.semestre == semestre, Estudiante.active == True)
+    )).one()
+    if not total:
+        raise HTTPException(status_code=404, detail=f"No hay estudiantes activos en el semestre {semestre}.")
+
+    os.makedirs(_directorio_trabajos(), exist_ok=True)
+    _limpiar_trabajos()
+    estado = EstadoTrabajoCertificados(trabajo_id=uuid.uuid4().hex, semestre=semestre, estado="pendiente", total=total, creado=ahora())
+    _guardar_estado(estado)
+    tarea = asyncio.create_task(_ejecutar_trabajo(estado.model_copy(deep=True)))
+    _trabajos_activos.add(tarea)
+    tarea.add_done_callback(_trabajos_activos.discard)
+    return estado
+
+
+@router.get("/trabajos/{trabajo_id}", response_model=EstadoTrabajoCertificados, summary="Consultar un trabajo de certificados")
+def consultar_trabajo_certificados(trabajo_id: str):
+    estado = _leer_estado(trabajo_id)
+    if estado is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado.")
+    return estado
+
+
+@router.get("/trabajos/{trabajo_id}/zip", summary="Descargar los certificados de un trabajo")
+def descargar_trabajo_certificados(trabajo_id: str):
+    """
+    Envía en streaming el zip con un PDF por estudiante.
+    - Retorna 404 si el trabajo no existe y 409 si todavía no termina.
+    """
+    estado = _leer_estado(trabajo_id)
+    if estado is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado.")
+    if estado.estado != "listo":
+        raise HTTPException(status_code=409, detail=f"El trabajo aún no está listo (estado: {estado.estado}).")
+    return FileResponse(
+        os.path.join(_directorio_trabajos(), f"{trabajo_id}.zip"),
+        media_type="application/zip",
+        filename=f"certificados_semestre_{estado.semestre}.zip",
+    )
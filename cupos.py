@@ -0,0 +1,202 @@
+from datetime import date
+from typing import Iterable, List, Optional, Tuple
+from sqlalchemy import bindparam, case, delete, func, insert, literal, update
+from sqlmodel import Session, select
+from models import Estudiante, ListaEspera, Materia, Matricula, MatriculaProfesorLink, PosicionListaEspera, ahora
+
+
+MATERIA = Materia.__table__
+LISTA_ESPERA = ListaEspera.__table__
+
+_RETIRAR_DE_LISTA = delete(LISTA_ESPERA).where(
+    LISTA_ESPERA.c.estudiante_id == bindparam("e_id"),
+    LISTA_ESPERA.c.materia_id == bindparam("m_id"),
+)
+
+
+def _matriculas_activas():
+    return (
+        select(func.count())
+        .where(Matricula.materia_id == MATERIA.c.id, Matricula.active == True)
+        .scalar_subquery()
+    )
+
+
+def _cambiar_disponibles(cantidad: int):
+    """
+    UPDATE que suma `cantidad` (negativa para descontar) a los cupos disponibles y sube la versión
+    de la materia, así su ETag y la cache del catálogo reflejan el nuevo cupo.
+    """
+    return update(MATERIA).values(
+        cupos_disponibles=MATERIA.c.cupos_disponibles + cantidad,
+        version=MATERIA.c.version + 1,
+        updated_at=ahora(),
+    )
+
+
+def reservar_cupos(session: Session, materia_id: int, cantidad: int = 1) -> int:
+    """
+    Descuenta hasta `cantidad` cupos de una materia activa y devuelve cuántos reservó.
+    El caso común es un único UPDATE condicional (cupos_disponibles >= cantidad), atómico aunque
+    lleguen miles de solicitudes a la vez. Si no alcanza, se relee la fila bloqueada (FOR UPDATE en
+    PostgreSQL; en SQLite el UPDATE ya tomó el bloqueo de escritura) y se reservan los que queden.
+    Las materias sin cupo (None) no se escriben y admiten todo.
+    """
+    conexion = session.connection()
+    disponibles = MATERIA.c.cupos_disponibles
+    resultado = conexion.execute(
+        _cambiar_disponibles(-cantidad).where(MATERIA.c.id == materia_id, MATERIA.c.active == True, disponibles >= cantidad)
+    )
+    if resultado.rowcount:
+        return cantidad
+
+    fila = conexion.execute(
+        select(MATERIA.c.cupo, disponibles).where(MATERIA.c.id == materia_id, MATERIA.c.active == True).with_for_update()
+    ).first()
+    if fila is None:
+        return 0
+    if fila.cupo is None:
+        return cantidad
+    restantes = max(fila.cupos_disponibles or 0, 0)
+    if restantes:
+        conexion.execute(_cambiar_disponibles(-restantes).where(MATERIA.c.id == materia_id))
+    return restantes
+
+
+def liberar_cupos(session: Session, materia_id: int, cantidad: int = 1) -> List[int]:
+    """
+    Devuelve cupos a la materia y los ocupa de inmediato con la lista de espera, en la misma transacción
+    (un cupo liberado nunca queda visible para quien llega después de los que esperan).
+    Devuelve los IDs de los estudiantes promovidos.
+    """
+    session.connection().execute(
+        _cambiar_disponibles(cantidad).where(MATERIA.c.id == materia_id, MATERIA.c.cupos_disponibles.is_not(None))
+    )
+    return promover_lista_espera(session, materia_id)
+
+
+def ajustar_cupo(session: Session, materia_id: int, cupo: Optional[int]) -> bool:
+    """
+    Cambia el cupo de la materia y recalcula sus disponibles contra las matrículas activas en un solo UPDATE.
+    Devuelve False (sin cambios) si el cupo nuevo es menor que los estudiantes ya matriculados.
+    Si el cupo crece se promueve la lista de espera.
+    """
+    activas = _matriculas_activas()
+    sentencia = update(MATERIA).where(MATERIA.c.id == materia_id)
+    if cupo is None:
+        sentencia = sentencia.values(cupo=None, cupos_disponibles=None)
+    else:
+        sentencia = sentencia.where(literal(cupo) >= activas).values(cupo=cupo, cupos_disponibles=cupo - activas)
+    resultado = session.connection().execute(sentencia.values(version=MATERIA.c.version + 1, updated_at=ahora()))
+    if not resultado.rowcount:
+        return False
+    promover_lista_espera(session, materia_id)
+    return True
+
+
+def recalcular_cupos(session: Session):
+    """
+    Recalcula los disponibles de todas las materias desde las matrículas activas (tras una importación,
+    que puede cambiar el cupo de muchas materias) y promueve las listas de espera con cupo libre.
+    Un cupo importado menor que los matriculados deja disponibles negativos: nadie entra hasta que se liberen.
+    """
+    nuevos = case((MATERIA.c.cupo.is_(None), None), else_=MATERIA.c.cupo - _matriculas_activas())
+    session.connection().execute(
+        update(MATERIA)
+        .where(MATERIA.c.cupos_disponibles.is_distinct_from(nuevos))
+        .values(cupos_disponibles=nuevos, version=MATERIA.c.version + 1, updated_at=ahora())
+    )
+    for materia_id in session.exec(select(ListaEspera.materia_id).distinct()).all():
+        promover_lista_espera(session, materia_id)
+    session.commit()
+
+
+def inscribir(
+    session: Session,
+    estudiante_id: int,
+    materia_id: int,
+    nota_final: Optional[float] = None,
+    fecha_registro: Optional[date] = None,
+    profesores_ids: Iterable[int] = (),
+    existente: Optional[Matricula] = None,
+) -> Matricula:
+    """
+    Crea la matrícula, o reactiva la dada de baja del mismo estudiante y materia (`existente`),
+    enlaza sus profesores y retira al estudiante de la lista de espera de la materia.
+    El cupo ya debe estar reservado y la transacción queda abierta.
+    """
+    if existente is None:
+        matricula = Matricula(estudiante_id=estudiante_id, materia_id=materia_id, nota_final=nota_final, fecha_registro=fecha_registro or date.today())
+        session.add(matricula)
+    else:
+        matricula = existente
+        matricula.active = True
+        matricula.nota_final = nota_final
+        matricula.fecha_registro = fecha_registro or date.today()
+        session.execute(delete(MatriculaProfesorLink).where(MatriculaProfesorLink.matricula_id == matricula.id))
+    session.flush()
+
+    enlaces = [{"matricula_id": matricula.id, "profesor_id": profesor_id} for profesor_id in dict.fromkeys(profesores_ids)]
+    if enlaces:
+        session.execute(insert(MatriculaProfesorLink), enlaces)
+    retirar_de_listas(session, [(estudiante_id, materia_id)])
+    return matricula
+
+
+def retirar_de_listas(session: Session, pares: List[Tuple[int, int]]):
+    """
+    Borra las solicitudes en espera de los pares (estudiante_id, materia_id) ya matriculados (executemany).
+    """
+    if pares:
+        session.connection().execute(_RETIRAR_DE_LISTA, [{"e_id": e_id, "m_id": m_id} for e_id, m_id in pares])
+
+
+def encolar(session: Session, estudiante_id: int, materia_id: int) -> PosicionListaEspera:
+    """
+    Agrega al estudiante al final de la lista de espera de la materia.
+    Lanza IntegrityError si ya estaba en ella.
+    """
+    entrada = ListaEspera(estudiante_id=estudiante_id, materia_id=materia_id)
+    session.add(entrada)
+    session.flush()
+    return PosicionListaEspera(
+        lista_espera_id=entrada.id,
+        estudiante_id=estudiante_id,
+        materia_id=materia_id,
+        posicion=posicion_en_lista(session, entrada),
+    )
+
+
+def posicion_en_lista(session: Session, entrada: ListaEspera) -> int:
+    return session.exec(
+        select(func.count()).where(ListaEspera.materia_id == entrada.materia_id, ListaEspera.id <= entrada.id)
+    ).one()
+
+
+def promover_lista_espera(session: Session, materia_id: int) -> List[int]:
+    """
+    Matricula en orden de llegada a los estudiantes en espera mientras la materia tenga cupo.
+    Las solicitudes de estudiantes inactivos o ya matriculados se descartan sin ocupar cupo.
+    Devuelve los IDs de los estudiantes promovidos.
+    """
+    promovidos = []
+    while True:
+        siguiente = session.exec(
+            select(ListaEspera).where(ListaEspera.materia_id == materia_id).order_by(ListaEspera.id).limit(1)
+        ).first()
+        if siguiente is None:
+            break
+
+        estudiante = session.get(Estudiante, siguiente.estudiante_id)
+        existente = session.exec(
+            select(Matricula).where(Matricula.estudiante_id == siguiente.estudiante_id, Matricula.materia_id == materia_id)
+        ).first()
+        if not estudiante or not estudiante.active or (existente and existente.active):
+            retirar_de_listas(session, [(siguiente.estudiante_id, materia_id)])
+            continue
+
+        if not reservar_cupos(session, materia_id):
+            break
+        inscribir(session, siguiente.estudiante_id, materia_id, existente=existente)
+        promovidos.append(siguiente.estudiante_id)
+    return promovidos
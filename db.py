@@ -1,12 +1,157 @@
-from typing import Generator
+import asyncio
+import os
+import weakref
+from typing import AsyncGenerator
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from etag import asegurar_marcas
+from metricas import instrumentar
 
-DATABASE_URL = "sqlite:///./universidad.db"
-engine = create_engine(DATABASE_URL, echo=False, connect_args={"check_same_thread": False})
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./universidad.db")
+# "desarrollo": SQLite con la configuración por defecto. "produccion": WAL, synchronous=NORMAL, mmap y busy_timeout.
+DB_PERFIL = os.getenv("DB_PERFIL", "desarrollo")
+DB_ECHO = os.getenv("DB_ECHO", "0") == "1"
+
+# Pool de conexiones (SQLite en archivo, PostgreSQL u otros servidores)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+# Sesiones síncronas abiertas a la vez (ver get_session). SQLite admite un solo escritor: más sesiones
+# compitiendo por el bloqueo no suben el throughput y alargan las esperas hasta "database is locked".
+DB_SESIONES_MAX = int(os.getenv("DB_SESIONES_MAX", "8" if DATABASE_URL.startswith("sqlite") else str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+
+# Perfil de producción de SQLite
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+
+def _pragmas_sqlite_produccion(dbapi_connection, connection_record):
+    """
+    Se ejecuta en cada conexión nueva: WAL permite lecturas concurrentes mientras alguien escribe
+    y busy_timeout hace que los escritores esperen el bloqueo en vez de fallar con "database is locked".
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+def _activar_claves_foraneas(dbapi_connection, connection_record):
+    """
+    SQLite no aplica las claves foráneas (ni sus ON DELETE CASCADE) salvo que cada conexión lo pida.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+def _opciones_pool(url: str) -> dict:
+    """
+    SQLite en memoria usa un pool de una sola conexión y no admite tamaño;
+    SQLite en archivo usa QueuePool; los servidores además reciclan y verifican conexiones.
+    """
+    if url.startswith("sqlite") and ":memory:" in url:
+        return {}
+    opciones = {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "pool_timeout": DB_POOL_TIMEOUT}
+    if not url.startswith("sqlite"):
+        opciones.update(pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=DB_POOL_PRE_PING)
+    return opciones
+
+
+def crear_engine(url: str = DATABASE_URL, perfil: str = DB_PERFIL):
+    """
+    Crea el engine según la URL: SQLite (con el perfil indicado) o un servidor como PostgreSQL con pool configurable.
+    """
+    if url.startswith("sqlite"):
+        connect_args = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+        sqlite_engine = create_engine(url, echo=DB_ECHO, connect_args=connect_args, **_opciones_pool(url))
+        event.listen(sqlite_engine, "connect", _activar_claves_foraneas)
+        if perfil == "produccion":
+            event.listen(sqlite_engine, "connect", _pragmas_sqlite_produccion)
+        return sqlite_engine
+
+    return create_engine(url, echo=DB_ECHO, **_opciones_pool(url))
+
+
+def url_async(url: str) -> str:
+    """
+    Traduce la URL síncrona al driver async equivalente (aiosqlite / asyncpg).
+    """
+    if url.startswith("sqlite"):
+        return "sqlite+aiosqlite" + url[url.index(":"):]
+    if url.startswith("postgresql"):
+        return "postgresql+asyncpg" + url[url.index(":"):]
+    return url
+
+
+def crear_engine_async(url: str = DATABASE_URL, perfil: str = DB_PERFIL):
+    """
+    Engine async para los endpoints de lectura: la concurrencia queda limitada por la base de datos
+    y no por el threadpool de Starlette. Usa la misma configuración de perfil y pool que `crear_engine`.
+    """
+    if url.startswith("sqlite"):
+        connect_args = {"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+        engine_async = create_async_engine(url_async(url), echo=DB_ECHO, connect_args=connect_args, **_opciones_pool(url))
+        event.listen(engine_async.sync_engine, "connect", _activar_claves_foraneas)
+        if perfil == "produccion":
+            event.listen(engine_async.sync_engine, "connect", _pragmas_sqlite_produccion)
+        return engine_async
+
+    return create_async_engine(url_async(url), echo=DB_ECHO, **_opciones_pool(url))
+
+
+engine = crear_engine()
+async_engine = crear_engine_async()
+instrumentar(engine)
+instrumentar(async_engine.sync_engine)
 
 def create_db_and_tables():
+    from busqueda import crear_indices_busqueda
+    from migraciones import agregar_columnas_faltantes, crear_indices_faltantes, eliminar_enlaces_huerfanos, usar_autoincrement_sqlite
+    from promedios import recalcular_promedios
+
     SQLModel.metadata.create_all(engine)
+    agregadas = agregar_columnas_faltantes(engine)
+    usar_autoincrement_sqlite(engine)
+    crear_indices_faltantes(engine)
+    eliminar_enlaces_huerfanos(engine)
+    asegurar_marcas(engine)
+    crear_indices_busqueda(engine)
+    # Bases creadas antes de materializar los promedios: se llenan los acumulados una sola vez.
+    if any(columna.startswith("historial.") for columna in agregadas):
+        with Session(engine) as session:
+            recalcular_promedios(session)
+
+_limites_sesiones: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def _limite_sesiones() -> asyncio.Semaphore:
+    bucle = asyncio.get_running_loop()
+    limite = _limites_sesiones.get(bucle)
+    if limite is None:
+        limite = _limites_sesiones[bucle] = asyncio.Semaphore(DB_SESIONES_MAX)
+    return limite
+
+
+async def get_session() -> AsyncGenerator[Session, None]:
+    """
+    Sesión síncrona para los endpoints de escritura (que corren en el threadpool).
+    Se admite en el event loop: con más peticiones simultáneas que conexiones, las que sobran esperan aquí
+    sin ocupar un hilo. Si esperaran la conexión dentro del threadpool, los hilos bloqueados impedirían que
+    las peticiones que ya tienen una serialicen su respuesta y cierren la sesión, y todo quedaría
+    detenido hasta el pool_timeout.
+    """
+    async with _limite_sesiones():
+        with Session(engine) as session:
+            yield session
 
-def get_session() -> Generator[Session, None, None]:
-    with Session(engine) as session:
-        yield session
\ No newline at end of file
+async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
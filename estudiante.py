@@ -1,48 +1,95 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, Response, UploadFile
 from sqlmodel import Session, select
-from typing import List, Optional 
-from db import get_session
-from models import Estudiante, EstudianteCreate  
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import Dict, List, Optional 
+from db import get_session, get_async_session
+from models import (
+    Estudiante, EstudianteCreate, Historial, ListaEspera, Materia, Matricula, MatriculaArchivada, MatriculaPanel, MatriculaProfesorLink,
+    MatriculaProfesorLinkArchivado, PanelEstudiante, Profesor, ResumenEliminacion, ResumenImportacion,
+)
+from paginacion import Paginacion, obtener_paginacion, paginar_rapido, construir_consulta
+from exportacion import obtener_formato, exportar
+from importacion import detectar_formato, importar
 from sqlalchemy.orm import selectinload 
+from etag import condicional, condicional_tablas, etag_fila
+from metricas import RutaMedida
+from sqlalchemy import delete, func, union_all
+from cupos import liberar_cupos
+from cache import cache_catalogo
+from lotes import consultar_por_ids, convertir_ids, obtener_ids, responder_lote
+from cambios import ELIMINAR, registrar_cambios
 
-router = APIRouter(prefix="/estudiantes", tags=["Estudiantes"])
+router = APIRouter(prefix="/estudiantes", tags=["Estudiantes"], route_class=RutaMedida)
+
+# Estudiantes por transacción al borrar una cohorte: cada DELETE lleva un IN con los IDs del lote.
+LOTE_ELIMINACION = 500
+
+ENLACES = MatriculaProfesorLink.__table__
+ENLACES_ARCHIVADOS = MatriculaProfesorLinkArchivado.__table__
 
 
 @router.get("/", response_model=List[Estudiante], summary="Listar todos los estudiantes (Filtro por Semestre)")
-def listar_estudiantes(session: Session = Depends(get_session), semestre: Optional[int] = None):
+async def listar_estudiantes(request: Request, response: Response, session: AsyncSession = Depends(get_async_session), semestre: Optional[int] = None, paginacion: Paginacion = Depends(obtener_paginacion), formato: Optional[str] = Depends(obtener_formato)):
     """
     Lista todos los estudiantes activos, con la opción de filtrar por semestre académico.
+    Paginado por cursor: usar el valor de la cabecera X-Next-Cursor como `after_id` de la siguiente página.
+    Con `format=ndjson|csv` (o Accept equivalente) exporta en streaming todos los registros desde `after_id`.
     """
-    statement = select(Estudiante).where(Estudiante.active == True)
+    condiciones = [Estudiante.active == True]
     
     if semestre is not None:
-        statement = statement.where(Estudiante.semestre == semestre)
-        
-    return session.exec(statement).all()
+        condiciones.append(Estudiante.semestre == semestre)
+
+    if formato:
+        return exportar(construir_consulta(Estudiante, condiciones, paginacion, solo_columnas=True), formato, "estudiantes")
+
+    sin_cambios = await condicional_tablas(request, response, session, "estudiante")
+    if sin_cambios is not None:
+        return sin_cambios
+    return await paginar_rapido(session, Estudiante, condiciones, paginacion, response)
 
 
 @router.get("/eliminados", response_model=List[Estudiante], summary="Listar estudiantes dados de baja ")
-def listar_estudiantes_eliminados(session: Session = Depends(get_session)):
+async def listar_estudiantes_eliminados(request: Request, response: Response, session: AsyncSession = Depends(get_async_session), paginacion: Paginacion = Depends(obtener_paginacion)):
+    """
+    Lista todos los estudiantes que han sido marcados como inactivos (paginado por cursor).
     """
-    Lista todos los estudiantes que han sido marcados como inactivos.
+    sin_cambios = await condicional_tablas(request, response, session, "estudiante")
+    if sin_cambios is not None:
+        return sin_cambios
+    return await paginar_rapido(session, Estudiante, [Estudiante.active == False], paginacion, response)
+
+
+@router.get("/lote", response_model=List[Estudiante], summary="Obtener varios estudiantes por ID")
+async def obtener_estudiantes_lote(request: Request, response: Response, ids: List[int] = Depends(obtener_ids), session: AsyncSession = Depends(get_async_session)):
+    """
+    Multi-get: los estudiantes pedidos en `ids` (activos o no) con una sola consulta IN, en el orden pedido.
+    Los IDs inexistentes se omiten y se informan en la cabecera X-Missing-Ids.
+    - Retorna 400 Bad Request si `ids` no es una lista de enteros o supera MAXIMO_IDS_LOTE.
     """
-    return session.exec(select(Estudiante).where(Estudiante.active == False)).all()
+    sin_cambios = await condicional_tablas(request, response, session, "estudiante")
+    if sin_cambios is not None:
+        return sin_cambios
+    return responder_lote(await consultar_por_ids(session, Estudiante, ids), ids, response)
 
 
 @router.get("/correo/{estudiante_correo}", response_model=Estudiante, summary="Buscar estudiante por correo")
-def obtener_estudiante_por_correo(estudiante_correo: str, session: Session = Depends(get_session)):
+async def obtener_estudiante_por_correo(estudiante_correo: str, request: Request, response: Response, session: AsyncSession = Depends(get_async_session)):
     """
     Busca un estudiante específico utilizando su dirección de correo electrónico.
     - Retorna 404 Not Found si el correo no existe.
     """
-    estudiante = session.exec(select(Estudiante).where(Estudiante.correo == estudiante_correo)).first()
+    estudiante = (await session.exec(select(Estudiante).where(Estudiante.correo == estudiante_correo))).first()
     if not estudiante:
         raise HTTPException(status_code=404, detail="Estudiante no encontrado o correo mal digitado")
+    sin_cambios = condicional(request, response, etag_fila(Estudiante, estudiante.id, estudiante.version), estudiante.updated_at)
+    if sin_cambios is not None:
+        return sin_cambios
     return estudiante
 
 
 @router.get("/{estudiante_id}", response_model=Estudiante, summary="Obtener estudiante por ID con sus matrículas")
-def obtener_estudiante(estudiante_id: int, session: Session = Depends(get_session)):
+async def obtener_estudiante(estudiante_id: int, request: Request, response: Response, session: AsyncSession = Depends(get_async_session)):
     """
     Consulta relacional obligatoria: Obtener estudiante y sus cursos matriculados.
     Utiliza selectinload para cargar las matrículas de manera eficiente.
@@ -53,22 +100,72 @@ def obtener_estudiante(estudiante_id: int, session: Session = Depends(get_sessio
         .where(Estudiante.id == estudiante_id)
         .options(selectinload(Estudiante.matriculas))
     )
-    estudiante = session.exec(statement).first()
+    estudiante = (await session.exec(statement)).first()
     
     if not estudiante:
         raise HTTPException(status_code=404, detail="Estudiante no encontrado")
+    sin_cambios = condicional(request, response, etag_fila(Estudiante, estudiante.id, estudiante.version), estudiante.updated_at)
+    if sin_cambios is not None:
+        return sin_cambios
     return estudiante
 
 
+@router.get("/{estudiante_id}/panel", response_model=PanelEstudiante, summary="Página del estudiante en una sola llamada")
+async def obtener_panel_estudiante(estudiante_id: int, request: Request, response: Response, session: AsyncSession = Depends(get_async_session)):
+    """
+    Estudiante, historial, matrículas (con los IDs de sus profesores), materias y profesores en una sola respuesta,
+    en vez de consultar /estudiantes/{id}, /historiales/estudiante/{id}, /reporte/estudiante/{id} y cada
+    materia y profesor por separado.
+    Son como máximo 6 consultas sin importar cuántas matrículas tenga; materias y profesores salen de la cache
+    del catálogo cuando están en ella.
+    - Retorna 404 Not Found si el ID no existe.
+    """
+    sin_cambios = await condicional_tablas(request, response, session, "estudiante", "historial", "matricula", "materia", "profesor", "matriculaprofesorlink")
+    if sin_cambios is not None:
+        return sin_cambios
+
+    estudiante = await session.get(Estudiante, estudiante_id)
+    if not estudiante:
+        raise HTTPException(status_code=404, detail="Estudiante no encontrado")
+    historial = (await session.exec(select(Historial).where(Historial.estudiante_id == estudiante_id))).first()
+    matriculas = (await session.exec(select(Matricula).where(Matricula.estudiante_id == estudiante_id).order_by(Matricula.id))).all()
+    enlaces = (await session.exec(
+        select(MatriculaProfesorLink.matricula_id, MatriculaProfesorLink.profesor_id)
+        .join(Matricula, Matricula.id == MatriculaProfesorLink.matricula_id)
+        .where(Matricula.estudiante_id == estudiante_id)
+        .order_by(MatriculaProfesorLink.matricula_id, MatriculaProfesorLink.profesor_id)
+    )).all() if matriculas else []
+
+    profesores_por_matricula: Dict[int, List[int]] = {}
+    for matricula_id, profesor_id in enlaces:
+        profesores_por_matricula.setdefault(matricula_id, []).append(profesor_id)
+    materias_ids = list(dict.fromkeys(m.materia_id for m in matriculas if m.materia_id is not None))
+    profesores_ids = list(dict.fromkeys(profesor_id for _, profesor_id in enlaces))
+    marca = request.state.marca_tablas
+    materias = await consultar_por_ids(session, Materia, materias_ids, "materia", marca) if materias_ids else {}
+    profesores = await consultar_por_ids(session, Profesor, profesores_ids, "profesor", marca) if profesores_ids else {}
+
+    return {
+        "estudiante": estudiante,
+        "historial": historial,
+        "matriculas": [MatriculaPanel(**m.model_dump(), profesores_ids=profesores_por_matricula.get(m.id, [])) for m in matriculas],
+        "materias": [materias[materia_id] for materia_id in materias_ids if materia_id in materias],
+        "profesores": [profesores[profesor_id] for profesor_id in profesores_ids if profesor_id in profesores],
+    }
+
+
 @router.get("/cedula/{estudiante_cedula}", response_model=Estudiante, summary="Buscar estudiante por cédula")
-def obtener_estudiante_por_cedula(estudiante_cedula: str, session: Session = Depends(get_session)):
+async def obtener_estudiante_por_cedula(estudiante_cedula: str, request: Request, response: Response, session: AsyncSession = Depends(get_async_session)):
     """
     Busca un estudiante utilizando su cédula (ID único).
     - Retorna 404 Not Found si la cédula no existe.
     """
-    estudiante = session.exec(select(Estudiante).where(Estudiante.cedula == estudiante_cedula)).first()
+    estudiante = (await session.exec(select(Estudiante).where(Estudiante.cedula == estudiante_cedula))).first()
     if not estudiante:
         raise HTTPException(status_code=404, detail="Estudiante no encontrado")
+    sin_cambios = condicional(request, response, etag_fila(Estudiante, estudiante.id, estudiante.version), estudiante.updated_at)
+    if sin_cambios is not None:
+        return sin_cambios
     return estudiante
 
 
@@ -95,20 +192,115 @@ def crear_estudiante(estudiante: EstudianteCreate, session: Session = Depends(ge
     return db_estudiante
 
 
+@router.post("/importar", response_model=ResumenImportacion, summary="Importar estudiantes desde CSV/JSON Lines (upsert por cédula)")
+def importar_estudiantes(archivo: UploadFile = File(...), session: Session = Depends(get_session)):
+    """
+    Inserta o actualiza estudiantes en lotes usando INSERT ... ON CONFLICT sobre la cédula.
+    Las filas cuyo correo pertenece a otra cédula o con datos inválidos se rechazan.
+    - Retorna 400 Bad Request si el archivo no es .csv ni JSON Lines.
+    """
+    try:
+        formato = detectar_formato(archivo.filename)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    return importar(session, "estudiantes", archivo.file, formato)
+
+
+def _eliminar_lote(session: Session, ids: List[int], resumen: ResumenEliminacion):
+    """
+    Borra físicamente los estudiantes `ids` con una sentencia por tabla (DELETE ... WHERE estudiante_id IN),
+    sin cargar sus matrículas en memoria: solicitudes en espera, enlaces con profesores, matrículas
+    (también las archivadas), historial y por último los estudiantes. No depende del ON DELETE CASCADE,
+    que las bases creadas antes no tienen. Los cupos que ocupaban pasan a la lista de espera de cada materia.
+    """
+    conexion = session.connection()
+    de_los_estudiantes = Matricula.estudiante_id.in_(ids)
+    cupos_ocupados = conexion.execute(
+        select(Matricula.materia_id, func.count())
+        .where(de_los_estudiantes, Matricula.active == True, Matricula.materia_id.is_not(None))
+        .group_by(Matricula.materia_id)
+        .order_by(Matricula.materia_id)
+    ).all()
+    # La lista de espera primero: los cupos liberados no deben ir a los propios estudiantes borrados.
+    resumen.solicitudes_espera += conexion.execute(delete(ListaEspera).where(ListaEspera.estudiante_id.in_(ids))).rowcount
+    resumen.enlaces += conexion.execute(
+        delete(ENLACES).where(ENLACES.c.matricula_id.in_(select(Matricula.id).where(de_los_estudiantes)))
+    ).rowcount
+    resumen.enlaces += conexion.execute(
+        delete(ENLACES_ARCHIVADOS).where(
+            ENLACES_ARCHIVADOS.c.matricula_id.in_(select(MatriculaArchivada.id).where(MatriculaArchivada.estudiante_id.in_(ids)))
+        )
+    ).rowcount
+    archivadas = conexion.execute(
+        delete(MatriculaArchivada).where(MatriculaArchivada.estudiante_id.in_(ids)).returning(MatriculaArchivada.id)
+    ).scalars().all()
+    matriculas = conexion.execute(delete(Matricula).where(de_los_estudiantes).returning(Matricula.id)).scalars().all()
+    resumen.historiales += conexion.execute(delete(Historial).where(Historial.estudiante_id.in_(ids))).rowcount
+    estudiantes = conexion.execute(delete(Estudiante).where(Estudiante.id.in_(ids)).returning(Estudiante.id)).scalars().all()
+
+    registrar_cambios(session, Matricula, [*matriculas, *archivadas], ELIMINAR)
+    registrar_cambios(session, Estudiante, estudiantes, ELIMINAR)
+    resumen.matriculas += len(matriculas)
+    resumen.matriculas_archivadas += len(archivadas)
+    resumen.estudiantes += len(estudiantes)
+    for materia_id, cantidad in cupos_ocupados:
+        resumen.promovidos += len(liberar_cupos(session, materia_id, cantidad))
+
+
+def eliminar_estudiantes(session: Session, ids: List[int]) -> ResumenEliminacion:
+    """
+    Borra físicamente a los estudiantes en lotes de LOTE_ELIMINACION, cada uno en su propia transacción,
+    y devuelve cuántas filas se borraron de cada tabla.
+    """
+    resumen = ResumenEliminacion()
+    for inicio in range(0, len(ids), LOTE_ELIMINACION):
+        _eliminar_lote(session, ids[inicio:inicio + LOTE_ELIMINACION], resumen)
+        session.commit()
+    if resumen.matriculas:
+        cache_catalogo.invalidar("materia")
+    return resumen
+
+
+@router.delete("/cohorte", response_model=ResumenEliminacion, summary="Eliminar FÍSICAMENTE una cohorte de estudiantes")
+def eliminar_cohorte(
+    semestre: Optional[int] = Query(default=None, description="Borra a todos los estudiantes (activos o no) de este semestre"),
+    ids: Optional[str] = Query(default=None, description="IDs separados por coma (ej: 1,2,3)"),
+    session: Session = Depends(get_session),
+):
+    """
+    Elimina físicamente a los estudiantes de un semestre o de una lista de IDs, con sus matrículas (también
+    las archivadas), enlaces con profesores, historial y solicitudes en lista de espera.
+    Trabaja con DELETE por conjuntos en lotes de LOTE_ELIMINACION estudiantes; los cupos que ocupaban pasan
+    a la lista de espera de cada materia. Devuelve cuántas filas se borraron.
+    - Retorna 400 Bad Request si no se indica exactamente uno de `semestre` o `ids`.
+    """
+    if (semestre is None) == (ids is None):
+        raise HTTPException(status_code=400, detail="Indique `semestre` o `ids` (solo uno de los dos).")
+    if ids is not None:
+        pedidos = convertir_ids(ids)
+    else:
+        # Activos por el índice parcial de semestre; los dados de baja por ix_estudiante_active_id.
+        pedidos = session.execute(union_all(
+            select(Estudiante.id).where(Estudiante.semestre == semestre, Estudiante.active == True),
+            select(Estudiante.id).where(Estudiante.active == False, Estudiante.semestre == semestre),
+        )).scalars().all()
+    return eliminar_estudiantes(session, sorted(pedidos))
+
+
 @router.delete("/{estudiante_id}", summary="Eliminar estudiante FÍSICAMENTE (Activa Cascada)")
 def eliminar_estudiante(estudiante_id: int, session: Session = Depends(get_session)):
     """
     Elimina físicamente al estudiante de la base de datos.
-    LÓGICA DE NEGOCIO: La eliminación activa la cascada en models.py, 
-    eliminando automáticamente sus matrículas y historial asociados.
+    LÓGICA DE NEGOCIO: Se eliminan también sus matrículas (activas, dadas de baja y archivadas), sus enlaces
+    con profesores y su historial (con él desaparecen sus promedios acumulados, así que no hay acumulados que ajustar).
+    Sus solicitudes en lista de espera se borran y los cupos que ocupaba pasan a la lista de espera de cada materia.
     - Retorna 404 Not Found si el ID no existe.
     """
     estudiante = session.get(Estudiante, estudiante_id)
     if not estudiante:
         raise HTTPException(status_code=404, detail="Estudiante no encontrado")
-   
-    session.delete(estudiante)
-    session.commit()
+
+    eliminar_estudiantes(session, [estudiante_id])
     return {"mensaje": f"Estudiante {estudiante_id} y sus matrículas/historial asociados han sido eliminados."}
 
 
@@ -0,0 +1,154 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional, Tuple
+from fastapi import Request, Response
+from sqlalchemy import bindparam, event, insert, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session as SessionORM
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models import MarcaTabla, Versionado, ahora
+
+
+MARCAS = MarcaTabla.__table__
+
+_INCREMENTAR_MARCAS = (
+    update(MARCAS)
+    .where(MARCAS.c.tabla.in_(bindparam("tablas", expanding=True)))
+    .values(version=MARCAS.c.version + 1, updated_at=bindparam("momento"))
+)
+# Tablas escritas en la transacción en curso de cada conexión (en `conexion.info`).
+_PENDIENTES = "marcas_pendientes"
+
+
+@event.listens_for(SessionORM, "before_flush")
+def _incrementar_versiones(session, flush_context, instances):
+    """
+    Toda fila versionada modificada por el ORM sube de versión en el mismo UPDATE
+    (version = version + 1 en SQL, así dos escrituras concurrentes nunca comparten versión).
+    """
+    for objeto in session.dirty:
+        if isinstance(objeto, Versionado) and session.is_modified(objeto, include_collections=False):
+            objeto.version = type(objeto).version + 1
+            objeto.updated_at = ahora()
+
+
+@event.listens_for(Engine, "after_execute")
+def _marcar_tabla(conexion, sentencia, parametros_multi, parametros, opciones, resultado):
+    """
+    Cualquier INSERT/UPDATE/DELETE (del ORM o masivo) anota su tabla; las marcas se incrementan
+    una sola vez al confirmar la transacción (ver `_incrementar_marcas`).
+    """
+    if not getattr(sentencia, "is_dml", False):
+        return
+    nombre = getattr(getattr(sentencia, "table", None), "name", None)
+    if nombre is None or nombre == MARCAS.name or resultado.rowcount == 0:
+        return
+    conexion.info.setdefault(_PENDIENTES, set()).add(nombre)
+
+
+@event.listens_for(Engine, "commit")
+def _incrementar_marcas(conexion):
+    """
+    Justo antes del COMMIT, un solo UPDATE incrementa la marca de cada tabla escrita en la transacción.
+    Sigue dentro de la transacción, así la marca nunca es visible antes que los datos, pero el bloqueo
+    de la fila de la marca (en PostgreSQL) dura solo hasta el commit inmediato: los escritores
+    concurrentes de una misma tabla ya no esperan uno detrás de otro durante toda su transacción.
+    """
+    tablas = conexion.info.pop(_PENDIENTES, None)
+    if tablas:
+        conexion.execute(_INCREMENTAR_MARCAS, {"tablas": sorted(tablas), "momento": ahora()})
+
+
+@event.listens_for(Engine, "rollback")
+def _descartar_marcas(conexion):
+    conexion.info.pop(_PENDIENTES, None)
+
+
+def asegurar_marcas(engine: Engine):
+    """
+    Crea la marca (versión 0) de cada tabla que todavía no la tenga.
+    """
+    with engine.begin() as conexion:
+        existentes = set(conexion.execute(select(MARCAS.c.tabla)).scalars())
+        faltantes = [
+            {"tabla": tabla.name, "version": 0, "updated_at": ahora()}
+            for tabla in SQLModel.metadata.sorted_tables
+            if tabla.name not in existentes and tabla is not MARCAS
+        ]
+        if faltantes:
+            conexion.execute(insert(MARCAS), faltantes)
+
+
+async def marca_tablas(session: AsyncSession, *tablas: str) -> Tuple[str, Optional[datetime]]:
+    """
+    Versión combinada y última modificación de las tablas indicadas.
+    Debe leerse antes que los datos: si una escritura ocurre entre ambas lecturas,
+    el ETag queda viejo y el siguiente sondeo recibe 200 en lugar de un 304 incorrecto.
+    """
+    filas = (await session.execute(
+        select(MARCAS.c.tabla, MARCAS.c.version, MARCAS.c.updated_at).where(MARCAS.c.tabla.in_(tablas))
+    )).all()
+    versiones = {fila.tabla: fila.version for fila in filas}
+    ultima = max((fila.updated_at for fila in filas if fila.updated_at), default=None)
+    return ".".join(str(versiones.get(tabla, 0)) for tabla in tablas), ultima
+
+
+def etag_fila(modelo, fila_id: int, version: int) -> str:
+    return f'"{modelo.__tablename__}-{fila_id}-{version}"'
+
+
+def etag_consulta(request: Request, marca: str) -> str:
+    """
+    ETag de un listado o reporte: la marca de sus tablas más la ruta y los parámetros
+    (filtros, cursor, limit, fields), que determinan la representación.
+    """
+    huella = hashlib.blake2b(f"{request.url.path}?{request.url.query}|{marca}".encode(), digest_size=12).hexdigest()
+    return f'"{huella}"'
+
+
+def _fecha_http(momento: datetime) -> str:
+    return format_datetime(momento.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+
+def _no_modificado(request: Request, etag: str, ultima_modificacion: Optional[datetime]) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        candidatos = [candidato.strip() for candidato in if_none_match.split(",")]
+        return "*" in candidatos or etag in (candidato.removeprefix("W/") for candidato in candidatos)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and ultima_modificacion:
+        try:
+            desde = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return ultima_modificacion.replace(tzinfo=timezone.utc, microsecond=0) <= desde
+    return False
+
+
+def condicional(request: Request, response: Response, etag: str, ultima_modificacion: Optional[datetime] = None) -> Optional[Response]:
+    """
+    Agrega ETag / Last-Modified a la respuesta. Si el cliente ya tiene esa versión
+    (If-None-Match, o If-Modified-Since cuando no envía ETag) devuelve la respuesta 304 a retornar.
+    """
+    cabeceras = {"ETag": etag, "Cache-Control": "no-cache"}
+    if ultima_modificacion:
+        cabeceras["Last-Modified"] = _fecha_http(ultima_modificacion)
+    if _no_modificado(request, etag, ultima_modificacion):
+        return Response(status_code=304, headers=cabeceras)
+    response.headers.update(cabeceras)
+    return None
+
+
+async def condicional_tablas(request: Request, response: Response, session: AsyncSession, *tablas: str) -> Optional[Response]:
+    """
+    `condicional` para listados y reportes: el ETag sale de la marca de las tablas involucradas.
+    La marca queda en `request.state.marca_tablas` para las claves de la cache del catálogo: una respuesta
+    cacheada solo se sirve con el ETag de la marca con la que se guardó, aunque otro worker (o la ventana
+    entre el commit y la invalidación) todavía no haya invalidado la entrada vieja.
+    """
+    marca, ultima = await marca_tablas(session, *tablas)
+    request.state.marca_tablas = marca
+    return condicional(request, response, etag_consulta(request, marca), ultima)
@@ -0,0 +1,107 @@
+import csv
+import io
+import json
+from typing import Callable, Iterable, Iterator, List, Optional
+from fastapi import Query, Request
+from fastapi.responses import StreamingResponse
+from sqlmodel import Session
+from db import engine
+
+
+FORMATOS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+TAMANO_LOTE = 500
+
+
+def obtener_formato(request: Request, formato: Optional[str] = Query(default=None, alias="format", pattern="^(json|ndjson|csv)$", description="Exportación en streaming: ndjson o csv")) -> Optional[str]:
+    """
+    Decide si la respuesta se exporta en streaming.
+    Prioridad: parámetro `format`, luego la cabecera Accept (application/x-ndjson o text/csv).
+    Devuelve None para la respuesta JSON normal.
+    """
+    if formato is not None:
+        return None if formato == "json" else formato
+
+    accept = request.headers.get("accept", "")
+    if "application/x-ndjson" in accept:
+        return "ndjson"
+    if "text/csv" in accept:
+        return "csv"
+    return None
+
+
+def obtener_formato_reporte(request: Request, formato: Optional[str] = Query(default=None, alias="format", pattern="^(json|ndjson|csv|pdf)$", description="ndjson o csv en streaming, o pdf")) -> Optional[str]:
+    """
+    Igual que `obtener_formato`, pero además acepta `pdf` (parámetro o Accept: application/pdf)
+    para los reportes que se pueden imprimir.
+    """
+    if formato == "pdf" or (formato is None and "application/pdf" in request.headers.get("accept", "")):
+        return "pdf"
+    return obtener_formato(request, formato)
+
+
+def _valor_serializable(valor):
+    if hasattr(valor, "isoformat"):
+        return valor.isoformat()
+    return str(valor)
+
+
+def _linea_ndjson(fila: dict) -> str:
+    return json.dumps(fila, ensure_ascii=False, default=_valor_serializable) + "\n"
+
+
+def _lineas_csv(columnas: List[str], filas: Iterable[dict]) -> Iterator[str]:
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+
+    def volcar() -> str:
+        texto = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return texto
+
+    escritor.writerow(columnas)
+    yield volcar()
+    for fila in filas:
+        valores = []
+        for columna in columnas:
+            valor = fila.get(columna)
+            if isinstance(valor, list):
+                valor = "; ".join(str(elemento) for elemento in valor)
+            elif hasattr(valor, "isoformat"):
+                valor = valor.isoformat()
+            valores.append(valor)
+        escritor.writerow(valores)
+        yield volcar()
+
+
+def exportar(statement, formato: str, nombre: str, columnas: Optional[List[str]] = None, agrupar: Optional[Callable[[Iterable[dict]], Iterator[dict]]] = None) -> StreamingResponse:
+    """
+    Envía el resultado de `statement` fila por fila como NDJSON o CSV.
+    La consulta corre con yield_per (cursor del servidor en PostgreSQL), por lo que la memoria
+    no depende del número de filas y el primer byte sale antes de que termine la consulta.
+    La sesión se abre dentro del generador porque vive mientras dura el envío de la respuesta.
+    `agrupar` permite convertir filas planas (de un JOIN ordenado) en registros compuestos.
+    """
+    if columnas is None:
+        columnas = list(statement.selected_columns.keys())
+
+    def filas() -> Iterator[dict]:
+        with Session(engine) as session:
+            resultado = session.execute(statement, execution_options={"yield_per": TAMANO_LOTE})
+            registros = (dict(fila._mapping) for fila in resultado)
+            yield from agrupar(registros) if agrupar else registros
+
+    if formato == "csv":
+        contenido = _lineas_csv(columnas, filas())
+    else:
+        contenido = (_linea_ndjson(fila) for fila in filas())
+
+    extension = "csv" if formato == "csv" else "ndjson"
+    return StreamingResponse(
+        contenido,
+        media_type=FORMATOS[formato],
+        headers={"Content-Disposition": f'attachment; filename="{nombre}.{extension}"'},
+    )
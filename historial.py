@@ -1,36 +1,64 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlmodel import select
 from typing import List
-from db import get_session
+from db import get_session, get_async_session
 from models import Historial, HistorialCreate, Estudiante, HistorialBase 
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from paginacion import Paginacion, obtener_paginacion, paginar_rapido
+from promedios import calcular_acumulados
+from etag import condicional, condicional_tablas, etag_fila
+from metricas import RutaMedida
+from lotes import consultar_por_ids, obtener_ids, responder_lote
 
 
-router = APIRouter(prefix="/historiales", tags=["Historial Académico"])
+router = APIRouter(prefix="/historiales", tags=["Historial Académico"], route_class=RutaMedida)
 
 
 @router.get("/", response_model=List[Historial], summary="Listar todos los Historiales")
-def listar_historiales(session: Session = Depends(get_session)):
-    return session.exec(select(Historial)).all()
+async def listar_historiales(request: Request, response: Response, session: AsyncSession = Depends(get_async_session), paginacion: Paginacion = Depends(obtener_paginacion)):
+    sin_cambios = await condicional_tablas(request, response, session, "historial")
+    if sin_cambios is not None:
+        return sin_cambios
+    return await paginar_rapido(session, Historial, [], paginacion, response)
+
+
+@router.get("/lote", response_model=List[Historial], summary="Obtener varios historiales por ID")
+async def obtener_historiales_lote(request: Request, response: Response, ids: List[int] = Depends(obtener_ids), session: AsyncSession = Depends(get_async_session)):
+    """
+    Multi-get: los historiales pedidos en `ids` (por ID de historial) con una sola consulta IN, en el orden pedido.
+    Los IDs inexistentes se omiten y se informan en la cabecera X-Missing-Ids.
+    - Retorna 400 Bad Request si `ids` no es una lista de enteros o supera MAXIMO_IDS_LOTE.
+    """
+    sin_cambios = await condicional_tablas(request, response, session, "historial")
+    if sin_cambios is not None:
+        return sin_cambios
+    return responder_lote(await consultar_por_ids(session, Historial, ids), ids, response)
 
 
 @router.get("/estudiante/{estudiante_id}", response_model=Historial, summary="Obtener Historial por ID del Estudiante")
-def obtener_historial_por_estudiante(estudiante_id: int, session: Session = Depends(get_session)):
+async def obtener_historial_por_estudiante(estudiante_id: int, request: Request, response: Response, session: AsyncSession = Depends(get_async_session)):
     """
     Busca el Historial Académico asociado a un Estudiante específico.
     - Retorna 404 Not Found si no existe Historial para ese ID.
     """
-    historial = session.exec(select(Historial).where(Historial.estudiante_id == estudiante_id)).first()
+    historial = (await session.exec(select(Historial).where(Historial.estudiante_id == estudiante_id))).first()
     if not historial:
         raise HTTPException(status_code=404, detail=f"No se encontró Historial para el Estudiante ID {estudiante_id}")
+    sin_cambios = condicional(request, response, etag_fila(Historial, historial.id, historial.version), historial.updated_at)
+    if sin_cambios is not None:
+        return sin_cambios
     return historial
 
 
 @router.get("/{historial_id}", response_model=Historial, summary="Obtener Historial por ID")
-def obtener_historial(historial_id: int, session: Session = Depends(get_session)):
-    historial = session.get(Historial, historial_id)
+async def obtener_historial(historial_id: int, request: Request, response: Response, session: AsyncSession = Depends(get_async_session)):
+    historial = await session.get(Historial, historial_id)
     if not historial:
         raise HTTPException(status_code=404, detail="Historial no encontrado")
+    sin_cambios = condicional(request, response, etag_fila(Historial, historial.id, historial.version), historial.updated_at)
+    if sin_cambios is not None:
+        return sin_cambios
     return historial
 
 
@@ -40,6 +68,7 @@ def crear_historial(nuevo: HistorialCreate, session: Session = Depends(get_sessi
     """
     Crea un nuevo Historial Académico. 
     Aplica Lógica de Negocio: La relación es 1:1, por lo que un estudiante solo puede tener un Historial.
+    El promedio se calcula desde las matrículas existentes y a partir de ahí se mantiene incrementalmente.
     - Retorna 400 Bad Request si el Estudiante ya tiene un Historial.
     - Retorna 404 Not Found si el Estudiante ID no existe.
     """
@@ -54,7 +83,7 @@ def crear_historial(nuevo: HistorialCreate, session: Session = Depends(get_sessi
         raise HTTPException(status_code=400, detail="El Estudiante ya tiene un Historial asociado")
         
     
-    db_historial = Historial.model_validate(nuevo)
+    db_historial = Historial(estudiante_id=nuevo.estudiante_id, **calcular_acumulados(session, nuevo.estudiante_id))
     session.add(db_historial)
     session.commit()
     session.refresh(db_historial)
@@ -63,6 +92,10 @@ def crear_historial(nuevo: HistorialCreate, session: Session = Depends(get_sessi
 
 @router.put("/{historial_id}", response_model=Historial, summary="Actualizar un registro de Historial")
 def actualizar_historial(historial_id: int, historial_actualizado: HistorialBase, session: Session = Depends(get_session)):
+    """
+    El promedio ya no se escribe a mano: este endpoint lo recalcula desde las matrículas del estudiante.
+    - Retorna 400 Bad Request si se intenta cambiar el estudiante_id.
+    """
     historial_db = session.get(Historial, historial_id)
     if not historial_db:
         raise HTTPException(status_code=404, detail="Historial no encontrado")
@@ -71,8 +104,7 @@ def actualizar_historial(historial_id: int, historial_actualizado: HistorialBase
     if hasattr(historial_actualizado, 'estudiante_id') and historial_actualizado.estudiante_id != historial_db.estudiante_id: #Has atribute
         raise HTTPException(status_code=400, detail="El estudiante_id no puede ser modificado directamente en este endpoint de PUT. Cree un nuevo Historial para otro Estudiante.")
 
-    update_data = historial_actualizado.model_dump(exclude_unset=True)
-    for key, value in update_data.items():
+    for key, value in calcular_acumulados(session, historial_db.estudiante_id).items():
         setattr(historial_db, key, value)  #Set atribute
 
     session.add(historial_db)
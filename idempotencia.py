@@ -0,0 +1,166 @@
+import asyncio
+import hashlib
+import os
+from typing import Dict, List, Optional, Tuple
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from cache import crear_backend
+
+
+# Tiempo durante el cual un reintento con la misma clave recibe la respuesta guardada.
+IDEMPOTENCIA_TTL_S = float(os.getenv("IDEMPOTENCIA_TTL_S", str(24 * 3600)))
+IDEMPOTENCIA_MAX_CLAVES = int(os.getenv("IDEMPOTENCIA_MAX_CLAVES", "10000"))
+LARGO_MAXIMO_CLAVE = 255
+METODOS_IDEMPOTENTES = {"POST"}
+CABECERA_CLAVE = b"idempotency-key"
+CABECERA_REPETIDA = b"idempotent-replayed"
+
+router = APIRouter(prefix="/idempotencia", tags=["Idempotencia"])
+
+# (huella de la petición, status, cabeceras, cuerpo)
+RespuestaGuardada = Tuple[str, int, List[Tuple[bytes, bytes]], bytes]
+
+
+class AlmacenIdempotencia:
+    """
+    Respuestas ya enviadas por clave de idempotencia (acotadas por cantidad y con TTL) y peticiones en curso.
+    Con CACHE_COMPARTIDA_DIR (servidor.py lo define con varios workers) las respuestas se comparten entre
+    procesos y un reintento recibe la respuesta guardada en cualquier worker. La fusión de peticiones en curso
+    es por proceso: dos intentos simultáneos que caen en workers distintos pueden ejecutarse ambos.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or crear_backend("idempotencia", max_entradas=IDEMPOTENCIA_MAX_CLAVES, ttl=IDEMPOTENCIA_TTL_S)
+        self.en_curso: Dict[str, asyncio.Event] = {}
+        self.ejecutadas = 0
+        self.repetidas = 0
+        self.fusionadas = 0
+        self.conflictos = 0
+
+    def estadisticas(self) -> dict:
+        return {
+            "ejecutadas": self.ejecutadas,
+            "repetidas": self.repetidas,
+            "fusionadas": self.fusionadas,
+            "conflictos": self.conflictos,
+            "en_curso": len(self.en_curso),
+        }
+
+
+almacen_idempotencia = AlmacenIdempotencia()
+
+
+async def _leer_cuerpo(receive) -> Optional[bytes]:
+    cuerpo = bytearray()
+    while True:
+        mensaje = await receive()
+        if mensaje["type"] == "http.disconnect":
+            return None
+        cuerpo += mensaje.get("body", b"")
+        if not mensaje.get("more_body"):
+            return bytes(cuerpo)
+
+
+def _huella(scope, cuerpo: bytes) -> str:
+    return hashlib.blake2b(
+        b"|".join([scope["method"].encode(), scope["path"].encode(), scope.get("query_string", b""), cuerpo]), digest_size=16
+    ).hexdigest()
+
+
+class MiddlewareIdempotencia:
+    """
+    Middleware ASGI para la cabecera Idempotency-Key en los POST. La primera petición con una clave se ejecuta
+    y su respuesta (salvo errores 5xx) se guarda; los reintentos con la misma clave, ruta y cuerpo reciben esa
+    respuesta (con la cabecera Idempotent-Replayed) sin llegar al endpoint ni a la base de datos.
+    Los reintentos que llegan mientras la primera sigue en curso esperan su resultado en vez de ejecutarse.
+    - Retorna 400 si la clave está vacía o supera LARGO_MAXIMO_CLAVE caracteres.
+    - Retorna 422 si la clave ya se usó con otra petición (distinto cuerpo o parámetros).
+    """
+
+    def __init__(self, app, almacen: AlmacenIdempotencia = almacen_idempotencia):
+        self.app = app
+        self.almacen = almacen
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in METODOS_IDEMPOTENTES:
+            return await self.app(scope, receive, send)
+        llave = next((valor for nombre, valor in scope["headers"] if nombre == CABECERA_CLAVE), None)
+        if llave is None:
+            return await self.app(scope, receive, send)
+        if not llave.strip() or len(llave) > LARGO_MAXIMO_CLAVE:
+            respuesta = JSONResponse(status_code=400, content={"detail": f"Idempotency-Key debe tener entre 1 y {LARGO_MAXIMO_CLAVE} caracteres."})
+            return await respuesta(scope, receive, send)
+
+        cuerpo = await _leer_cuerpo(receive)
+        if cuerpo is None:
+            return
+        huella = _huella(scope, cuerpo)
+        clave = f"idempotencia:{scope['path']}:{llave.decode('latin-1')}"
+
+        fusionada = False
+        while True:
+            encontrado, guardada = self.almacen.backend.obtener(clave)
+            if encontrado:
+                return await self._responder_guardada(guardada, huella, scope, receive, send)
+            evento = self.almacen.en_curso.get(clave)
+            if evento is None:
+                break
+            # Otra petición con la misma clave se está ejecutando: se espera su respuesta. Si terminó
+            # sin guardarla (error 5xx o desconexión), esta pasa a ejecutarse.
+            if not fusionada:
+                fusionada = True
+                self.almacen.fusionadas += 1
+            await evento.wait()
+
+        evento = self.almacen.en_curso[clave] = asyncio.Event()
+        try:
+            self.almacen.ejecutadas += 1
+            respuesta = await self._ejecutar(scope, cuerpo, receive, send)
+            if respuesta is not None:
+                self.almacen.backend.guardar(clave, (huella, *respuesta))
+        finally:
+            del self.almacen.en_curso[clave]
+            evento.set()
+
+    async def _ejecutar(self, scope, cuerpo: bytes, receive, send) -> Optional[Tuple[int, List[Tuple[bytes, bytes]], bytes]]:
+        """
+        Ejecuta la petición con el cuerpo ya leído y devuelve la respuesta enviada, o None si no debe guardarse.
+        """
+        entregado = False
+        inicio, partes = None, []
+
+        async def receive_leido():
+            nonlocal entregado
+            if not entregado:
+                entregado = True
+                return {"type": "http.request", "body": cuerpo, "more_body": False}
+            return await receive()
+
+        async def send_guardando(mensaje):
+            nonlocal inicio
+            if mensaje["type"] == "http.response.start":
+                # Copia antes de enviar: los middlewares externos agregan cabeceras propias (p. ej. Server-Timing).
+                inicio = (mensaje["status"], list(mensaje.get("headers", [])))
+            elif mensaje["type"] == "http.response.body":
+                partes.append(mensaje.get("body", b""))
+            await send(mensaje)
+
+        await self.app(scope, receive_leido, send_guardando)
+        if inicio is None or inicio[0] >= 500:
+            return None
+        return inicio[0], inicio[1], b"".join(partes)
+
+    async def _responder_guardada(self, guardada: RespuestaGuardada, huella: str, scope, receive, send):
+        huella_original, status, cabeceras, cuerpo = guardada
+        if huella_original != huella:
+            self.almacen.conflictos += 1
+            respuesta = JSONResponse(status_code=422, content={"detail": "La Idempotency-Key ya se usó con otra petición (distinto cuerpo o parámetros)."})
+            return await respuesta(scope, receive, send)
+        self.almacen.repetidas += 1
+        await send({"type": "http.response.start", "status": status, "headers": cabeceras + [(CABECERA_REPETIDA, b"true")]})
+        await send({"type": "http.response.body", "body": cuerpo})
+
+
+@router.get("/estadisticas", summary="Peticiones ejecutadas, repetidas y fusionadas por Idempotency-Key")
+def estadisticas_idempotencia():
+    return almacen_idempotencia.estadisticas()
@@ -0,0 +1,227 @@
+import argparse
+import csv
+import io
+import json
+from typing import BinaryIO, Dict, FrozenSet, Iterator, List, Tuple
+from pydantic import ValidationError
+from sqlalchemy import or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+from models import Estudiante, EstudianteCreate, Materia, MateriaCreate, ResumenImportacion, ahora
+from promedios import recalcular_promedios
+from cupos import recalcular_cupos
+from cambios import ACTUALIZAR, CREAR, registrar_cambios
+
+
+TAMANO_LOTE_IMPORTACION = 1000
+MAXIMO_ERRORES_REPORTADOS = 100
+
+# entidad -> (tabla, esquema de validación, clave del ON CONFLICT, otras columnas únicas)
+ENTIDADES = {
+    "estudiantes": (Estudiante, EstudianteCreate, "cedula", ["correo"]),
+    "materias": (Materia, MateriaCreate, "codigo", []),
+}
+
+
+def detectar_formato(nombre_archivo: str) -> str:
+    """
+    Deduce el formato por la extensión: .csv o JSON Lines (.json, .jsonl, .ndjson, un objeto por línea).
+    """
+    nombre = (nombre_archivo or "").lower()
+    if nombre.endswith(".csv"):
+        return "csv"
+    if nombre.endswith((".json", ".jsonl", ".ndjson")):
+        return "json"
+    raise ValueError("Formato no soportado: use .csv o JSON Lines (.json, .jsonl, .ndjson)")
+
+
+def leer_registros(archivo: BinaryIO, formato: str) -> Iterator[Tuple[int, dict]]:
+    """
+    Lee el archivo línea por línea (sin cargarlo completo) y devuelve (número de línea, registro).
+    """
+    texto = io.TextIOWrapper(archivo, encoding="utf-8-sig", newline="")
+    if formato == "csv":
+        for numero, fila in enumerate(csv.DictReader(texto), start=2):
+            yield numero, {clave.strip(): (valor.strip() or None) if valor is not None else None for clave, valor in fila.items() if clave}
+        return
+
+    for numero, linea in enumerate(texto, start=1):
+        if linea.strip():
+            try:
+                yield numero, json.loads(linea)
+            except json.JSONDecodeError as error:
+                yield numero, {"__error__": f"JSON inválido: {error.msg}"}
+
+
+def _insert_dialecto(session: Session):
+    nombre = session.get_bind().dialect.name
+    if nombre == "postgresql":
+        return postgresql.insert
+    if nombre == "sqlite":
+        return sqlite.insert
+    raise RuntimeError(f"El upsert masivo no está soportado para la base de datos '{nombre}'")
+
+
+class _Importador:
+    """
+    Acumula registros válidos en lotes y los escribe con INSERT ... ON CONFLICT DO UPDATE.
+    Un lote se escribe al llenarse o cuando llega una clave ya presente en él,
+    de modo que una clave repetida en el archivo se cuenta como actualización.
+    """
+
+    def __init__(self, session: Session, entidad: str):
+        self.session = session
+        self.modelo, self.esquema, self.clave, self.unicas = ENTIDADES[entidad]
+        self.resumen = ResumenImportacion()
+        self.lote: List[Tuple[int, dict]] = []
+        self.claves_lote: Dict[str, set] = {columna: set() for columna in [self.clave] + self.unicas}
+        self.statements: Dict[FrozenSet[str], object] = {}
+
+    def statement(self, columnas: FrozenSet[str]):
+        """
+        Upsert que solo actualiza las columnas presentes en el registro: una columna que el archivo no trae
+        conserva su valor en vez de quedar en NULL. Se arma uno por combinación de columnas.
+        """
+        if columnas not in self.statements:
+            insert = _insert_dialecto(self.session)(self.modelo)
+            actualizables = [columna for columna in self.esquema.model_fields if columna in columnas and columna != self.clave]
+            self.statements[columnas] = insert.on_conflict_do_update(
+                index_elements=[self.clave],
+                set_={
+                    **{columna: insert.excluded[columna] for columna in actualizables},
+                    "version": self.modelo.version + 1,
+                    "updated_at": insert.excluded.updated_at,
+                },
+            )
+        return self.statements[columnas]
+
+    def rechazar(self, numero: int, motivo: str):
+        self.resumen.rechazados += 1
+        if len(self.resumen.errores) < MAXIMO_ERRORES_REPORTADOS:
+            self.resumen.errores.append(f"Línea {numero}: {motivo}")
+
+    def agregar(self, numero: int, registro: dict):
+        if "__error__" in registro:
+            return self.rechazar(numero, registro["__error__"])
+        try:
+            datos = self.esquema.model_validate(registro).model_dump(exclude_unset=True)
+        except ValidationError as error:
+            return self.rechazar(numero, "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in error.errors()))
+
+        faltantes = [columna for columna in [self.clave] + self.unicas if not datos.get(columna)]
+        if faltantes:
+            return self.rechazar(numero, f"Faltan campos obligatorios: {', '.join(faltantes)}")
+
+        if any(datos[columna] in valores for columna, valores in self.claves_lote.items()):
+            self.escribir()
+        self.lote.append((numero, datos))
+        for columna, valores in self.claves_lote.items():
+            valores.add(datos[columna])
+        if len(self.lote) >= TAMANO_LOTE_IMPORTACION:
+            self.escribir()
+
+    def escribir(self):
+        if not self.lote:
+            return
+        columnas = [self.clave] + self.unicas
+        existentes = self.session.execute(
+            select(*[getattr(self.modelo, columna) for columna in columnas]).where(
+                or_(*[getattr(self.modelo, columna).in_(self.claves_lote[columna]) for columna in columnas])
+            )
+        ).all()
+        claves_existentes = {fila[0] for fila in existentes}
+        duenos = {columna: {fila[i + 1]: fila[0] for fila in existentes} for i, columna in enumerate(self.unicas)}
+
+        filas, insertados, actualizados = [], 0, 0
+        for numero, datos in self.lote:
+            conflicto = next(
+                (columna for columna in self.unicas if duenos[columna].get(datos[columna], datos[self.clave]) != datos[self.clave]),
+                None,
+            )
+            if conflicto:
+                self.rechazar(numero, f"El {conflicto} '{datos[conflicto]}' ya pertenece a otro registro.")
+                continue
+            filas.append((numero, datos))
+            if datos[self.clave] in claves_existentes:
+                actualizados += 1
+            else:
+                insertados += 1
+
+        try:
+            if filas:
+                momento = ahora()
+                grupos: Dict[FrozenSet[str], List[dict]] = {}
+                for _, datos in filas:
+                    grupos.setdefault(frozenset(datos), []).append({**datos, "updated_at": momento})
+                for columnas, parametros in grupos.items():
+                    self.session.execute(self.statement(columnas), parametros)
+                self.registrar_cambios([datos[self.clave] for _, datos in filas], claves_existentes)
+            self.session.commit()
+            self.resumen.insertados += insertados
+            self.resumen.actualizados += actualizados
+        except IntegrityError:
+            # Un lote con conflictos cruzados entre sus propias filas se reintenta fila por fila.
+            self.session.rollback()
+            self.escribir_fila_por_fila(filas, claves_existentes)
+
+        self.lote.clear()
+        for valores in self.claves_lote.values():
+            valores.clear()
+
+    def registrar_cambios(self, claves: List[str], claves_existentes: set):
+        """
+        El upsert no informa qué filas insertó: los IDs se leen por clave y las que ya existían cuentan como actualizadas.
+        """
+        clave = getattr(self.modelo, self.clave)
+        ids = self.session.execute(select(self.modelo.id, clave).where(clave.in_(claves))).all()
+        registrar_cambios(self.session, self.modelo, [fila[0] for fila in ids if fila[1] not in claves_existentes], CREAR)
+        registrar_cambios(self.session, self.modelo, [fila[0] for fila in ids if fila[1] in claves_existentes], ACTUALIZAR)
+
+    def escribir_fila_por_fila(self, filas: List[Tuple[int, dict]], claves_existentes: set):
+        for numero, datos in filas:
+            try:
+                self.session.execute(self.statement(frozenset(datos)), [{**datos, "updated_at": ahora()}])
+                self.registrar_cambios([datos[self.clave]], claves_existentes)
+                self.session.commit()
+            except IntegrityError:
+                self.session.rollback()
+                self.rechazar(numero, f"Conflicto de unicidad para {self.clave} '{datos[self.clave]}'.")
+                continue
+            if datos[self.clave] in claves_existentes:
+                self.resumen.actualizados += 1
+            else:
+                self.resumen.insertados += 1
+
+
+def importar(session: Session, entidad: str, archivo: BinaryIO, formato: str) -> ResumenImportacion:
+    """
+    Importa (upsert) estudiantes por cédula o materias por código desde un archivo CSV o JSON Lines.
+    Procesa el archivo en streaming y escribe en lotes de TAMANO_LOTE_IMPORTACION filas,
+    así que la memoria usada no depende del tamaño del archivo.
+    Si se actualizaron materias (sus créditos pueden cambiar) se recalculan los promedios ponderados;
+    al importar materias también se recalculan los cupos disponibles.
+    """
+    importador = _Importador(session, entidad)
+    for numero, registro in leer_registros(archivo, formato):
+        importador.agregar(numero, registro)
+    importador.escribir()
+    if entidad == "materias":
+        recalcular_cupos(session)
+    if entidad == "materias" and importador.resumen.actualizados:
+        recalcular_promedios(session)
+    return importador.resumen
+
+
+if __name__ == "__main__":
+    from db import create_db_and_tables, engine
+
+    parser = argparse.ArgumentParser(description="Importación masiva (upsert) de estudiantes o materias.")
+    parser.add_argument("entidad", choices=sorted(ENTIDADES))
+    parser.add_argument("archivo", help="Archivo .csv o JSON Lines (.json, .jsonl, .ndjson)")
+    args = parser.parse_args()
+
+    create_db_and_tables()
+    with open(args.archivo, "rb") as archivo, Session(engine) as session:
+        resumen = importar(session, args.entidad, archivo, detectar_formato(args.archivo))
+    print(resumen.model_dump_json(indent=2))
@@ -0,0 +1,75 @@
+from typing import Dict, List, Optional
+from fastapi import HTTPException, Query, Response
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from cache import cache_catalogo
+
+
+# Una sola consulta IN por lote (SQLite antiguo admite 999 parámetros por sentencia).
+MAXIMO_IDS_LOTE = 500
+CABECERA_FALTANTES = "X-Missing-Ids"
+
+
+def obtener_ids(ids: str = Query(..., description=f"IDs separados por coma (ej: 1,2,3), máximo {MAXIMO_IDS_LOTE}")) -> List[int]:
+    """
+    Dependencia de los endpoints `/lote`: IDs sin repetir, en el orden pedido.
+    - Retorna 400 Bad Request si algún valor no es un entero o si se piden más de MAXIMO_IDS_LOTE.
+    """
+    return convertir_ids(ids, MAXIMO_IDS_LOTE)
+
+
+def convertir_ids(ids: str, maximo: Optional[int] = None) -> List[int]:
+    """
+    Convierte "1,2,3" en la lista de IDs sin repetir, en el orden pedido.
+    - Retorna 400 Bad Request si algún valor no es un entero, si no hay ninguno o si se piden más de `maximo`.
+    """
+    try:
+        pedidos = [int(valor) for valor in ids.split(",") if valor.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="`ids` debe ser una lista de enteros separados por coma.")
+    pedidos = list(dict.fromkeys(pedidos))
+    if not pedidos:
+        raise HTTPException(status_code=400, detail="`ids` debe contener al menos un ID.")
+    if maximo is not None and len(pedidos) > maximo:
+        raise HTTPException(status_code=400, detail=f"No se pueden pedir más de {maximo} IDs por lote.")
+    return pedidos
+
+
+async def consultar_por_ids(
+    session: AsyncSession, modelo, ids: List[int], espacio: Optional[str] = None, marca: Optional[str] = None
+) -> Dict[int, object]:
+    """
+    Filas de los IDs pedidos (activas o no) con una sola consulta IN por la clave primaria.
+    Con `espacio` ("materia", "profesor") se sirven primero desde la cache del catálogo, con las mismas
+    claves que el GET por ID, y solo los que faltan van a la base de datos. Con `marca` (la del ETag de la
+    respuesta) las claves la incluyen, así el lote nunca combina ese ETag con filas guardadas antes.
+    Devuelve {id: fila}; los IDs inexistentes no aparecen.
+    """
+    encontrados: Dict[int, object] = {}
+    claves = {}
+    if espacio:
+        for entidad_id in ids:
+            claves[entidad_id] = cache_catalogo.clave(espacio, f"id:{entidad_id}" if marca is None else f"id:{entidad_id}@{marca}")
+            encontrado, valor = cache_catalogo.obtener(claves[entidad_id])
+            if encontrado:
+                encontrados[entidad_id] = valor
+
+    faltantes = [entidad_id for entidad_id in ids if entidad_id not in encontrados]
+    if faltantes:
+        for fila in (await session.exec(select(modelo).where(modelo.id.in_(faltantes)))).all():
+            if espacio:
+                encontrados[fila.id] = fila.model_dump()
+                cache_catalogo.guardar(claves[fila.id], encontrados[fila.id])
+            else:
+                encontrados[fila.id] = fila
+    return encontrados
+
+
+def responder_lote(encontrados: Dict[int, object], ids: List[int], response: Response) -> list:
+    """
+    Lista en el orden pedido; los IDs inexistentes se informan en la cabecera X-Missing-Ids.
+    """
+    faltantes = [entidad_id for entidad_id in ids if entidad_id not in encontrados]
+    if faltantes:
+        response.headers[CABECERA_FALTANTES] = ",".join(map(str, faltantes))
+    return [encontrados[entidad_id] for entidad_id in ids if entidad_id in encontrados]
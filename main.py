@@ -1,17 +1,41 @@
+import os
 from fastapi import FastAPI
-from db import create_db_and_tables
+from db import async_engine, create_db_and_tables, engine
 from estudiante import router as estudiante_router
 from materia import router as materia_router
 from profesor import router as profesor_router
 from matricula import router as matricula_router
 from historial import router as historial_router
 from reporte import router as reportes_router
+from cache import router as cache_router
+from metricas import MiddlewareMetricas, router as metricas_router
+from calificaciones import cola_calificaciones, router as calificaciones_router
+from busqueda import router as busqueda_router
+from certificados import cerrar_procesos, router as certificados_router
+from analitica import programador_analitica, router as analitica_router
+from cambios import router as cambios_router
+from idempotencia import MiddlewareIdempotencia, router as idempotencia_router
+from archivo import programador_archivo, router as archivo_router
 from contextlib import asynccontextmanager
 
+# servidor.py crea el esquema una sola vez en el proceso maestro y lo desactiva en los workers.
+ESQUEMA_AL_INICIAR = os.getenv("ESQUEMA_AL_INICIAR", "1") == "1"
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    create_db_and_tables() 
+    if ESQUEMA_AL_INICIAR:
+        create_db_and_tables()
+    cola_calificaciones.iniciar(engine)
+    programador_analitica.iniciar(engine)
+    programador_archivo.iniciar(engine)
+    # La primera petición no paga la apertura de la conexión async (hilo de aiosqlite, PRAGMAs).
+    async with async_engine.connect():
+        pass
     yield
+    programador_archivo.detener()
+    programador_analitica.detener()
+    cola_calificaciones.detener()
+    cerrar_procesos()
 
 app = FastAPI(
     title="Universidad API: Sistema de Matrículas", 
@@ -24,6 +48,19 @@ app.include_router(profesor_router, prefix="/profesores", tags=["Profesores"])
 app.include_router(historial_router, prefix="/historiales", tags=["Historial Académico"])
 app.include_router(matricula_router, prefix="/matriculas", tags=["Matrículas"])
 app.include_router(reportes_router)
+app.include_router(cache_router)
+app.include_router(metricas_router)
+app.include_router(calificaciones_router)
+app.include_router(busqueda_router)
+app.include_router(certificados_router)
+app.include_router(analitica_router)
+app.include_router(cambios_router)
+app.include_router(idempotencia_router)
+app.include_router(archivo_router)
+
+# El último agregado es el más externo: las métricas también miden las respuestas repetidas.
+app.add_middleware(MiddlewareIdempotencia)
+app.add_middleware(MiddlewareMetricas)
 
 @app.get("/")
 def root():
@@ -1,54 +1,114 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, File, HTTPException, Request, Response, UploadFile
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import List, Optional 
-from db import get_session
+from db import get_session, get_async_session
 
-from models import Materia, MateriaCreate 
+from models import Materia, MateriaCreate, ResumenImportacion
+from importacion import detectar_formato, importar
+from paginacion import Paginacion, obtener_paginacion, consultar_pagina_async, responder_pagina
+from cache import cache_catalogo
+from etag import condicional, condicional_tablas, etag_fila
+from promedios import registrar_cambio_creditos
+from cupos import ajustar_cupo
+from metricas import RutaMedida
+from cambios import ACTUALIZAR, registrar_cambios
+from lotes import consultar_por_ids, obtener_ids, responder_lote
+from archivo import desarchivar, paginar_eliminados
 
-router = APIRouter(prefix="/materias", tags=["Materias"])
+router = APIRouter(prefix="/materias", tags=["Materias"], route_class=RutaMedida)
 
 
 @router.get("/", response_model=List[Materia], summary="Listar todas las materias (Filtro por Créditos)")
-def listar_materias(session: Session = Depends(get_session), creditos: Optional[int] = None):
+async def listar_materias(request: Request, response: Response, session: AsyncSession = Depends(get_async_session), creditos: Optional[int] = None, paginacion: Paginacion = Depends(obtener_paginacion)):
     """
     Lista todas las materias activas, con la opción de filtrar por número de créditos.
+    Paginado por cursor: usar el valor de la cabecera X-Next-Cursor como `after_id` de la siguiente página.
+    Las páginas se sirven desde la cache del catálogo, que se invalida en cada escritura de materias.
     """
-    statement = select(Materia).where(Materia.active == True)
-    if creditos is not None:
-        statement = statement.where(Materia.creditos == creditos)
+    sin_cambios = await condicional_tablas(request, response, session, "materia")
+    if sin_cambios is not None:
+        return sin_cambios
+    clave = cache_catalogo.clave(
+        "materia", f"lista:{request.state.marca_tablas}:{creditos}:{paginacion.after_id}:{paginacion.limit}:{paginacion.fields}"
+    )
+    encontrado, pagina = cache_catalogo.obtener(clave)
+    if not encontrado:
+        condiciones = [Materia.active == True]
+        if creditos is not None:
+            condiciones.append(Materia.creditos == creditos)
+        pagina = await consultar_pagina_async(session, Materia, condiciones, paginacion)
+        cache_catalogo.guardar(clave, pagina)
         
-    return session.exec(statement).all()
+    return responder_pagina(*pagina, paginacion, response)
 
 
 @router.get("/eliminadas", response_model=List[Materia], summary="Listar materias retiradas" )
-def listar_materias_eliminadas(session: Session = Depends(get_session)):
+async def listar_materias_eliminadas(request: Request, response: Response, session: AsyncSession = Depends(get_async_session), paginacion: Paginacion = Depends(obtener_paginacion)):
     """
-    Lista todas las materias que han sido marcadas como inactivas (retiradas).
+    Lista todas las materias que han sido marcadas como inactivas (retiradas), paginado por cursor:
+    las retiradas recientemente y las que ya pasaron al archivo (ver archivo.py).
     """
-    return session.exec(select(Materia).where(Materia.active == False)).all()
+    sin_cambios = await condicional_tablas(request, response, session, "materia", "materiaarchivada")
+    if sin_cambios is not None:
+        return sin_cambios
+    return await paginar_eliminados(session, Materia, paginacion, response)
+
+
+@router.get("/lote", response_model=List[Materia], summary="Obtener varias materias por ID")
+async def obtener_materias_lote(request: Request, response: Response, ids: List[int] = Depends(obtener_ids), session: AsyncSession = Depends(get_async_session)):
+    """
+    Multi-get: las materias pedidas en `ids` (activas o no) con una sola consulta IN, en el orden pedido.
+    Se sirven desde la cache del catálogo y solo las que falten se leen de la base.
+    Los IDs inexistentes se omiten y se informan en la cabecera X-Missing-Ids.
+    - Retorna 400 Bad Request si `ids` no es una lista de enteros o supera MAXIMO_IDS_LOTE.
+    """
+    sin_cambios = await condicional_tablas(request, response, session, "materia")
+    if sin_cambios is not None:
+        return sin_cambios
+    return responder_lote(await consultar_por_ids(session, Materia, ids, "materia", request.state.marca_tablas), ids, response)
 
 
 @router.get("/codigo/{materia_codigo}", response_model=Materia, summary="Buscar materia por código")
-def obtener_materia_por_codigo(materia_codigo: str, session: Session = Depends(get_session)):
+async def obtener_materia_por_codigo(materia_codigo: str, request: Request, response: Response, session: AsyncSession = Depends(get_async_session)):
     """
-    Busca una materia utilizando su código único.
+    Busca una materia utilizando su código único (con cache del catálogo).
     - Retorna 404 Not Found si el código no existe.
     """
-    materia = session.exec(select(Materia).where(Materia.codigo == materia_codigo)).first()
-    if not materia:
-        raise HTTPException(status_code=404, detail="Materia no encontrada o código mal digitado")
+    clave = cache_catalogo.clave("materia", f"codigo:{materia_codigo}")
+    encontrado, materia = cache_catalogo.obtener(clave)
+    if not encontrado:
+        materia = (await session.exec(select(Materia).where(Materia.codigo == materia_codigo))).first()
+        if not materia:
+            raise HTTPException(status_code=404, detail="Materia no encontrada o código mal digitado")
+        materia = materia.model_dump()
+        cache_catalogo.guardar(clave, materia)
+
+    sin_cambios = condicional(request, response, etag_fila(Materia, materia["id"], materia["version"]), materia["updated_at"])
+    if sin_cambios is not None:
+        return sin_cambios
     return materia
 
 
 @router.get("/{materia_id}", response_model=Materia, summary="Obtener materia por ID")
-def obtener_materia(materia_id: int, session: Session = Depends(get_session)):
+async def obtener_materia(materia_id: int, request: Request, response: Response, session: AsyncSession = Depends(get_async_session)):
     """
-    Busca una materia utilizando su ID primario.
+    Busca una materia utilizando su ID primario (con cache del catálogo).
     - Retorna 404 Not Found si el ID no existe.
     """
-    materia = session.get(Materia, materia_id)
-    if not materia:
-        raise HTTPException(status_code=404, detail="Materia no encontrada")
+    clave = cache_catalogo.clave("materia", f"id:{materia_id}")
+    encontrado, materia = cache_catalogo.obtener(clave)
+    if not encontrado:
+        materia = await session.get(Materia, materia_id)
+        if not materia:
+            raise HTTPException(status_code=404, detail="Materia no encontrada")
+        materia = materia.model_dump()
+        cache_catalogo.guardar(clave, materia)
+
+    sin_cambios = condicional(request, response, etag_fila(Materia, materia["id"], materia["version"]), materia["updated_at"])
+    if sin_cambios is not None:
+        return sin_cambios
     return materia
 
 
@@ -66,12 +126,30 @@ def crear_materia(materia: MateriaCreate, session: Session = Depends(get_session
 
 
     db_materia = Materia.model_validate(materia)
+    db_materia.cupos_disponibles = db_materia.cupo
     session.add(db_materia)
     session.commit()
+    cache_catalogo.invalidar("materia")
     session.refresh(db_materia)
     return db_materia
 
 
+@router.post("/importar", response_model=ResumenImportacion, summary="Importar materias desde CSV/JSON Lines (upsert por código)")
+def importar_materias(archivo: UploadFile = File(...), session: Session = Depends(get_session)):
+    """
+    Inserta o actualiza materias en lotes usando INSERT ... ON CONFLICT sobre el código.
+    - Retorna 400 Bad Request si el archivo no es .csv ni JSON Lines.
+    """
+    try:
+        formato = detectar_formato(archivo.filename)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    try:
+        return importar(session, "materias", archivo.file, formato)
+    finally:
+        cache_catalogo.invalidar("materia")
+
+
 @router.delete("/{materia_id}", summary="Marcar materia como eliminada ")
 def eliminar_materia(materia_id: int, session: Session = Depends(get_session)):
     """
@@ -85,25 +163,64 @@ def eliminar_materia(materia_id: int, session: Session = Depends(get_session)):
     materia.active = False
     session.add(materia)
     session.commit()
+    cache_catalogo.invalidar("materia")
     return {"mensaje": f"Materia {materia_id} marcada como eliminada"}
 
 
+@router.post("/{materia_id}/restaurar", response_model=Materia, summary="Restaurar una materia eliminada")
+def restaurar_materia(materia_id: int, session: Session = Depends(get_session)):
+    """
+    Deshace la eliminación lógica: la materia vuelve del archivo si ya estaba archivada y queda activa,
+    con los cupos disponibles recalculados.
+    - Retorna 404 Not Found si el ID no existe ni en la tabla ni en el archivo.
+    - Retorna 409 Conflict si la materia ya está activa o si otra materia tomó su código.
+    """
+    try:
+        desarchivar(session, Materia, materia_id)
+    except IntegrityError:
+        session.rollback()
+        raise HTTPException(status_code=409, detail="Otra materia ya usa el código de la materia archivada.")
+    materia = session.get(Materia, materia_id)
+    if not materia:
+        raise HTTPException(status_code=404, detail="Materia no encontrada")
+    if materia.active:
+        raise HTTPException(status_code=409, detail="La materia no está eliminada.")
+
+    materia.active = True
+    session.add(materia)
+    session.flush()
+    ajustar_cupo(session, materia_id, materia.cupo)
+    session.commit()
+    cache_catalogo.invalidar("materia")
+    session.refresh(materia)
+    return materia
+
+
 @router.put("/{materia_id}", response_model=Materia, summary="Actualizar materia completa")
 def actualizar_materia(materia_id: int, materia_actualizada: MateriaCreate, session: Session = Depends(get_session)):
     """
     Actualiza completamente un registro de materia.
+    Un cambio de cupo recalcula los cupos disponibles y, si crece, matricula a los primeros de la lista de espera.
     - Retorna 404 Not Found si el ID no existe.
+    - Retorna 409 Conflict si el cupo nuevo es menor que los estudiantes ya matriculados.
     """
     materia_db = session.get(Materia, materia_id)
     if not materia_db:
         raise HTTPException(status_code=404, detail="Materia no encontrada")
 
-    
+    if not ajustar_cupo(session, materia_id, materia_actualizada.cupo):
+        session.rollback()
+        raise HTTPException(status_code=409, detail=f"El cupo {materia_actualizada.cupo} es menor que los estudiantes ya matriculados.")
+    registrar_cambio_creditos(session, materia_id, materia_db.creditos, materia_actualizada.creditos)
     materia_db.nombre = materia_actualizada.nombre
     materia_db.creditos = materia_actualizada.creditos
     materia_db.codigo = materia_actualizada.codigo
+    if not session.is_modified(materia_db):
+        # Solo cambió el cupo, que ajustar_cupo escribe con un UPDATE fuera del ORM.
+        registrar_cambios(session, Materia, [materia_id], ACTUALIZAR)
 
     session.add(materia_db)
     session.commit()
+    cache_catalogo.invalidar("materia")
     session.refresh(materia_db)
     return materia_db
@@ -1,36 +1,153 @@
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List
+from datetime import date
+from fastapi import APIRouter, Body, Depends, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 from sqlmodel import select
-from db import get_session
-from models import Matricula, MatriculaCreate, MatriculaProfesorLink, Profesor, Estudiante, Materia
+from sqlalchemy import bindparam, delete, insert, update
+from sqlalchemy.exc import IntegrityError
+from db import get_session, get_async_session
+from models import (
+    Matricula, MatriculaArchivada, MatriculaCreate, MatriculaProfesorLink, Profesor, Estudiante, Materia, MateriaArchivada,
+    ListaEspera, PosicionListaEspera, ResultadoMatriculaLote, ahora,
+)
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from paginacion import Paginacion, obtener_paginacion, paginar_rapido, construir_consulta
+from exportacion import obtener_formato, exportar
+from promedios import DeltaPromedio, aplicar_deltas, registrar_cambio_nota
+from etag import condicional, condicional_tablas, etag_fila
+from metricas import RutaMedida
+from cupos import encolar, inscribir, liberar_cupos, reservar_cupos, retirar_de_listas
+from cache import cache_catalogo
+from cambios import ACTUALIZAR, CREAR, registrar_cambios
+from lotes import consultar_por_ids, obtener_ids, responder_lote
+from archivo import desarchivar, paginar_eliminados
 
 
-router = APIRouter(prefix="/matriculas", tags=["Matrículas"])
+router = APIRouter(prefix="/matriculas", tags=["Matrículas"], route_class=RutaMedida)
+
+LIMITE_LOTE = 10000
+TAMANO_BLOQUE_IN = 500
+
+MATRICULA = Matricula.__table__
+
+# Reactivación en lote de matrículas dadas de baja; la condición active = false detecta una reactivación concurrente.
+_REACTIVAR = (
+    update(MATRICULA)
+    .where(MATRICULA.c.id == bindparam("m_id"), MATRICULA.c.active == False)
+    .values(
+        active=True, nota_final=bindparam("nota"), fecha_registro=bindparam("fecha"),
+        version=MATRICULA.c.version + 1, updated_at=bindparam("momento"),
+    )
+)
+
+
+def _bloques(valores: Iterable[int]) -> Iterable[List[int]]:
+    valores = list(valores)
+    for inicio in range(0, len(valores), TAMANO_BLOQUE_IN):
+        yield valores[inicio:inicio + TAMANO_BLOQUE_IN]
+
+
+def _ids_activos(session: Session, modelo, ids: Set[int]) -> Set[int]:
+    """
+    Devuelve cuáles de los IDs existen y están activos, con una consulta IN por bloque.
+    """
+    activos = set()
+    for bloque in _bloques(ids):
+        activos.update(session.exec(select(modelo.id).where(modelo.id.in_(bloque), modelo.active == True)).all())
+    return activos
+
+
+def _pares_existentes(session: Session, estudiantes_ids: Set[int]) -> Dict[Tuple[int, int], Tuple[int, bool]]:
+    """
+    Devuelve las matrículas existentes (activas o no) de los estudiantes como {(estudiante_id, materia_id): (id, active)}.
+    """
+    pares = {}
+    for bloque in _bloques(estudiantes_ids):
+        filas = session.exec(
+            select(Matricula.estudiante_id, Matricula.materia_id, Matricula.id, Matricula.active).where(Matricula.estudiante_id.in_(bloque))
+        ).all()
+        pares.update({(estudiante_id, materia_id): (matricula_id, active) for estudiante_id, materia_id, matricula_id, active in filas})
+    return pares
 
 
 @router.get("/", response_model=List[Matricula], summary="Listar todas las matrículas activas")
-def listar_matriculas(session: Session = Depends(get_session)):
-    return session.exec(select(Matricula).where(Matricula.active == True)).all()
+async def listar_matriculas(request: Request, response: Response, session: AsyncSession = Depends(get_async_session), paginacion: Paginacion = Depends(obtener_paginacion), formato: Optional[str] = Depends(obtener_formato)):
+    """
+    Lista las matrículas activas paginadas por cursor.
+    Con `format=ndjson|csv` (o Accept equivalente) exporta en streaming todos los registros desde `after_id`.
+    """
+    condiciones = [Matricula.active == True]
+    if formato:
+        return exportar(construir_consulta(Matricula, condiciones, paginacion, solo_columnas=True), formato, "matriculas")
+    sin_cambios = await condicional_tablas(request, response, session, "matricula")
+    if sin_cambios is not None:
+        return sin_cambios
+    return await paginar_rapido(session, Matricula, condiciones, paginacion, response)
 
 
 @router.get("/eliminadas", response_model=List[Matricula], summary="Listar matrículas dadas de baja ")
-def listar_matriculas_eliminadas(session: Session = Depends(get_session)):
-    return session.exec(select(Matricula).where(Matricula.active == False)).all()
+async def listar_matriculas_eliminadas(request: Request, response: Response, session: AsyncSession = Depends(get_async_session), paginacion: Paginacion = Depends(obtener_paginacion)):
+    """
+    Matrículas dadas de baja (recientes y archivadas), paginado por cursor.
+    """
+    sin_cambios = await condicional_tablas(request, response, session, "matricula", "matriculaarchivada")
+    if sin_cambios is not None:
+        return sin_cambios
+    return await paginar_eliminados(session, Matricula, paginacion, response)
+
+
+@router.get("/lote", response_model=List[Matricula], summary="Obtener varias matrículas por ID")
+async def obtener_matriculas_lote(request: Request, response: Response, ids: List[int] = Depends(obtener_ids), session: AsyncSession = Depends(get_async_session)):
+    """
+    Multi-get: las matrículas pedidas en `ids` (activas o no) con una sola consulta IN, en el orden pedido.
+    Los IDs inexistentes se omiten y se informan en la cabecera X-Missing-Ids.
+    - Retorna 400 Bad Request si `ids` no es una lista de enteros o supera MAXIMO_IDS_LOTE.
+    """
+    sin_cambios = await condicional_tablas(request, response, session, "matricula")
+    if sin_cambios is not None:
+        return sin_cambios
+    return responder_lote(await consultar_por_ids(session, Matricula, ids), ids, response)
+
+
+@router.get("/lista-espera/{materia_id}", response_model=List[ListaEspera], summary="Lista de espera de una materia")
+async def listar_lista_espera(materia_id: int, request: Request, response: Response, session: AsyncSession = Depends(get_async_session), paginacion: Paginacion = Depends(obtener_paginacion)):
+    """
+    Solicitudes en espera de cupo en orden de llegada (el primero es el próximo en ser matriculado), paginadas por cursor.
+    """
+    sin_cambios = await condicional_tablas(request, response, session, "listaespera")
+    if sin_cambios is not None:
+        return sin_cambios
+    return await paginar_rapido(session, ListaEspera, [ListaEspera.materia_id == materia_id], paginacion, response)
 
 
 @router.get("/{matricula_id}", response_model=Matricula, summary="Obtener matrícula por ID")
-def obtener_matricula(matricula_id: int, session: Session = Depends(get_session)):
-    matricula = session.get(Matricula, matricula_id)
+async def obtener_matricula(matricula_id: int, request: Request, response: Response, session: AsyncSession = Depends(get_async_session)):
+    matricula = await session.get(Matricula, matricula_id)
     if not matricula:
         raise HTTPException(status_code=404, detail="Matrícula no encontrada")
+    sin_cambios = condicional(request, response, etag_fila(Matricula, matricula.id, matricula.version), matricula.updated_at)
+    if sin_cambios is not None:
+        return sin_cambios
     return matricula
 
 
-@router.post("/", response_model=Matricula, status_code=201, summary="Crear nueva matrícula y asociar profesores")
-def crear_matricula(nueva: MatriculaCreate, session: Session = Depends(get_session)):
+@router.post(
+    "/",
+    response_model=Matricula,
+    status_code=201,
+    summary="Crear nueva matrícula y asociar profesores",
+    responses={202: {"model": PosicionListaEspera, "description": "Materia sin cupo: el estudiante quedó en lista de espera"}},
+)
+def crear_matricula(nueva: MatriculaCreate, lista_espera: bool = True, session: Session = Depends(get_session)):
     """
-    Implementa la Lógica de Negocio: Matrícula única (Estudiante + Materia).
+    Implementa la Lógica de Negocio: Matrícula única (Estudiante + Materia) y cupo de la materia.
+    Todo ocurre en una sola transacción y el cupo se descuenta con un UPDATE condicional (ver cupos.py),
+    así que miles de solicitudes simultáneas nunca sobrepasan el cupo.
+    - Una matrícula dada de baja del mismo estudiante y materia se reactiva (si ya pasó al archivo, se crea una nueva).
+    - Retorna 202 Accepted con la posición si la materia no tiene cupo y el estudiante entra a la lista de espera
+      (con `lista_espera=false` retorna 409 Conflict sin encolarlo).
+    - Retorna 409 Conflict si ya está matriculado o en lista de espera, también ante solicitudes simultáneas.
     """
 
     matricula_existente = session.exec(
@@ -53,39 +170,175 @@ def crear_matricula(nueva: MatriculaCreate, session: Session = Depends(get_sessi
     if not materia or not materia.active:
         raise HTTPException(status_code=404, detail=f"Materia ID {nueva.materia_id} no encontrada o inactiva")
 
-    db_matricula = Matricula(
-        estudiante_id=nueva.estudiante_id,
-        materia_id=nueva.materia_id,
-        nota_final=nueva.nota_final, 
-        fecha_registro=nueva.fecha_registro 
-    )
-    session.add(db_matricula)
-    session.commit()
-    session.refresh(db_matricula)
-    
-    
-    if nueva.profesor_ids:
-        for profesor_id in nueva.profesor_ids:
+    profesores_ids = list(dict.fromkeys(nueva.profesores_ids or []))
+    profesores_activos = _ids_activos(session, Profesor, set(profesores_ids))
+    profesor_invalido = next((p for p in profesores_ids if p not in profesores_activos), None)
+    if profesor_invalido is not None:
+        raise HTTPException(status_code=404, detail=f"Profesor ID {profesor_invalido} no encontrado o inactivo")
 
-            profesor = session.get(Profesor, profesor_id)
-            if not profesor or not profesor.active:
+    try:
+        if not reservar_cupos(session, nueva.materia_id):
+            # Otra solicitud del mismo estudiante pudo matricularlo después de la primera lectura:
+            # se verifica de nuevo dentro de la transacción, que ya tiene el bloqueo de la materia.
+            ya_matriculado = session.exec(
+                select(Matricula.id).where(
+                    Matricula.estudiante_id == nueva.estudiante_id, Matricula.materia_id == nueva.materia_id, Matricula.active == True
+                )
+            ).first()
+            if ya_matriculado is not None or not lista_espera:
                 session.rollback()
-                raise HTTPException(status_code=404, detail=f"Profesor ID {profesor_id} no encontrado o inactivo")
+                detalle = "El estudiante ya está matriculado en este curso." if ya_matriculado is not None else "La materia no tiene cupos disponibles."
+                raise HTTPException(status_code=409, detail=detalle)
+            posicion = encolar(session, nueva.estudiante_id, nueva.materia_id)
+            session.commit()
+            return JSONResponse(status_code=202, content=posicion.model_dump())
 
+        db_matricula = inscribir(
+            session, nueva.estudiante_id, nueva.materia_id, nueva.nota_final, nueva.fecha_registro,
+            profesores_ids, existente=matricula_existente,
+        )
+        registrar_cambio_nota(session, nueva.estudiante_id, materia.creditos, None, nueva.nota_final)
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        raise HTTPException(status_code=409, detail="El estudiante ya está matriculado o en lista de espera para este curso.")
 
-            link = MatriculaProfesorLink(matricula_id=db_matricula.id, profesor_id=profesor.id)
-            session.add(link)
-    
-    session.commit()
+    if materia.cupo is not None:
+        cache_catalogo.invalidar("materia")
     session.refresh(db_matricula)
     return db_matricula
 
 
+@router.post("/bulk", response_model=List[ResultadoMatriculaLote], summary="Crear matrículas en lote")
+def crear_matriculas_lote(nuevas: List[MatriculaCreate] = Body(...), session: Session = Depends(get_session)):
+    """
+    Crea miles de matrículas en una sola transacción con validación por conjuntos:
+    existencia/actividad de estudiantes, materias y profesores con consultas IN,
+    duplicados contra uq_matricula_estudiante_materia en una sola pasada
+    e inserción de matrículas y enlaces con executemany. Como en `crear_matricula`, una matrícula dada de baja
+    del mismo estudiante y materia se reactiva (ocupa cupo y vuelve a contar en el historial).
+    Los cupos se reservan por materia con un UPDATE condicional; en una materia sin cupos suficientes
+    entran los primeros ítems del lote y los demás se rechazan (no se agregan a la lista de espera).
+    Devuelve un resultado por ítem (201 creada, 404 referencia inválida, 409 duplicada o sin cupo).
+    - Retorna 400 Bad Request si el lote supera LIMITE_LOTE ítems.
+    - Retorna 409 Conflict si otra petición insertó las mismas matrículas durante la transacción.
+    """
+    if len(nuevas) > LIMITE_LOTE:
+        raise HTTPException(status_code=400, detail=f"El lote no puede superar {LIMITE_LOTE} matrículas.")
+
+    estudiantes_activos = _ids_activos(session, Estudiante, {n.estudiante_id for n in nuevas})
+    materias_activas = _ids_activos(session, Materia, {n.materia_id for n in nuevas})
+    profesores_activos = _ids_activos(session, Profesor, {p for n in nuevas for p in (n.profesores_ids or [])})
+    existentes = _pares_existentes(session, estudiantes_activos)
+
+    resultados: List[ResultadoMatriculaLote] = []
+    # (índice en el lote, ítem, profesores, ID de la matrícula dada de baja que se reactiva o None)
+    aceptadas: List[Tuple[int, MatriculaCreate, List[int], Optional[int]]] = []
+    pares_lote: Set[Tuple[int, int]] = set()
+
+    for indice, nueva in enumerate(nuevas):
+        par = (nueva.estudiante_id, nueva.materia_id)
+        profesores_ids = list(dict.fromkeys(nueva.profesores_ids or []))
+        profesor_invalido = next((p for p in profesores_ids if p not in profesores_activos), None)
+
+        if nueva.estudiante_id not in estudiantes_activos:
+            detalle, status = f"Estudiante ID {nueva.estudiante_id} no encontrado o inactivo", 404
+        elif nueva.materia_id not in materias_activas:
+            detalle, status = f"Materia ID {nueva.materia_id} no encontrada o inactiva", 404
+        elif profesor_invalido is not None:
+            detalle, status = f"Profesor ID {profesor_invalido} no encontrado o inactivo", 404
+        elif par in existentes and existentes[par][1]:
+            detalle, status = "El estudiante ya está matriculado en este curso.", 409
+        elif par in pares_lote:
+            detalle, status = "Matrícula repetida dentro del lote.", 409
+        else:
+            pares_lote.add(par)
+            aceptadas.append((indice, nueva, profesores_ids, existentes[par][0] if par in existentes else None))
+            resultados.append(ResultadoMatriculaLote(indice=indice, status=201))
+            continue
+        resultados.append(ResultadoMatriculaLote(indice=indice, status=status, detalle=detalle))
+
+    if aceptadas:
+        # Cupos por materia en orden de ID (mismo orden de bloqueo en todas las transacciones):
+        # dentro de cada materia entran los primeros del lote y el resto se rechaza.
+        por_materia: Dict[int, List[int]] = {}
+        for posicion, (_, nueva, _, _) in enumerate(aceptadas):
+            por_materia.setdefault(nueva.materia_id, []).append(posicion)
+        sin_cupo: Set[int] = set()
+        for materia_id in sorted(por_materia):
+            reservados = reservar_cupos(session, materia_id, len(por_materia[materia_id]))
+            sin_cupo.update(por_materia[materia_id][reservados:])
+        for posicion in sin_cupo:
+            indice = aceptadas[posicion][0]
+            resultados[indice] = ResultadoMatriculaLote(indice=indice, status=409, detalle="La materia no tiene cupos disponibles.")
+        aceptadas = [aceptada for posicion, aceptada in enumerate(aceptadas) if posicion not in sin_cupo]
+
+    if aceptadas:
+        creditos = dict(session.execute(select(Materia.id, Materia.creditos).where(Materia.id.in_({n.materia_id for _, n, _, _ in aceptadas}))).all())
+        deltas: Dict[int, DeltaPromedio] = {}
+        for _, nueva, _, _ in aceptadas:
+            deltas.setdefault(nueva.estudiante_id, DeltaPromedio()).agregar(nueva.nota_final, creditos.get(nueva.materia_id))
+
+        nuevas_filas = [aceptada for aceptada in aceptadas if aceptada[3] is None]
+        reactivadas = [aceptada for aceptada in aceptadas if aceptada[3] is not None]
+        filas = [
+            {
+                "estudiante_id": nueva.estudiante_id,
+                "materia_id": nueva.materia_id,
+                "nota_final": nueva.nota_final,
+                "fecha_registro": nueva.fecha_registro,
+            }
+            for _, nueva, _, _ in nuevas_filas
+        ]
+        try:
+            ids: Dict[int, int] = {}
+            if filas:
+                # int(): algunas versiones de SQLite devuelven REAL en el RETURNING de un INSERT multi-fila.
+                insertadas = session.scalars(insert(Matricula).returning(Matricula.id, sort_by_parameter_order=True), filas)
+                ids.update((indice, int(matricula_id)) for (indice, _, _, _), matricula_id in zip(nuevas_filas, insertadas))
+            if reactivadas:
+                momento = ahora()
+                actualizadas = session.connection().execute(_REACTIVAR, [
+                    {"m_id": matricula_id, "nota": nueva.nota_final, "fecha": nueva.fecha_registro or date.today(), "momento": momento}
+                    for _, nueva, _, matricula_id in reactivadas
+                ]).rowcount
+                if actualizadas != len(reactivadas):
+                    raise IntegrityError("reactivar", None, Exception("Otra operación reactivó una matrícula del lote."))
+                ids_reactivadas = [matricula_id for _, _, _, matricula_id in reactivadas]
+                for bloque in _bloques(ids_reactivadas):
+                    session.execute(delete(MatriculaProfesorLink).where(MatriculaProfesorLink.matricula_id.in_(bloque)))
+                ids.update((indice, matricula_id) for indice, _, _, matricula_id in reactivadas)
+            enlaces = [
+                {"matricula_id": ids[indice], "profesor_id": profesor_id}
+                for indice, _, profesores_ids, _ in aceptadas
+                for profesor_id in profesores_ids
+            ]
+            if enlaces:
+                session.execute(insert(MatriculaProfesorLink), enlaces)
+            registrar_cambios(session, Matricula, [ids[indice] for indice, _, _, _ in nuevas_filas], CREAR)
+            registrar_cambios(session, Matricula, [ids[indice] for indice, _, _, _ in reactivadas], ACTUALIZAR)
+            retirar_de_listas(session, [(nueva.estudiante_id, nueva.materia_id) for _, nueva, _, _ in aceptadas])
+            aplicar_deltas(session, deltas)
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            raise HTTPException(status_code=409, detail="Otra operación registró matrículas del lote al mismo tiempo; reintente.")
+        cache_catalogo.invalidar("materia")
+
+        for indice, matricula_id in ids.items():
+            resultados[indice].matricula_id = matricula_id
+
+    return resultados
+
+
 @router.put("/{matricula_id}", response_model=Matricula, summary="Actualizar matrícula completa")
 def actualizar_matricula(matricula_id: int, matricula_actualizada: MatriculaCreate, session: Session = Depends(get_session)):
     matricula_db = session.get(Matricula, matricula_id)
     if not matricula_db:
         raise HTTPException(status_code=404, detail="Matrícula no encontrada")
+    if matricula_db.active:
+        materia = session.get(Materia, matricula_db.materia_id)
+        registrar_cambio_nota(session, matricula_db.estudiante_id, materia.creditos if materia else None, matricula_db.nota_final, matricula_actualizada.nota_final)
     matricula_db.nota_final = matricula_actualizada.nota_final
     matricula_db.fecha_registro = matricula_actualizada.fecha_registro
     
@@ -96,6 +349,76 @@ def actualizar_matricula(matricula_id: int, matricula_actualizada: MatriculaCrea
     return matricula_db
 
 
+def _conflicto_al_desarchivar(session: Session, matricula_id: int):
+    """
+    Traduce el IntegrityError de devolver una matrícula archivada a su motivo real: otra matrícula del
+    estudiante en el mismo curso, otra materia con el código de la materia archivada, o un estudiante
+    o una materia que ya no existen.
+    """
+    archivada = session.get(MatriculaArchivada, matricula_id)
+    if archivada is None:
+        raise HTTPException(status_code=409, detail="La matrícula cambió mientras se restauraba; intente de nuevo.")
+    otra = session.exec(
+        select(Matricula.id).where(Matricula.estudiante_id == archivada.estudiante_id, Matricula.materia_id == archivada.materia_id)
+    ).first()
+    if otra is not None:
+        raise HTTPException(status_code=409, detail=f"El estudiante ya tiene otra matrícula en este curso (ID {otra}).")
+    materia_archivada = session.get(MateriaArchivada, archivada.materia_id) if archivada.materia_id is not None else None
+    if materia_archivada is not None and session.exec(select(Materia.id).where(Materia.codigo == materia_archivada.codigo)).first():
+        raise HTTPException(
+            status_code=409,
+            detail=f"La materia archivada ID {archivada.materia_id} no se puede restaurar: otra materia ya usa el código '{materia_archivada.codigo}'.",
+        )
+    raise HTTPException(status_code=404, detail=f"El estudiante ID {archivada.estudiante_id} o la materia ID {archivada.materia_id} ya no existe.")
+
+
+@router.post("/{matricula_id}/restaurar", response_model=Matricula, summary="Restaurar una matrícula eliminada")
+def restaurar_matricula(matricula_id: int, session: Session = Depends(get_session)):
+    """
+    Deshace la baja: la matrícula vuelve del archivo si ya estaba archivada (con sus profesores) y queda activa,
+    ocupando un cupo de la materia y sumando su nota al historial del estudiante.
+    - Retorna 404 Not Found si el ID no existe ni en la tabla ni en el archivo, o si el estudiante o la materia ya no están activos.
+    - Retorna 409 Conflict si la matrícula ya está activa, si el estudiante tiene otra matrícula en el curso,
+      si otra materia tomó el código de la materia archivada o si la materia no tiene cupos disponibles.
+    Si la materia también se archivó, vuelve con la matrícula pero dada de baja: la restauración responde 404
+    hasta que se restaure la materia.
+    """
+    try:
+        desarchivar(session, Matricula, matricula_id)
+    except IntegrityError:
+        session.rollback()
+        _conflicto_al_desarchivar(session, matricula_id)
+    matricula = session.get(Matricula, matricula_id)
+    if not matricula:
+        raise HTTPException(status_code=404, detail="Matrícula no encontrada")
+    if matricula.active:
+        raise HTTPException(status_code=409, detail="La matrícula no está eliminada.")
+
+    # El rollback puede sacar la fila de la sesión (si venía del archivo): los IDs se leen antes.
+    estudiante_id, materia_id = matricula.estudiante_id, matricula.materia_id
+    estudiante = session.get(Estudiante, estudiante_id)
+    if not estudiante or not estudiante.active:
+        session.rollback()
+        raise HTTPException(status_code=404, detail=f"Estudiante ID {estudiante_id} no encontrado o inactivo")
+    materia = session.get(Materia, materia_id)
+    if not materia or not materia.active:
+        session.rollback()
+        raise HTTPException(status_code=404, detail=f"Materia ID {materia_id} no encontrada o inactiva")
+    if not reservar_cupos(session, matricula.materia_id):
+        session.rollback()
+        raise HTTPException(status_code=409, detail="La materia no tiene cupos disponibles.")
+
+    registrar_cambio_nota(session, matricula.estudiante_id, materia.creditos, None, matricula.nota_final)
+    matricula.active = True
+    session.add(matricula)
+    retirar_de_listas(session, [(matricula.estudiante_id, matricula.materia_id)])
+    session.commit()
+    if materia.cupo is not None:
+        cache_catalogo.invalidar("materia")
+    session.refresh(matricula)
+    return matricula
+
+
 @router.delete("/{matricula_id}", summary="Marcar matrícula como eliminada ")
 def eliminar_matricula(matricula_id: int, session: Session = Depends(get_session)):
     
@@ -103,7 +426,16 @@ def eliminar_matricula(matricula_id: int, session: Session = Depends(get_session
     if not matricula:
         raise HTTPException(status_code=404, detail="Matrícula no encontrada")
     
-    matricula.active = False
-    session.add(matricula)
+    promovidos, materia = [], None
+    if matricula.active:
+        materia = session.get(Materia, matricula.materia_id)
+        registrar_cambio_nota(session, matricula.estudiante_id, materia.creditos if materia else None, matricula.nota_final, None)
+        matricula.active = False
+        session.add(matricula)
+        session.flush()
+        # El cupo liberado pasa en la misma transacción al primero de la lista de espera.
+        promovidos = liberar_cupos(session, matricula.materia_id)
     session.commit()
-    return {"mensaje": f"Matrícula {matricula_id} marcada como eliminada"}
\ No newline at end of file
+    if promovidos or (materia and materia.cupo is not None):
+        cache_catalogo.invalidar("materia")
+    return {"mensaje": f"Matrícula {matricula_id} marcada como eliminada", "promovidos": promovidos}
\ No newline at end of file
@@ -0,0 +1,262 @@
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+METRICAS_ACTIVAS = os.getenv("METRICAS_ACTIVAS", "1") == "1"
+# Umbral del log de consultas lentas en milisegundos; 0 lo desactiva.
+SQL_LENTA_MS = float(os.getenv("SQL_LENTA_MS", "0"))
+# Límites (segundos) del histograma de duración total de las peticiones.
+LIMITES_DURACION = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+log_consultas_lentas = logging.getLogger("universidad.sql_lenta")
+router = APIRouter(tags=["Métricas"])
+
+
+@dataclass
+class Medicion:
+    """
+    Tiempos de una petición en curso. Se comparte por contextvar con los eventos de SQLAlchemy,
+    también cuando el endpoint síncrono corre en el threadpool (el contexto se copia al hilo).
+    """
+    inicio: float
+    consultas: int = 0
+    tiempo_db: float = 0.0
+    espera_pool: float = 0.0
+    fin_endpoint: Optional[float] = None
+
+
+_medicion_actual: ContextVar[Optional[Medicion]] = ContextVar("medicion_actual", default=None)
+
+
+@dataclass
+class _Acumulado:
+    peticiones: int = 0
+    consultas: int = 0
+    total: float = 0.0
+    db: float = 0.0
+    serializacion: float = 0.0
+    espera_pool: float = 0.0
+    histograma: List[int] = field(default_factory=lambda: [0] * len(LIMITES_DURACION))
+
+
+class RegistroMetricas:
+    """
+    Acumula por (método, ruta, estado) y produce el formato de texto de Prometheus.
+    """
+
+    def __init__(self):
+        self._acumulados: Dict[Tuple[str, str, int], _Acumulado] = {}
+        self.consultas_lentas = 0
+        self._lock = threading.Lock()
+
+    def registrar(self, metodo: str, ruta: str, estado: int, total: float, medicion: Medicion, serializacion: float):
+        with self._lock:
+            acumulado = self._acumulados.setdefault((metodo, ruta, estado), _Acumulado())
+            acumulado.peticiones += 1
+            acumulado.consultas += medicion.consultas
+            acumulado.total += total
+            acumulado.db += medicion.tiempo_db
+            acumulado.serializacion += serializacion
+            acumulado.espera_pool += medicion.espera_pool
+            for indice, limite in enumerate(LIMITES_DURACION):
+                if total <= limite:
+                    acumulado.histograma[indice] += 1
+                    break
+
+    def limpiar(self):
+        with self._lock:
+            self._acumulados.clear()
+            self.consultas_lentas = 0
+
+    def prometheus(self) -> str:
+        with self._lock:
+            acumulados = {clave: (valor.peticiones, valor.consultas, valor.total, valor.db, valor.serializacion, valor.espera_pool, list(valor.histograma))
+                          for clave, valor in self._acumulados.items()}
+            consultas_lentas = self.consultas_lentas
+
+        lineas = []
+
+        def serie(nombre: str, tipo: str, ayuda: str, indice: int):
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} {tipo}")
+            for (metodo, ruta, estado), valores in sorted(acumulados.items()):
+                lineas.append(f'{nombre}{{metodo="{metodo}",ruta="{ruta}",estado="{estado}"}} {valores[indice]}')
+
+        serie("universidad_peticiones_total", "counter", "Peticiones HTTP atendidas.", 0)
+        serie("universidad_consultas_sql_total", "counter", "Consultas SQL ejecutadas por las peticiones.", 1)
+        serie("universidad_db_segundos_total", "counter", "Tiempo en la base de datos.", 3)
+        serie("universidad_serializacion_segundos_total", "counter", "Tiempo desde que el endpoint retorna hasta que empieza la respuesta.", 4)
+        serie("universidad_pool_espera_segundos_total", "counter", "Tiempo esperando una conexión del pool.", 5)
+
+        nombre = "universidad_peticion_duracion_segundos"
+        lineas.append(f"# HELP {nombre} Duración total de las peticiones.")
+        lineas.append(f"# TYPE {nombre} histogram")
+        for (metodo, ruta, estado), (peticiones, _, total, _, _, _, histograma) in sorted(acumulados.items()):
+            etiquetas = f'metodo="{metodo}",ruta="{ruta}",estado="{estado}"'
+            acumulado = 0
+            for limite, cantidad in zip(LIMITES_DURACION, histograma):
+                acumulado += cantidad
+                lineas.append(f'{nombre}_bucket{{{etiquetas},le="{limite}"}} {acumulado}')
+            lineas.append(f'{nombre}_bucket{{{etiquetas},le="+Inf"}} {peticiones}')
+            lineas.append(f"{nombre}_sum{{{etiquetas}}} {total}")
+            lineas.append(f"{nombre}_count{{{etiquetas}}} {peticiones}")
+
+        lineas.append("# HELP universidad_consultas_lentas_total Consultas que superaron SQL_LENTA_MS.")
+        lineas.append("# TYPE universidad_consultas_lentas_total counter")
+        lineas.append(f"universidad_consultas_lentas_total {consultas_lentas}")
+        return "\n".join(lineas) + "\n"
+
+
+registro_metricas = RegistroMetricas()
+
+
+def _antes_de_consulta(conexion, cursor, sentencia, parametros, contexto, executemany):
+    conexion.info.setdefault("metricas_inicio", []).append(time.perf_counter())
+
+
+def _despues_de_consulta(conexion, cursor, sentencia, parametros, contexto, executemany):
+    duracion = time.perf_counter() - conexion.info["metricas_inicio"].pop()
+    medicion = _medicion_actual.get()
+    if medicion is not None:
+        medicion.consultas += 1
+        medicion.tiempo_db += duracion
+    if SQL_LENTA_MS and duracion * 1000 >= SQL_LENTA_MS:
+        registro_metricas.consultas_lentas += 1
+        log_consultas_lentas.warning("Consulta lenta (%.1f ms): %s", duracion * 1000, " ".join(sentencia.split()))
+
+
+def _error_de_consulta(contexto):
+    """
+    Si la sentencia falla (p. ej. IntegrityError capturado por el endpoint) no hay after_cursor_execute:
+    se descarta aquí su inicio para que no quede en la conexión del pool ni se empareje con otra consulta.
+    """
+    conexion = contexto.connection
+    if conexion is not None:
+        conexion.info.pop("metricas_inicio", None)
+
+
+def instrumentar(engine: Engine):
+    """
+    Registra los eventos de cursor y mide la espera por una conexión del pool
+    envolviendo `pool.connect` (incluye abrir una conexión nueva cuando el pool crece).
+    """
+    if not METRICAS_ACTIVAS:
+        return
+    event.listen(engine, "before_cursor_execute", _antes_de_consulta)
+    event.listen(engine, "after_cursor_execute", _despues_de_consulta)
+    event.listen(engine, "handle_error", _error_de_consulta)
+
+    conectar = engine.pool.connect
+
+    def connect_medido():
+        inicio = time.perf_counter()
+        try:
+            return conectar()
+        finally:
+            medicion = _medicion_actual.get()
+            if medicion is not None:
+                medicion.espera_pool += time.perf_counter() - inicio
+
+    engine.pool.connect = connect_medido
+
+
+def _medir_endpoint(endpoint):
+    """
+    Marca el momento en que el endpoint retorna: lo que sigue hasta el inicio de la respuesta
+    (validación del response_model y JSON) se reporta como serialización.
+    """
+    if getattr(endpoint, "_metricas", False):
+        return endpoint
+
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def medido(*args, **kwargs):
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                _marcar_fin_endpoint()
+    else:
+        @functools.wraps(endpoint)
+        def medido(*args, **kwargs):
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                _marcar_fin_endpoint()
+
+    medido._metricas = True
+    return medido
+
+
+def _marcar_fin_endpoint():
+    medicion = _medicion_actual.get()
+    if medicion is not None:
+        medicion.fin_endpoint = time.perf_counter()
+
+
+class RutaMedida(APIRoute):
+    """
+    `route_class` de los routers: igual que APIRoute pero mide el fin del endpoint.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _medir_endpoint(endpoint) if METRICAS_ACTIVAS else endpoint, **kwargs)
+
+
+class MiddlewareMetricas:
+    """
+    Middleware ASGI: abre la medición de la petición, agrega la cabecera Server-Timing
+    al iniciar la respuesta y registra los totales por ruta al terminar.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICAS_ACTIVAS:
+            return await self.app(scope, receive, send)
+
+        medicion = Medicion(inicio=time.perf_counter())
+        token = _medicion_actual.set(medicion)
+        estado = 500
+        serializacion = 0.0
+
+        async def send_medido(mensaje):
+            nonlocal estado, serializacion
+            if mensaje["type"] == "http.response.start":
+                ahora = time.perf_counter()
+                estado = mensaje["status"]
+                if medicion.fin_endpoint is not None:
+                    serializacion = ahora - medicion.fin_endpoint
+                server_timing = (
+                    f'db;dur={medicion.tiempo_db * 1000:.2f};desc="{medicion.consultas} consultas", '
+                    f"pool;dur={medicion.espera_pool * 1000:.2f}, "
+                    f"serializacion;dur={serializacion * 1000:.2f}, "
+                    f"total;dur={(ahora - medicion.inicio) * 1000:.2f}"
+                )
+                mensaje.setdefault("headers", [])
+                mensaje["headers"] = list(mensaje["headers"]) + [(b"server-timing", server_timing.encode("latin-1"))]
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, send_medido)
+        finally:
+            _medicion_actual.reset(token)
+            ruta = getattr(scope.get("route"), "path", "sin_ruta")
+            registro_metricas.registrar(scope["method"], ruta, estado, time.perf_counter() - medicion.inicio, medicion, serializacion)
+
+
+@router.get("/metrics", response_class=PlainTextResponse, summary="Métricas en formato Prometheus")
+def metricas():
+    return registro_metricas.prometheus()
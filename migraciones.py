@@ -0,0 +1,129 @@
+from typing import List
+from sqlalchemy import delete, exists, func, inspect, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateColumn, CreateTable
+from sqlmodel import SQLModel
+
+
+def agregar_columnas_faltantes(engine: Engine) -> List[str]:
+    """
+    `create_all` solo crea tablas nuevas; esta función agrega a las tablas existentes
+    las columnas declaradas en models.py que todavía no tienen (ALTER TABLE ... ADD COLUMN).
+    Las columnas nuevas NOT NULL deben declarar `server_default`. Devuelve "tabla.columna" agregadas.
+    """
+    inspector = inspect(engine)
+    tablas_existentes = set(inspector.get_table_names())
+    agregadas = []
+
+    with engine.begin() as conexion:
+        for tabla in SQLModel.metadata.sorted_tables:
+            if tabla.name not in tablas_existentes:
+                continue
+            columnas_existentes = {columna["name"] for columna in inspector.get_columns(tabla.name)}
+            for columna in tabla.columns:
+                if columna.name in columnas_existentes:
+                    continue
+                definicion = CreateColumn(columna).compile(dialect=engine.dialect)
+                conexion.exec_driver_sql(f"ALTER TABLE {tabla.name} ADD COLUMN {definicion}")
+                agregadas.append(f"{tabla.name}.{columna.name}")
+
+    return agregadas
+
+
+def crear_indices_faltantes(engine: Engine) -> List[str]:
+    """
+    Crea en las tablas existentes los índices declarados en models.py que todavía no existen
+    (`create_all` no los agrega a tablas ya creadas). Devuelve los nombres creados.
+    """
+    inspector = inspect(engine)
+    tablas_existentes = set(inspector.get_table_names())
+    creados = []
+
+    with engine.begin() as conexion:
+        for tabla in SQLModel.metadata.sorted_tables:
+            if tabla.name not in tablas_existentes:
+                continue
+            indices_existentes = {indice["name"] for indice in inspector.get_indexes(tabla.name)}
+            for indice in tabla.indexes:
+                if indice.name not in indices_existentes:
+                    indice.create(conexion)
+                    creados.append(indice.name)
+
+    return creados
+
+
+def eliminar_enlaces_huerfanos(engine: Engine) -> int:
+    """
+    Borra los enlaces matrícula-profesor cuya matrícula ya no existe (los dejaban los borrados hechos sin
+    la cascada de la base). Con las claves foráneas activas no aparecen nuevos. Devuelve cuántos borró.
+    """
+    from models import Matricula, MatriculaProfesorLink
+
+    enlaces = MatriculaProfesorLink.__table__
+    with engine.begin() as conexion:
+        return conexion.execute(
+            delete(enlaces).where(~exists().where(Matricula.id == enlaces.c.matricula_id))
+        ).rowcount
+
+
+def usar_autoincrement_sqlite(engine: Engine) -> List[str]:
+    """
+    Reconstruye con AUTOINCREMENT las tablas SQLite creadas antes de declarar `sqlite_autoincrement`
+    (SQLite no permite agregarlo con ALTER TABLE). Sigue el procedimiento de SQLite: sin claves foráneas,
+    crea la tabla nueva, copia las filas con sus IDs, borra la vieja y renombra la nueva. Los índices y
+    disparadores se van con la tabla vieja: los recrean `crear_indices_faltantes` y `crear_indices_busqueda`,
+    que se ejecutan después. La secuencia arranca en el ID más alto de la tabla y de su archivo, así ningún
+    ID ya usado vuelve a asignarse. Devuelve las tablas reconstruidas.
+    """
+    from models import Materia, MateriaArchivada, Matricula, MatriculaArchivada, Profesor, ProfesorArchivado
+
+    if engine.dialect.name != "sqlite":
+        return []
+    archivos = {Materia.__table__: MateriaArchivada.__table__, Profesor.__table__: ProfesorArchivado.__table__,
+                Matricula.__table__: MatriculaArchivada.__table__}
+    reconstruidas = []
+
+    with engine.connect() as conexion:
+        definiciones = dict(conexion.exec_driver_sql("SELECT name, sql FROM sqlite_master WHERE type = 'table'").all())
+        pendientes = [
+            tabla for tabla in archivos
+            if tabla.name in definiciones and "AUTOINCREMENT" not in definiciones[tabla.name].upper()
+        ]
+        if not pendientes:
+            return []
+
+        # PRAGMA foreign_keys no tiene efecto dentro de una transacción: se cambia antes de empezarla.
+        conexion.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        conexion.commit()
+        try:
+            with conexion.begin():
+                for tabla in pendientes:
+                    nueva = f"{tabla.name}__autoincrement"
+                    crear = str(CreateTable(tabla).compile(dialect=engine.dialect)).strip()
+                    conexion.exec_driver_sql(crear.replace(f"CREATE TABLE {tabla.name} ", f"CREATE TABLE {nueva} ", 1))
+                    columnas = ", ".join(columna.name for columna in tabla.columns)
+                    conexion.exec_driver_sql(f"INSERT INTO {nueva} ({columnas}) SELECT {columnas} FROM {tabla.name}")
+                    conexion.exec_driver_sql(f"DROP TABLE {tabla.name}")
+                    conexion.exec_driver_sql(f"ALTER TABLE {nueva} RENAME TO {tabla.name}")
+
+                    maximo = max(
+                        conexion.execute(select(func.max(tabla.c.id))).scalar() or 0,
+                        conexion.execute(select(func.max(archivos[tabla].c.id))).scalar() or 0,
+                    )
+                    conexion.execute(text("DELETE FROM sqlite_sequence WHERE name = :tabla"), {"tabla": tabla.name})
+                    conexion.execute(
+                        text("INSERT INTO sqlite_sequence (name, seq) VALUES (:tabla, :maximo)"), {"tabla": tabla.name, "maximo": maximo}
+                    )
+                    reconstruidas.append(tabla.name)
+                fallas = conexion.exec_driver_sql("PRAGMA foreign_key_check").all()
+                if fallas:
+                    raise RuntimeError(f"Claves foráneas rotas tras reconstruir {', '.join(reconstruidas)}: {fallas[:5]}")
+        finally:
+            conexion.exec_driver_sql("PRAGMA foreign_keys=ON")
+            conexion.commit()
+
+    # Las otras conexiones del pool pueden conservar el esquema anterior en memoria (y con él los índices
+    # de las tablas borradas): se cierran para que la próxima las abra de nuevo. Se vacía el pool sin
+    # reemplazarlo, porque `metricas.instrumentar` lo tiene envuelto.
+    engine.pool.dispose()
+    return reconstruidas
@@ -1,12 +1,48 @@
 from typing import Optional, List
-from datetime import date
+from datetime import date, datetime, timezone
+from sqlalchemy import Index, text
 from sqlmodel import SQLModel, Field, Relationship, UniqueConstraint
 
 
+# Condición de los índices parciales sobre filas activas (SQLite y PostgreSQL; otros motores crean el índice completo).
+SOLO_ACTIVOS = {"sqlite_where": text("active = 1"), "postgresql_where": text("active")}
+# Tablas con archivo: SQLite sin AUTOINCREMENT reutiliza el ID más alto tras un borrado, y ese ID puede estar
+# archivado o ya publicado en el registro de cambios. En PostgreSQL las secuencias nunca reutilizan IDs.
+SIN_REUTILIZAR_IDS = {"sqlite_autoincrement": True}
+
+
+def ahora() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class Versionado(SQLModel):
+    """
+    Versión por fila para ETag / Last-Modified: se incrementa en cada escritura
+    (evento before_flush en etag.py y explícitamente en las sentencias masivas).
+    """
+    version: int = Field(default=1, sa_column_kwargs={"server_default": "1"})
+    updated_at: Optional[datetime] = Field(default_factory=ahora)
+
+
+class MarcaTabla(SQLModel, table=True):
+    """
+    Marca de agua por tabla: cualquier INSERT/UPDATE/DELETE sobre la tabla incrementa su versión.
+    Los listados la usan como ETag sin tener que consultar ni serializar las filas.
+    """
+    tabla: str = Field(primary_key=True)
+    version: int = Field(default=0)
+    updated_at: Optional[datetime] = Field(default_factory=ahora)
+
+
 class MatriculaProfesorLink(SQLModel, table=True):
-    matricula_id: Optional[int] = Field(default=None, foreign_key="matricula.id", primary_key=True)
+    matricula_id: Optional[int] = Field(default=None, foreign_key="matricula.id", primary_key=True, ondelete="CASCADE")
     profesor_id: Optional[int] = Field(default=None, foreign_key="profesor.id", primary_key=True)
 
+    # La PK (matricula_id, profesor_id) no sirve para buscar por profesor: índice inverso cubriente.
+    __table_args__ = (
+        Index("ix_matriculaprofesorlink_profesor_matricula", "profesor_id", "matricula_id"),
+    )
+
 
 class EstudianteBase(SQLModel):
     nombre: Optional[str] = None
@@ -15,21 +51,24 @@ class EstudianteBase(SQLModel):
     semestre: Optional[int] = None 
 
 
-class Estudiante(EstudianteBase, table=True):
+class Estudiante(Versionado, EstudianteBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     active: bool = Field(default=True)
 
     matriculas: List["Matricula"] = Relationship(
         back_populates="estudiante",
-        sa_relationship_kwargs={"cascade": "all, delete-orphan"}
+        sa_relationship_kwargs={"cascade": "all, delete-orphan", "passive_deletes": True}
     )
     historial: Optional["Historial"] = Relationship(
         back_populates="estudiante", 
-        sa_relationship_kwargs={"uselist": False, "cascade": "all, delete-orphan"} 
+        sa_relationship_kwargs={"uselist": False, "cascade": "all, delete-orphan", "passive_deletes": True} 
     )
     __table_args__ = (
         UniqueConstraint("cedula", name="uq_estudiante_cedula"),
         UniqueConstraint("correo", name="uq_estudiante_correo"),
+        # Listados paginados por id: activos / dados de baja y filtro por semestre.
+        Index("ix_estudiante_active_id", "active", "id"),
+        Index("ix_estudiante_semestre_activos", "semestre", "id", **SOLO_ACTIVOS),
     )
 
 class EstudianteCreate(EstudianteBase):
@@ -40,15 +79,22 @@ class MateriaBase(SQLModel):
     nombre: Optional[str] = None
     creditos: Optional[int] = None
     codigo: Optional[str] = None 
+    # Cupo máximo de estudiantes activos; None = sin límite.
+    cupo: Optional[int] = Field(default=None, ge=0)
 
-class Materia(MateriaBase, table=True):
+class Materia(Versionado, MateriaBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     active: bool = Field(default=True)
+    # cupo - matrículas activas, mantenido con UPDATE condicionales (ver cupos.py), nunca se escribe desde la API.
+    cupos_disponibles: Optional[int] = None
 
     matriculas: List["Matricula"] = Relationship(back_populates="materia")
 
     __table_args__ = (
         UniqueConstraint("codigo", name="uq_materia_codigo"),
+        Index("ix_materia_active_id", "active", "id"),
+        Index("ix_materia_creditos_activas", "creditos", "id", **SOLO_ACTIVOS),
+        SIN_REUTILIZAR_IDS,
     )
 
 class MateriaCreate(MateriaBase):
@@ -56,11 +102,19 @@ class MateriaCreate(MateriaBase):
 
 
 class HistorialBase(SQLModel):
-    nota_promedio: Optional[float] = None
-    estudiante_id: Optional[int] = Field(default=None, foreign_key="estudiante.id", nullable=True)
+    estudiante_id: Optional[int] = Field(default=None, foreign_key="estudiante.id", nullable=True, index=True, ondelete="CASCADE")
     
-class Historial(HistorialBase, table=True):
+class Historial(Versionado, HistorialBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
+
+    # Promedios materializados: se mantienen con los acumulados en la misma transacción
+    # que modifica las matrículas (ver promedios.py), nunca se escriben desde la API.
+    nota_promedio: Optional[float] = None
+    promedio_ponderado: Optional[float] = None
+    suma_notas: float = Field(default=0.0, sa_column_kwargs={"server_default": "0"})
+    cantidad_notas: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    suma_ponderada: float = Field(default=0.0, sa_column_kwargs={"server_default": "0"})
+    suma_creditos: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
     
     estudiante: Optional[Estudiante] = Relationship(back_populates="historial")
 
@@ -72,12 +126,17 @@ class ProfesorBase(SQLModel):
     nombre: Optional[str] = None
     especialidad: Optional[str] = None
 
-class Profesor(ProfesorBase, table=True):
+class Profesor(Versionado, ProfesorBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     active: bool = Field(default=True)
     
     matriculas: List["Matricula"] = Relationship(back_populates="profesores", link_model=MatriculaProfesorLink)
 
+    __table_args__ = (
+        Index("ix_profesor_active_id", "active", "id"),
+        SIN_REUTILIZAR_IDS,
+    )
+
 class ProfesorCreate(ProfesorBase):
     pass
 
@@ -86,22 +145,235 @@ class MatriculaBase(SQLModel):
     nota_final: Optional[float] = None
     fecha_registro: Optional[date] = Field(default_factory=date.today)
     
-class Matricula(MatriculaBase, table=True):
+class Matricula(Versionado, MatriculaBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     active: bool = Field(default=True)
     
-    estudiante_id: Optional[int] = Field(default=None, foreign_key="estudiante.id", nullable=True)
-    materia_id: Optional[int] = Field(default=None, foreign_key="materia.id", nullable=True)
+    estudiante_id: Optional[int] = Field(default=None, foreign_key="estudiante.id", nullable=True, ondelete="CASCADE")
+    materia_id: Optional[int] = Field(default=None, foreign_key="materia.id", nullable=True, index=True)
     
     estudiante: Optional[Estudiante] = Relationship(back_populates="matriculas")
     materia: Optional[Materia] = Relationship(back_populates="matriculas")
 
-    profesores: List[Profesor] = Relationship(back_populates="matriculas", link_model=MatriculaProfesorLink)
+    profesores: List[Profesor] = Relationship(
+        back_populates="matriculas", link_model=MatriculaProfesorLink, sa_relationship_kwargs={"passive_deletes": True}
+    )
     __table_args__ = (
         UniqueConstraint("estudiante_id", "materia_id", name="uq_matricula_estudiante_materia"),
+        Index("ix_matricula_active_id", "active", "id"),
+        SIN_REUTILIZAR_IDS,
+    )
+
+
+class ListaEspera(SQLModel, table=True):
+    """
+    Solicitudes de matrícula a materias sin cupo, atendidas en orden de llegada (id)
+    cuando se libera un cupo.
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    estudiante_id: int = Field(foreign_key="estudiante.id", ondelete="CASCADE")
+    materia_id: int = Field(foreign_key="materia.id")
+    fecha_solicitud: Optional[datetime] = Field(default_factory=ahora)
+
+    __table_args__ = (
+        UniqueConstraint("estudiante_id", "materia_id", name="uq_listaespera_estudiante_materia"),
+        # Cabeza de la cola por materia y posición de una solicitud.
+        Index("ix_listaespera_materia_id", "materia_id", "id"),
     )
 
+
+class PosicionListaEspera(SQLModel):
+    lista_espera_id: int
+    estudiante_id: int
+    materia_id: int
+    posicion: int
+
+
 class MatriculaCreate(MatriculaBase):
     estudiante_id: int
     materia_id: int
-    profesores_ids: Optional[List[int]] = None
\ No newline at end of file
+    profesores_ids: Optional[List[int]] = None
+
+
+class MatriculaPanel(Versionado, MatriculaBase):
+    id: int
+    active: bool
+    estudiante_id: Optional[int] = None
+    materia_id: Optional[int] = None
+    profesores_ids: List[int] = Field(default_factory=list)
+
+
+class PanelEstudiante(SQLModel):
+    """
+    Página del estudiante en una sola respuesta. Cada materia y profesor aparece una vez
+    y las matrículas los referencian por ID.
+    """
+    estudiante: Estudiante
+    historial: Optional[Historial] = None
+    matriculas: List[MatriculaPanel] = Field(default_factory=list)
+    materias: List[Materia] = Field(default_factory=list)
+    profesores: List[Profesor] = Field(default_factory=list)
+
+
+class ResumenImportacion(SQLModel):
+    insertados: int = 0
+    actualizados: int = 0
+    rechazados: int = 0
+    errores: List[str] = Field(default_factory=list)
+
+
+class ResumenEliminacion(SQLModel):
+    estudiantes: int = 0
+    matriculas: int = 0
+    matriculas_archivadas: int = 0
+    enlaces: int = 0
+    historiales: int = 0
+    solicitudes_espera: int = 0
+    promovidos: int = 0
+
+
+class ResultadoMatriculaLote(SQLModel):
+    indice: int
+    status: int
+    matricula_id: Optional[int] = None
+    detalle: Optional[str] = None
+
+class CalificacionCreate(SQLModel):
+    matricula_id: int
+    nota_final: Optional[float] = None
+
+
+class EstadoAcuse(SQLModel):
+    acuse_id: str
+    estado: str
+    total: int
+    pendientes: int
+    aplicadas: int = 0
+    reemplazadas: int = 0
+    rechazadas: List[int] = Field(default_factory=list)
+
+
+class EstadoTrabajoCertificados(SQLModel):
+    trabajo_id: str
+    semestre: int
+    estado: str
+    total: int = 0
+    generados: int = 0
+    reutilizados: int = 0
+    errores: List[str] = Field(default_factory=list)
+    creado: Optional[datetime] = None
+    terminado: Optional[datetime] = None
+
+
+class Cambio(SQLModel, table=True):
+    """
+    Registro de cambios (solo se agregan filas): una por alta, modificación, baja lógica o borrado físico
+    de estudiantes, materias, profesores y matrículas, escrita en la misma transacción que el cambio.
+    `id` es la secuencia que los consumidores guardan para pedir solo lo nuevo (`since`).
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    tabla: str
+    entidad_id: int
+    operacion: str  # "crear", "actualizar", "baja" o "eliminar"
+    momento: datetime = Field(default_factory=ahora)
+
+    __table_args__ = (
+        Index("ix_cambio_tabla_id", "tabla", "id"),
+    )
+
+
+# --- Archivo: filas dadas de baja hace más de ARCHIVO_EDAD_DIAS, movidas por archivo.py fuera de las tablas vivas. ---
+# Mismas columnas que la tabla original (con el mismo id) más `archivado`; sin claves foráneas ni únicas.
+
+class MateriaArchivada(Versionado, MateriaBase, table=True):
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    active: bool = False
+    cupos_disponibles: Optional[int] = None
+    archivado: datetime = Field(default_factory=ahora)
+
+
+class ProfesorArchivado(Versionado, ProfesorBase, table=True):
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    active: bool = False
+    archivado: datetime = Field(default_factory=ahora)
+
+
+class MatriculaArchivada(Versionado, MatriculaBase, table=True):
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    active: bool = False
+    estudiante_id: Optional[int] = Field(default=None, index=True)
+    materia_id: Optional[int] = None
+    archivado: datetime = Field(default_factory=ahora)
+
+
+class MatriculaProfesorLinkArchivado(SQLModel, table=True):
+    matricula_id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    profesor_id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+
+
+class ResumenArchivo(SQLModel):
+    matriculas: int = 0
+    enlaces: int = 0
+    profesores: int = 0
+    materias: int = 0
+
+
+# --- Resúmenes de analítica: los reconstruye analitica.py con GROUP BY + NumPy; nunca se escriben desde la API. ---
+
+class ResumenMateria(SQLModel, table=True):
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})  # = materia.id
+    nombre: Optional[str] = None
+    codigo: Optional[str] = None
+    matriculas_activas: int = 0
+    con_nota: int = 0
+    aprobadas: int = 0
+    promedio: Optional[float] = None
+    minimo: Optional[float] = None
+    maximo: Optional[float] = None
+    p25: Optional[float] = None
+    p50: Optional[float] = None
+    p75: Optional[float] = None
+    p90: Optional[float] = None
+
+
+class ResumenSemestre(SQLModel, table=True):
+    semestre: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    estudiantes: int = 0
+    matriculas_activas: int = 0
+    con_nota: int = 0
+    promedio: Optional[float] = None
+    p50: Optional[float] = None
+    # Promedio de los promedios ponderados de los historiales del semestre.
+    promedio_ponderado: Optional[float] = None
+
+
+class CargaProfesor(SQLModel, table=True):
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})  # = profesor.id
+    nombre: Optional[str] = None
+    matriculas: int = 0
+    materias: int = 0
+    estudiantes: int = 0
+    promedio_notas: Optional[float] = None
+
+
+class DistribucionNotas(SQLModel, table=True):
+    """
+    Histograma de notas por ámbito: "global" (clave 0), "materia" (materia.id) o "semestre".
+    """
+    ambito: str = Field(primary_key=True)
+    clave: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    desde: float = Field(primary_key=True)
+    hasta: float
+    cantidad: int = 0
+
+
+class EstadoAnalitica(SQLModel, table=True):
+    """
+    Única fila (id=1): marca de las tablas de origen con la que se generaron los resúmenes.
+    Si la marca no cambió, la reconstrucción se omite.
+    """
+    id: int = Field(default=1, primary_key=True)
+    marca: str = ""
+    generado: Optional[datetime] = None
+    duracion_ms: float = 0.0
+    notas: int = 0
@@ -0,0 +1,155 @@
+import os
+from typing import Any, List, Optional, Tuple
+import orjson
+from fastapi import HTTPException, Query, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlmodel import SQLModel, Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+
+LIMITE_POR_DEFECTO = 100
+LIMITE_MAXIMO = 1000
+CABECERA_CURSOR = "X-Next-Cursor"
+# Camino rápido de los listados más consultados (ver `paginar_rapido`); con 0 todos pasan por el response_model.
+RESPUESTAS_RAPIDAS = os.getenv("RESPUESTAS_RAPIDAS", "1") == "1"
+
+
+class Paginacion(SQLModel):
+    after_id: Optional[int] = None
+    limit: int = LIMITE_POR_DEFECTO
+    fields: Optional[List[str]] = None
+
+
+def obtener_paginacion(
+    after_id: Optional[int] = Query(default=None, ge=0, description="Cursor: devuelve solo registros con ID mayor a este valor"),
+    limit: int = Query(default=LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO, description="Cantidad máxima de registros por página"),
+    fields: Optional[str] = Query(default=None, description="Columnas a devolver separadas por coma (ej: id,nombre)"),
+) -> Paginacion:
+    """
+    Dependencia común de los listados: cursor (after_id), tamaño de página y proyección de columnas.
+    """
+    campos = [campo.strip() for campo in fields.split(",") if campo.strip()] if fields else None
+    return Paginacion(after_id=after_id, limit=limit, fields=campos)
+
+
+def columnas_proyectadas(modelo, campos: List[str]):
+    """
+    Traduce los nombres pedidos en `fields` a columnas del modelo.
+    El `id` siempre se incluye porque es el cursor de la siguiente página.
+    - Retorna 400 Bad Request si algún campo no existe en la tabla.
+    """
+    tabla = modelo.__table__
+    desconocidos = [campo for campo in campos if campo not in tabla.columns]
+    if desconocidos:
+        raise HTTPException(status_code=400, detail=f"Campos no válidos para '{tabla.name}': {', '.join(desconocidos)}")
+
+    nombres = ["id"] + [campo for campo in campos if campo != "id"]
+    return [tabla.columns[nombre] for nombre in nombres]
+
+
+def construir_consulta(modelo, condiciones: list, paginacion: Paginacion, solo_columnas: bool = False):
+    """
+    Arma el SELECT ordenado por ID a partir del cursor y la proyección, sin aplicar el límite.
+    Con `solo_columnas` se seleccionan columnas en vez de entidades ORM aunque no se pida `fields`.
+    """
+    if paginacion.fields:
+        statement = select(*columnas_proyectadas(modelo, paginacion.fields))
+    elif solo_columnas:
+        statement = select(*modelo.__table__.columns)
+    else:
+        statement = select(modelo)
+
+    statement = statement.where(*condiciones)
+    if paginacion.after_id is not None:
+        statement = statement.where(modelo.id > paginacion.after_id)
+    return statement.order_by(modelo.id)
+
+
+def paginar(session: Session, modelo, condiciones: list, paginacion: Paginacion, response: Response):
+    """
+    Ejecuta un listado paginado por cursor (keyset) ordenado por ID.
+    Se pide un registro extra para saber si existe otra página; si existe,
+    el cursor siguiente viaja en la cabecera X-Next-Cursor.
+    Con `fields` solo se seleccionan esas columnas y se omite la hidratación ORM.
+    """
+    statement = construir_consulta(modelo, condiciones, paginacion).limit(paginacion.limit + 1)
+
+    # Con proyección se usa execute para recibir filas aunque se pida una sola columna.
+    filas = session.execute(statement).all() if paginacion.fields else session.exec(statement).all()
+    return _respuesta_pagina(filas, paginacion, response)
+
+
+async def paginar_async(session: AsyncSession, modelo, condiciones: list, paginacion: Paginacion, response: Response):
+    """
+    Versión de `paginar` para los endpoints async con AsyncSession.
+    """
+    statement = construir_consulta(modelo, condiciones, paginacion).limit(paginacion.limit + 1)
+
+    if paginacion.fields:
+        filas = (await session.execute(statement)).all()
+    else:
+        filas = (await session.exec(statement)).all()
+    return _respuesta_pagina(filas, paginacion, response)
+
+
+async def paginar_rapido(session: AsyncSession, modelo, condiciones: list, paginacion: Paginacion, response: Response):
+    """
+    `paginar_async` para los listados más consultados: lee tuplas de columnas (sin hidratar objetos ORM)
+    y las codifica con orjson en la respuesta, sin validar cada fila contra el response_model.
+    Las columnas van en el orden de los campos del modelo, así el JSON es byte a byte la serialización
+    del response_model (lo comprueba `verificaciones.py contrato`). Con RESPUESTAS_RAPIDAS=0 usa `paginar_async`.
+    """
+    if not RESPUESTAS_RAPIDAS:
+        return await paginar_async(session, modelo, condiciones, paginacion, response)
+    return responder_pagina(*await consultar_pagina_async(session, modelo, condiciones, paginacion), paginacion, response)
+
+
+def respuesta_json(contenido: Any, response: Response, opciones: int = orjson.OPT_UTC_Z) -> Response:
+    """
+    Respuesta ya codificada con orjson: FastAPI la envía tal cual, sin pasar por el response_model.
+    La Response reemplaza a `response`: se copian sus cabeceras (ETag, cursor).
+    Por defecto las fechas UTC terminan en "Z", igual que Pydantic; con `opciones=0` en "+00:00", como `jsonable_encoder`.
+    """
+    return Response(content=orjson.dumps(contenido, option=opciones), media_type="application/json", headers=dict(response.headers))
+
+
+async def consultar_pagina_async(session: AsyncSession, modelo, condiciones: list, paginacion: Paginacion) -> Tuple[List[dict], Optional[int]]:
+    """
+    Igual que `paginar_async`, pero devuelve los datos planos (registros como dict y cursor siguiente)
+    para poder guardarlos en cache; la respuesta se arma luego con `responder_pagina`.
+    Se leen tuplas de columnas: los dict son los mismos que daría `model_dump()` sin hidratar objetos ORM.
+    """
+    statement = construir_consulta(modelo, condiciones, paginacion, solo_columnas=True).limit(paginacion.limit + 1)
+    filas = (await session.execute(statement)).all()
+    items = [dict(fila._mapping) for fila in filas[:paginacion.limit]]
+    siguiente = filas[paginacion.limit - 1].id if len(filas) > paginacion.limit else None
+    return items, siguiente
+
+
+def responder_pagina(items: List[dict], siguiente: Optional[int], paginacion: Paginacion, response: Response):
+    """
+    Respuesta de una página ya leída como dict (p. ej. desde la cache); sin `fields` y con
+    RESPUESTAS_RAPIDAS se codifica con orjson en vez de validarse contra el response_model.
+    """
+    if not paginacion.fields:
+        if siguiente is not None:
+            response.headers[CABECERA_CURSOR] = str(siguiente)
+        return respuesta_json(items, response) if RESPUESTAS_RAPIDAS else items
+
+    # La JSONResponse reemplaza a `response`: se copian sus cabeceras (p. ej. ETag).
+    cabeceras = dict(response.headers)
+    if siguiente is not None:
+        cabeceras[CABECERA_CURSOR] = str(siguiente)
+    return JSONResponse(content=jsonable_encoder(items), headers=cabeceras)
+
+
+def _respuesta_pagina(filas: list, paginacion: Paginacion, response: Response):
+    siguiente = filas[paginacion.limit - 1].id if len(filas) > paginacion.limit else None
+    filas = filas[:paginacion.limit]
+    if paginacion.fields:
+        return responder_pagina([dict(fila._mapping) for fila in filas], siguiente, paginacion, response)
+    # Objetos ORM: los valida y serializa el response_model del endpoint.
+    if siguiente is not None:
+        response.headers[CABECERA_CURSOR] = str(siguiente)
+    return filas
@@ -1,30 +1,74 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session, select
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import List
-from db import get_session
+from db import get_session, get_async_session
 from models import Profesor, ProfesorCreate 
+from paginacion import Paginacion, obtener_paginacion, consultar_pagina_async, responder_pagina
+from cache import cache_catalogo
+from etag import condicional, condicional_tablas, etag_fila
+from metricas import RutaMedida
+from lotes import consultar_por_ids, obtener_ids, responder_lote
+from archivo import desarchivar, paginar_eliminados
 
-router = APIRouter(prefix="/profesores", tags=["Profesores"]) 
+router = APIRouter(prefix="/profesores", tags=["Profesores"], route_class=RutaMedida) 
 
 
 @router.get("/", response_model=List[Profesor], summary="Listar todos los profesores activos")
-def listar_profesores(session: Session = Depends(get_session)):
-    return session.exec(select(Profesor).where(Profesor.active == True)).all()
+async def listar_profesores(request: Request, response: Response, session: AsyncSession = Depends(get_async_session), paginacion: Paginacion = Depends(obtener_paginacion)):
+    sin_cambios = await condicional_tablas(request, response, session, "profesor")
+    if sin_cambios is not None:
+        return sin_cambios
+    clave = cache_catalogo.clave("profesor", f"lista:{request.state.marca_tablas}:{paginacion.after_id}:{paginacion.limit}:{paginacion.fields}")
+    encontrado, pagina = cache_catalogo.obtener(clave)
+    if not encontrado:
+        pagina = await consultar_pagina_async(session, Profesor, [Profesor.active == True], paginacion)
+        cache_catalogo.guardar(clave, pagina)
+    return responder_pagina(*pagina, paginacion, response)
 
 """
     Recupera una lista de todos los profesores que están marcados como activos en la base de datos.
 """
 
 @router.get("/eliminados", response_model=List[Profesor], summary="Listar profesores que se fueron")
-def listar_profesores_eliminados(session: Session = Depends(get_session)):
-    return session.exec(select(Profesor).where(Profesor.active == False)).all()
+async def listar_profesores_eliminados(request: Request, response: Response, session: AsyncSession = Depends(get_async_session), paginacion: Paginacion = Depends(obtener_paginacion)):
+    """
+    Profesores dados de baja (recientes y archivados), paginado por cursor.
+    """
+    sin_cambios = await condicional_tablas(request, response, session, "profesor", "profesorarchivado")
+    if sin_cambios is not None:
+        return sin_cambios
+    return await paginar_eliminados(session, Profesor, paginacion, response)
+
+
+@router.get("/lote", response_model=List[Profesor], summary="Obtener varios profesores por ID")
+async def obtener_profesores_lote(request: Request, response: Response, ids: List[int] = Depends(obtener_ids), session: AsyncSession = Depends(get_async_session)):
+    """
+    Multi-get: los profesores pedidos en `ids` (activos o no) con una sola consulta IN, en el orden pedido.
+    Se sirven desde la cache del catálogo y solo los que falten se leen de la base.
+    Los IDs inexistentes se omiten y se informan en la cabecera X-Missing-Ids.
+    - Retorna 400 Bad Request si `ids` no es una lista de enteros o supera MAXIMO_IDS_LOTE.
+    """
+    sin_cambios = await condicional_tablas(request, response, session, "profesor")
+    if sin_cambios is not None:
+        return sin_cambios
+    return responder_lote(await consultar_por_ids(session, Profesor, ids, "profesor", request.state.marca_tablas), ids, response)
 
 
 @router.get("/{profesor_id}", response_model=Profesor, summary="Obtener profesor por ID")
-def obtener_profesor(profesor_id: int, session: Session = Depends(get_session)):
-    profesor = session.get(Profesor, profesor_id)
-    if not profesor:
-        raise HTTPException(status_code=404, detail="Profesor no encontrado")
+async def obtener_profesor(profesor_id: int, request: Request, response: Response, session: AsyncSession = Depends(get_async_session)):
+    clave = cache_catalogo.clave("profesor", f"id:{profesor_id}")
+    encontrado, profesor = cache_catalogo.obtener(clave)
+    if not encontrado:
+        profesor = await session.get(Profesor, profesor_id)
+        if not profesor:
+            raise HTTPException(status_code=404, detail="Profesor no encontrado")
+        profesor = profesor.model_dump()
+        cache_catalogo.guardar(clave, profesor)
+
+    sin_cambios = condicional(request, response, etag_fila(Profesor, profesor["id"], profesor["version"]), profesor["updated_at"])
+    if sin_cambios is not None:
+        return sin_cambios
     return profesor
 
 
@@ -39,6 +83,7 @@ def crear_profesor(profesor: ProfesorCreate, session: Session = Depends(get_sess
     db_profesor = Profesor.model_validate(profesor)
     session.add(db_profesor)
     session.commit()
+    cache_catalogo.invalidar("profesor")
     session.refresh(db_profesor)
     return db_profesor
 
@@ -52,9 +97,32 @@ def eliminar_profesor(profesor_id: int, session: Session = Depends(get_session))
     profesor.active = False
     session.add(profesor)
     session.commit()
+    cache_catalogo.invalidar("profesor")
     return {"mensaje": f"Profesor {profesor_id} marcado como eliminado"}
 
 
+@router.post("/{profesor_id}/restaurar", response_model=Profesor, summary="Restaurar un profesor eliminado")
+def restaurar_profesor(profesor_id: int, session: Session = Depends(get_session)):
+    """
+    Deshace la eliminación lógica: el profesor vuelve del archivo si ya estaba archivado y queda activo.
+    - Retorna 404 Not Found si el ID no existe ni en la tabla ni en el archivo.
+    - Retorna 409 Conflict si el profesor ya está activo.
+    """
+    desarchivar(session, Profesor, profesor_id)
+    profesor = session.get(Profesor, profesor_id)
+    if not profesor:
+        raise HTTPException(status_code=404, detail="Profesor no encontrado")
+    if profesor.active:
+        raise HTTPException(status_code=409, detail="El profesor no está eliminado.")
+
+    profesor.active = True
+    session.add(profesor)
+    session.commit()
+    cache_catalogo.invalidar("profesor")
+    session.refresh(profesor)
+    return profesor
+
+
 @router.put("/{profesor_id}", response_model=Profesor, summary="Actualizar profesor completo")
 def actualizar_profesor(profesor_id: int, profesor_actualizado: ProfesorCreate, session: Session = Depends(get_session)):
     profesor_db = session.get(Profesor, profesor_id)
@@ -66,5 +134,6 @@ def actualizar_profesor(profesor_id: int, profesor_actualizado: ProfesorCreate,
 
     session.add(profesor_db)
     session.commit()
+    cache_catalogo.invalidar("profesor")
     session.refresh(profesor_db)
     return profesor_db
@@ -0,0 +1,216 @@
+import argparse
+from dataclasses import dataclass
+from typing import Collection, Dict, Optional
+from sqlalchemy import bindparam, case, func, update
+from sqlmodel import Session, select
+from models import Historial, Materia, Matricula, ahora
+
+
+HISTORIAL = Historial.__table__
+
+
+@dataclass
+class DeltaPromedio:
+    """
+    Cambio a aplicar sobre los acumulados del historial de un estudiante.
+    """
+    suma: float = 0.0
+    cantidad: int = 0
+    suma_ponderada: float = 0.0
+    creditos: int = 0
+
+    def agregar(self, nota: Optional[float], creditos: Optional[int], signo: int = 1):
+        """
+        Suma (signo=1) o resta (signo=-1) una nota. Las matrículas sin nota no cuentan
+        y las materias sin créditos no pesan en el promedio ponderado.
+        """
+        if nota is None:
+            return
+        creditos = creditos or 0
+        self.suma += signo * nota
+        self.cantidad += signo
+        self.suma_ponderada += signo * nota * creditos
+        self.creditos += signo * creditos
+
+
+def _promedio(suma, cantidad):
+    return case((cantidad > 0, suma / cantidad), else_=None)
+
+
+# Un solo UPDATE por estudiante: los acumulados y ambos promedios se recalculan en la misma sentencia,
+# así leer el promedio es O(1) y nunca queda desfasado respecto a los acumulados.
+_ACTUALIZAR_ACUMULADOS = (
+    update(HISTORIAL)
+    .where(HISTORIAL.c.estudiante_id == bindparam("e_id"))
+    .values(
+        suma_notas=HISTORIAL.c.suma_notas + bindparam("d_suma"),
+        cantidad_notas=HISTORIAL.c.cantidad_notas + bindparam("d_cantidad"),
+        suma_ponderada=HISTORIAL.c.suma_ponderada + bindparam("d_ponderada"),
+        suma_creditos=HISTORIAL.c.suma_creditos + bindparam("d_creditos"),
+        nota_promedio=_promedio(
+            HISTORIAL.c.suma_notas + bindparam("d_suma"),
+            HISTORIAL.c.cantidad_notas + bindparam("d_cantidad"),
+        ),
+        promedio_ponderado=_promedio(
+            HISTORIAL.c.suma_ponderada + bindparam("d_ponderada"),
+            HISTORIAL.c.suma_creditos + bindparam("d_creditos"),
+        ),
+        version=HISTORIAL.c.version + 1,
+        updated_at=bindparam("momento"),
+    )
+)
+
+
+def aplicar_deltas(session: Session, deltas: Dict[int, DeltaPromedio]):
+    """
+    Aplica los cambios por estudiante con un executemany dentro de la transacción de la sesión.
+    Los estudiantes sin historial se ignoran: su promedio se calcula al crear el historial.
+    """
+    parametros = [
+        {
+            "e_id": estudiante_id,
+            "d_suma": delta.suma,
+            "d_cantidad": delta.cantidad,
+            "d_ponderada": delta.suma_ponderada,
+            "d_creditos": delta.creditos,
+            "momento": ahora(),
+        }
+        for estudiante_id, delta in deltas.items()
+        if estudiante_id is not None and (delta.cantidad or delta.suma or delta.suma_ponderada or delta.creditos)
+    ]
+    if parametros:
+        session.connection().execute(_ACTUALIZAR_ACUMULADOS, parametros)
+
+
+def registrar_cambio_nota(session: Session, estudiante_id: int, creditos: Optional[int], nota_anterior: Optional[float], nota_nueva: Optional[float]):
+    """
+    Ajusta el historial cuando una matrícula activa cambia de nota.
+    Usar nota_anterior=None al matricular y nota_nueva=None al dar de baja.
+    """
+    delta = DeltaPromedio()
+    delta.agregar(nota_anterior, creditos, signo=-1)
+    delta.agregar(nota_nueva, creditos)
+    aplicar_deltas(session, {estudiante_id: delta})
+
+
+def registrar_cambio_creditos(session: Session, materia_id: int, creditos_anteriores: Optional[int], creditos_nuevos: Optional[int]):
+    """
+    Ajusta los acumulados ponderados de todos los estudiantes calificados en la materia
+    cuando cambian sus créditos, con un único UPDATE correlacionado.
+    """
+    diferencia = (creditos_nuevos or 0) - (creditos_anteriores or 0)
+    if not diferencia:
+        return
+
+    calificadas = (Matricula.materia_id == materia_id, Matricula.active == True, Matricula.nota_final.is_not(None))
+    suma_notas = (
+        select(func.coalesce(func.sum(Matricula.nota_final), 0.0))
+        .where(Matricula.estudiante_id == HISTORIAL.c.estudiante_id, *calificadas)
+        .scalar_subquery()
+    )
+    cantidad = (
+        select(func.count())
+        .where(Matricula.estudiante_id == HISTORIAL.c.estudiante_id, *calificadas)
+        .scalar_subquery()
+    )
+    suma_ponderada = HISTORIAL.c.suma_ponderada + suma_notas * diferencia
+    suma_creditos = HISTORIAL.c.suma_creditos + cantidad * diferencia
+    session.connection().execute(
+        update(HISTORIAL)
+        .where(HISTORIAL.c.estudiante_id.in_(select(Matricula.estudiante_id).where(*calificadas)))
+        .values(
+            suma_ponderada=suma_ponderada,
+            suma_creditos=suma_creditos,
+            promedio_ponderado=_promedio(suma_ponderada, suma_creditos),
+            version=HISTORIAL.c.version + 1,
+            updated_at=ahora(),
+        )
+    )
+
+
+def calcular_acumulados(session: Session, estudiante_id: int) -> dict:
+    """
+    Acumulados de un solo estudiante calculados desde sus matrículas (para crear o reparar su historial).
+    """
+    creditos = func.coalesce(Materia.creditos, 0)
+    suma, cantidad, suma_ponderada, suma_creditos = session.execute(
+        select(
+            func.coalesce(func.sum(Matricula.nota_final), 0.0),
+            func.count(Matricula.nota_final),
+            func.coalesce(func.sum(Matricula.nota_final * creditos), 0.0),
+            func.coalesce(func.sum(creditos), 0),
+        )
+        .select_from(Matricula)
+        .outerjoin(Materia, Materia.id == Matricula.materia_id)
+        .where(Matricula.estudiante_id == estudiante_id, Matricula.active == True, Matricula.nota_final.is_not(None))
+    ).one()
+    return {
+        "suma_notas": suma,
+        "cantidad_notas": cantidad,
+        "suma_ponderada": suma_ponderada,
+        "suma_creditos": suma_creditos,
+        "nota_promedio": suma / cantidad if cantidad else None,
+        "promedio_ponderado": suma_ponderada / suma_creditos if suma_creditos else None,
+    }
+
+
+def recalcular_promedios(session: Session, estudiantes_ids: Optional[Collection[int]] = None) -> int:
+    """
+    Reconstruye los acumulados de todos los historiales (o solo los de `estudiantes_ids`): los reinicia
+    y los vuelve a llenar con una sola agregación GROUP BY sobre las matrículas (UPDATE ... FROM).
+    Hace commit de la transacción de la sesión. Devuelve los historiales con notas.
+    """
+    filtro_matriculas, filtro_historiales = [], []
+    if estudiantes_ids is not None:
+        filtro_matriculas.append(Matricula.estudiante_id.in_(estudiantes_ids))
+        filtro_historiales.append(HISTORIAL.c.estudiante_id.in_(estudiantes_ids))
+
+    creditos = func.coalesce(Materia.creditos, 0)
+    agregados = (
+        select(
+            Matricula.estudiante_id.label("estudiante_id"),
+            func.sum(Matricula.nota_final).label("suma"),
+            func.count(Matricula.nota_final).label("cantidad"),
+            func.sum(Matricula.nota_final * creditos).label("suma_ponderada"),
+            func.sum(creditos).label("creditos"),
+        )
+        .select_from(Matricula)
+        .outerjoin(Materia, Materia.id == Matricula.materia_id)
+        .where(Matricula.active == True, Matricula.nota_final.is_not(None), *filtro_matriculas)
+        .group_by(Matricula.estudiante_id)
+        .subquery()
+    )
+
+    conexion = session.connection()
+    conexion.execute(
+        update(HISTORIAL).where(*filtro_historiales).values(
+            suma_notas=0.0, cantidad_notas=0, suma_ponderada=0.0, suma_creditos=0,
+            nota_promedio=None, promedio_ponderado=None,
+            version=HISTORIAL.c.version + 1, updated_at=ahora(),
+        )
+    )
+    resultado = conexion.execute(
+        update(HISTORIAL)
+        .where(HISTORIAL.c.estudiante_id == agregados.c.estudiante_id)
+        .values(
+            suma_notas=agregados.c.suma,
+            cantidad_notas=agregados.c.cantidad,
+            suma_ponderada=agregados.c.suma_ponderada,
+            suma_creditos=agregados.c.creditos,
+            nota_promedio=_promedio(agregados.c.suma, agregados.c.cantidad),
+            promedio_ponderado=_promedio(agregados.c.suma_ponderada, agregados.c.creditos),
+        )
+    )
+    session.commit()
+    return resultado.rowcount
+
+
+if __name__ == "__main__":
+    from db import create_db_and_tables, engine
+
+    parser = argparse.ArgumentParser(description="Recalcula desde cero los promedios de todos los historiales.")
+    parser.parse_args()
+
+    create_db_and_tables()
+    with Session(engine) as session:
+        print(f"Historiales con notas recalculados: {recalcular_promedios(session)}")
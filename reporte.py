@@ -1,21 +1,128 @@
-from fastapi import APIRouter, Depends, HTTPException, Response
-from sqlmodel import Session, select
-from db import get_session
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db import get_async_session
 from models import Estudiante, Materia, Matricula, Profesor, MatriculaProfesorLink
-from typing import List
+from typing import Iterable, Iterator, List, Optional
+from itertools import groupby
+from exportacion import obtener_formato, obtener_formato_reporte, exportar
+from sqlalchemy.orm import selectinload
+from etag import condicional_tablas
+from metricas import RutaMedida
+from certificados import certificado_estudiante
+import paginacion
 
 
-router = APIRouter(tags=["Reportes"])
+router = APIRouter(tags=["Reportes"], route_class=RutaMedida)
+
+
+COLUMNAS_MATRICULA = list(Matricula.__table__.columns.keys())
+COLUMNAS_PROFESOR = list(Profesor.__table__.columns.keys())
+
+
+def _agrupar_matriculas_detalladas(filas: Iterable[dict]) -> Iterator[dict]:
+    """
+    Convierte las filas del JOIN matrícula-materia-profesor (ordenadas por matrícula)
+    en un registro por matrícula con el mismo formato que `matriculas_detalladas`.
+    """
+    for _, grupo in groupby(filas, key=lambda fila: fila["id"]):
+        grupo = list(grupo)
+        detalle = {columna: grupo[0][columna] for columna in COLUMNAS_MATRICULA}
+        detalle["materia"] = grupo[0]["materia"] if grupo[0]["materia"] is not None else "Materia eliminada"
+        detalle["profesores"] = [fila["profesor"] for fila in grupo if fila["profesor"] is not None]
+        yield detalle
+
+
+def _consulta_matriculas_detalladas(estudiante_id: int):
+    """
+    JOIN matrícula-materia-profesor de un estudiante, una fila por profesor de cada matrícula.
+    """
+    return (
+        select(*Matricula.__table__.columns, Materia.nombre.label("materia"), Profesor.nombre.label("profesor"))
+        .select_from(Matricula)
+        .outerjoin(Materia, Materia.id == Matricula.materia_id)
+        .outerjoin(MatriculaProfesorLink, MatriculaProfesorLink.matricula_id == Matricula.id)
+        .outerjoin(Profesor, Profesor.id == MatriculaProfesorLink.profesor_id)
+        .where(Matricula.estudiante_id == estudiante_id)
+        .order_by(Matricula.id, MatriculaProfesorLink.profesor_id)
+    )
+
+
+def _consulta_profesores_matriculas():
+    """
+    JOIN profesor-matrícula de los profesores activos, una fila por matrícula impartida.
+    """
+    return (
+        select(*Profesor.__table__.columns, Matricula.id.label("matricula_id"), Matricula.estudiante_id, Matricula.materia_id)
+        .select_from(Profesor)
+        .outerjoin(MatriculaProfesorLink, MatriculaProfesorLink.profesor_id == Profesor.id)
+        .outerjoin(Matricula, Matricula.id == MatriculaProfesorLink.matricula_id)
+        .where(Profesor.active == True)
+        .order_by(Profesor.id, Matricula.id)
+    )
+
+
+def _agrupar_profesores(filas: Iterable[dict]) -> Iterator[dict]:
+    """
+    Convierte las filas del JOIN profesor-matrícula (ordenadas por profesor)
+    en un registro por profesor con el mismo formato que el reporte JSON.
+    """
+    for _, grupo in groupby(filas, key=lambda fila: fila["id"]):
+        grupo = list(grupo)
+        data = {columna: grupo[0][columna] for columna in COLUMNAS_PROFESOR}
+        data["matriculas_impartidas"] = [
+            f"Matrícula ID {fila['matricula_id']} (Estudiante: {fila['estudiante_id']}, Materia: {fila['materia_id']})"
+            for fila in grupo if fila["matricula_id"] is not None
+        ]
+        yield data
 
 
 @router.get("/reporte/estudiante/{estudiante_id}", summary="Generar reporte completo de un estudiante")
-def generar_reporte_estudiante(estudiante_id: int, session: Session = Depends(get_session)):
-    
+async def generar_reporte_estudiante(estudiante_id: int, request: Request, response: Response, session: AsyncSession = Depends(get_async_session), formato: Optional[str] = Depends(obtener_formato_reporte)):
+    """
+    Reporte del estudiante con sus matrículas, materia y profesores.
+    Con `format=ndjson|csv` (o Accept equivalente) exporta en streaming una fila por matrícula.
+    Con `format=pdf` (o Accept: application/pdf) devuelve el certificado de notas en PDF.
+    """
+
+    if formato == "pdf":
+        return await certificado_estudiante(session, estudiante_id, request, response)
+
+    if formato:
+        if not await session.get(Estudiante, estudiante_id):
+            raise HTTPException(status_code=404, detail="Estudiante no encontrado.")
+        return exportar(
+            _consulta_matriculas_detalladas(estudiante_id), formato, f"reporte_estudiante_{estudiante_id}",
+            columnas=COLUMNAS_MATRICULA + ["materia", "profesores"],
+            agrupar=_agrupar_matriculas_detalladas,
+        )
+
+    # Un sondeo sin cambios se responde con 304 leyendo solo las marcas de las tablas del reporte.
+    sin_cambios = await condicional_tablas(request, response, session, "estudiante", "matricula", "materia", "profesor", "matriculaprofesorlink")
+    if sin_cambios is not None:
+        return sin_cambios
 
-    estudiante = session.exec(
+    if paginacion.RESPUESTAS_RAPIDAS:
+        # Tuplas de columnas y un solo JOIN, sin hidratar objetos ORM; mismo JSON que la carga anticipada
+        # (dict sin response_model: fechas con isoformat, como jsonable_encoder).
+        fila = (await session.execute(select(*Estudiante.__table__.columns).where(Estudiante.id == estudiante_id))).first()
+        if fila is None:
+            raise HTTPException(status_code=404, detail="Estudiante no encontrado.")
+        report_data = dict(fila._mapping)
+        filas = (await session.execute(_consulta_matriculas_detalladas(estudiante_id))).all()
+        report_data["matriculas_detalladas"] = list(_agrupar_matriculas_detalladas(fila._mapping for fila in filas))
+        return paginacion.respuesta_json(report_data, response, opciones=0)
+
+    # Carga anticipada: estudiante, matrículas, materias y profesores en 4 consultas fijas,
+    # sin importar cuántas matrículas tenga el estudiante.
+    estudiante = (await session.exec(
         select(Estudiante)
         .where(Estudiante.id == estudiante_id)
-    ).first()
+        .options(
+            selectinload(Estudiante.matriculas).selectinload(Matricula.materia),
+            selectinload(Estudiante.matriculas).selectinload(Matricula.profesores),
+        )
+    )).first()
 
     if not estudiante:
         raise HTTPException(status_code=404, detail="Estudiante no encontrado.")
@@ -29,7 +136,7 @@ def generar_reporte_estudiante(estudiante_id: int, session: Session = Depends(ge
         matricula_detalle = matricula.model_dump(by_alias=True)
         
         
-        materia_obj = session.get(Materia, matricula.materia_id)
+        materia_obj = matricula.materia
         matricula_detalle['materia'] = materia_obj.nombre if materia_obj else "Materia eliminada"
         profesores_nombres = [p.nombre for p in matricula.profesores]
         matricula_detalle['profesores'] = profesores_nombres
@@ -39,8 +146,31 @@ def generar_reporte_estudiante(estudiante_id: int, session: Session = Depends(ge
 
 
 @router.get("/reporte/profesores", summary="Listado de profesores y sus matrículas")
-def listar_profesores_con_matriculas(session: Session = Depends(get_session)):
-    profesores_activos = session.exec(select(Profesor).where(Profesor.active == True)).all()
+async def listar_profesores_con_matriculas(request: Request, response: Response, session: AsyncSession = Depends(get_async_session), formato: Optional[str] = Depends(obtener_formato)):
+    """
+    Profesores activos con las matrículas que imparten.
+    Con `format=ndjson|csv` (o Accept equivalente) exporta en streaming un registro por profesor.
+    """
+    if formato:
+        return exportar(
+            _consulta_profesores_matriculas(), formato, "reporte_profesores",
+            columnas=COLUMNAS_PROFESOR + ["matriculas_impartidas"],
+            agrupar=_agrupar_profesores,
+        )
+
+    sin_cambios = await condicional_tablas(request, response, session, "profesor", "matricula", "matriculaprofesorlink")
+    if sin_cambios is not None:
+        return sin_cambios
+
+    if paginacion.RESPUESTAS_RAPIDAS:
+        filas = (await session.execute(_consulta_profesores_matriculas())).all()
+        return paginacion.respuesta_json(list(_agrupar_profesores(fila._mapping for fila in filas)), response, opciones=0)
+
+    profesores_activos = (await session.exec(
+        select(Profesor)
+        .where(Profesor.active == True)
+        .options(selectinload(Profesor.matriculas))
+    )).all()
     
     reporte = []
     for profesor in profesores_activos:
@@ -0,0 +1,162 @@
+"""
+Lanzador de producción con varios workers.
+
+El proceso maestro crea o migra el esquema una sola vez, importa la app y la calienta. Después
+gunicorn crea los workers (UvicornWorker) con fork. Así cada worker arranca con los routers
+importados, los mappers configurados y las caches llenas: la de sentencias compiladas de
+SQLAlchemy y la del catálogo. Sin gunicorn (Windows) se usa `uvicorn --workers`: el esquema se crea
+una sola vez igual, pero cada worker importa y calienta todo por su cuenta.
+
+Con más de un worker, la cache del catálogo y las respuestas de Idempotency-Key se guardan en un
+almacén compartido en disco (CACHE_COMPARTIDA_DIR, por defecto SERVIDOR_CACHE_COMPARTIDA): una invalidación
+llega a todos los workers y un reintento recibe la respuesta guardada aunque caiga en otro worker.
+Los acuses de calificaciones y los trabajos de certificados ya viven en disco. Con CACHE_COMPARTIDA_DIR
+vacío cada worker usa su memoria y se avisa en el log.
+
+Uso:
+  python servidor.py --workers 4 --port 8000
+  python servidor.py --sin-calentar
+"""
+import argparse
+import asyncio
+import importlib.util
+import logging
+import os
+import re
+import sys
+import time
+
+# Los workers no vuelven a crear el esquema: lo hace este proceso antes de crearlos.
+os.environ["ESQUEMA_AL_INICIAR"] = "0"
+
+SERVIDOR_HOST = os.getenv("SERVIDOR_HOST", "0.0.0.0")
+SERVIDOR_PUERTO = int(os.getenv("SERVIDOR_PUERTO", "8000"))
+SERVIDOR_WORKERS = int(os.getenv("SERVIDOR_WORKERS", str(os.cpu_count() or 1)))
+SERVIDOR_CACHE_COMPARTIDA = os.getenv("SERVIDOR_CACHE_COMPARTIDA", "./cache_compartida")
+
+# Valores de los parámetros de consulta obligatorios o que acotan la respuesta durante el calentamiento.
+PARAMETROS_CALENTAMIENTO = {"q": "a", "ids": "1", "limit": 1}
+# Streams que no terminan (Server-Sent Events).
+RUTAS_SIN_FIN = {"/cambios/stream"}
+
+log = logging.getLogger("universidad.servidor")
+
+
+async def calentar(app) -> int:
+    """
+    Llama una vez, en proceso y sin red, a cada GET declarado en OpenAPI (IDs = 1, páginas de un registro).
+    Así quedan compiladas las sentencias de lectura de ambos engines y se llenan la cache del catálogo y
+    las de validación de Pydantic. Las escrituras no se ejecutan: solo se configuran sus mappers.
+    Al terminar se cierran las conexiones abiertas, que no deben heredarse con el fork. Se vacían los pools
+    sin reemplazarlos, porque `metricas.instrumentar` los tiene envueltos. También se descartan las
+    métricas de estas peticiones. Devuelve cuántas rutas se recorrieron.
+    """
+    import httpx
+    from sqlalchemy.util import greenlet_spawn
+    from db import async_engine, engine
+    from metricas import registro_metricas
+
+    recorridas = 0
+    transporte = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://calentamiento") as cliente:
+        for ruta, operaciones in app.openapi()["paths"].items():
+            if "get" not in operaciones or ruta in RUTAS_SIN_FIN:
+                continue
+            declarados = {parametro["name"] for parametro in operaciones["get"].get("parameters", []) if parametro["in"] == "query"}
+            consulta = {nombre: valor for nombre, valor in PARAMETROS_CALENTAMIENTO.items() if nombre in declarados}
+            respuesta = await cliente.get(re.sub(r"{\w+}", "1", ruta), params=consulta)
+            if respuesta.status_code >= 500:
+                log.warning("Calentamiento: %s respondió %s", ruta, respuesta.status_code)
+            recorridas += 1
+
+    await greenlet_spawn(async_engine.sync_engine.pool.dispose)
+    engine.pool.dispose()
+    registro_metricas.limpiar()
+    return recorridas
+
+
+def preparar(calentar_app: bool = True):
+    """
+    Trabajo que se hace una sola vez antes de crear los workers: esquema, importación de la app,
+    configuración de los mappers y, con `calentar_app`, el recorrido de `calentar`. Devuelve la app.
+    """
+    inicio = time.perf_counter()
+    from sqlalchemy.orm import configure_mappers
+    from db import create_db_and_tables
+
+    create_db_and_tables()
+    import main
+    from cache import cache_catalogo
+
+    # Entradas de una ejecución anterior del almacén compartido: la base pudo cambiar mientras tanto.
+    cache_catalogo.backend.limpiar()
+    configure_mappers()
+    recorridas = asyncio.run(calentar(main.app)) if calentar_app else 0
+    log.info("App preparada en %.2f s (%s rutas calentadas).", time.perf_counter() - inicio, recorridas)
+    return main.app
+
+
+def _clase_worker() -> str:
+    try:
+        import uvicorn_worker  # noqa: F401
+        return "uvicorn_worker.UvicornWorker"
+    except ImportError:
+        return "uvicorn.workers.UvicornWorker"
+
+
+def servir_gunicorn(app, host: str, puerto: int, workers: int):
+    from gunicorn.app.base import BaseApplication
+
+    class Aplicacion(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{host}:{puerto}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("worker_class", _clase_worker())
+            # La app ya está importada y caliente en el maestro; los workers la heredan con el fork.
+            self.cfg.set("preload_app", True)
+
+        def load(self):
+            return app
+
+    Aplicacion().run()
+
+
+def compartir_estado(workers: int):
+    """
+    Con varios workers, activa el almacén compartido (antes de importar la app) salvo que
+    CACHE_COMPARTIDA_DIR se haya vaciado a propósito; en ese caso lo advierte.
+    """
+    if workers <= 1:
+        return
+    if "CACHE_COMPARTIDA_DIR" not in os.environ:
+        os.environ["CACHE_COMPARTIDA_DIR"] = SERVIDOR_CACHE_COMPARTIDA
+    elif not os.environ["CACHE_COMPARTIDA_DIR"]:
+        log.warning(
+            "%d workers sin almacén compartido: cada uno tiene su cache del catálogo (las invalidaciones no llegan a los demás "
+            "hasta CACHE_TTL_SEGUNDOS) y sus respuestas de Idempotency-Key (un reintento en otro worker se ejecuta de nuevo).",
+            workers,
+        )
+
+
+def servir(host: str = SERVIDOR_HOST, puerto: int = SERVIDOR_PUERTO, workers: int = SERVIDOR_WORKERS, calentar_app: bool = True):
+    compartir_estado(workers)
+    if importlib.util.find_spec("gunicorn") is None or sys.platform == "win32":
+        import uvicorn
+
+        # Sin fork los workers importan la app de nuevo: calentar aquí no les llegaría.
+        preparar(calentar_app=False)
+        uvicorn.run("main:app", host=host, port=puerto, workers=workers)
+        return
+    servir_gunicorn(preparar(calentar_app), host, puerto, workers)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=SERVIDOR_HOST)
+    parser.add_argument("--port", type=int, default=SERVIDOR_PUERTO)
+    parser.add_argument("--workers", type=int, default=SERVIDOR_WORKERS, help="Por defecto, uno por CPU")
+    parser.add_argument("--sin-calentar", action="store_true", help="No recorrer los GET antes de crear los workers")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    servir(args.host, args.port, args.workers, calentar_app=not args.sin_calentar)
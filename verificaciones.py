@@ -0,0 +1,544 @@
+"""
+Verificaciones ejecutables contra una base SQLite temporal (el proyecto no tiene suite de tests).
+
+  planes   Ejecuta todos los endpoints GET y las escrituras principales, captura cada consulta
+           que emiten y corre EXPLAIN QUERY PLAN sobre ella. Falla (código de salida 1)
+           si alguna recorre una tabla completa ("SCAN <tabla>" sin índice).
+
+  cupos    Prueba de concurrencia del cupo: miles de solicitudes de matrícula simultáneas
+           (cada estudiante la pide dos veces) a una materia con cupo pequeño y luego bajas
+           simultáneas. Falla si hay sobrecupo, errores 5xx o la lista de espera no se promueve en orden.
+
+  busqueda Siembra un millón de estudiantes y mide la búsqueda por nombre (prefijo, sin tildes).
+           Falla si algún resultado no contiene las palabras buscadas, si el índice no sigue los
+           cambios de nombre y bajas, o si el p95 supera el umbral.
+
+  contrato Llama a cada endpoint GET con el camino rápido (orjson sobre tuplas de columnas) y sin él
+           (response_model). Falla si difieren el status, el cursor o algún valor (los números se comparan
+           por su texto), o si el cuerpo rápido no es byte a byte la serialización del response_model.
+           El orden de claves del camino ORM sigue el __dict__ de cada objeto cargado (varía según
+           la sesión), por eso la comparación de bytes es contra el esquema y no contra esa respuesta.
+
+  reportes Cuenta las sentencias de /reporte/estudiante/{id} y /reporte/profesores (JSON con y sin el camino
+           rápido, y ndjson) con pocos datos y con muchos más. Falla si la cantidad cambia con el tamaño
+           o supera MAXIMO_SENTENCIAS_REPORTE (sin N+1).
+
+Uso: python verificaciones.py planes
+     python verificaciones.py cupos --estudiantes 3000 --cupo 100
+     python verificaciones.py busqueda --estudiantes 1000000 --umbral-ms 50
+     python verificaciones.py contrato
+     python verificaciones.py reportes --matriculas 300 --profesores 200
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+# La base de datos temporal debe definirse antes de importar db.
+_directorio = tempfile.mkdtemp(prefix="verificaciones_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_directorio}/verificaciones.db")
+os.environ.setdefault("CALIFICACIONES_DIARIO", f"{_directorio}/calificaciones_diario")
+os.environ.setdefault("CERTIFICADOS_CACHE", f"{_directorio}/certificados_cache")
+# Sin reconstrucciones de analítica ni archivo en segundo plano durante las mediciones.
+os.environ.setdefault("ANALITICA_INTERVALO_S", "0")
+os.environ.setdefault("ARCHIVO_INTERVALO_S", "0")
+
+from sqlalchemy import event
+from sqlmodel import SQLModel
+
+
+# Valores de los parámetros de ruta para la base sembrada por `_sembrar`.
+PARAMETROS_RUTA = {
+    "estudiante_id": 1,
+    "materia_id": 1,
+    "profesor_id": 1,
+    "matricula_id": 1,
+    "historial_id": 1,
+    "estudiante_correo": "ana@uni.edu",
+    "estudiante_cedula": "100",
+    "materia_codigo": "MAT-1",
+}
+# Filtros opcionales que se prueban cuando el endpoint los declara.
+PARAMETROS_CONSULTA = {"semestre": 1, "creditos": 3, "q": "ma", "ids": "1,2"}
+
+ESCANEO_COMPLETO = re.compile(r"^SCAN (\w+)(?: AS \w+)?$")
+# Tablas con una fila por valor de un dominio pequeño (p. ej. un resumen por semestre) que se leen completas a propósito.
+TABLAS_ACOTADAS = {"resumensemestre"}
+# Streams que no terminan (Server-Sent Events): sus consultas se cubren con el listado equivalente.
+RUTAS_SIN_FIN = {"/cambios/stream"}
+# Sentencias por petición de un reporte: marcas del ETag, estudiante y las cargas anticipadas.
+MAXIMO_SENTENCIAS_REPORTE = 5
+
+
+def _sembrar(cliente):
+    cliente.post("/estudiantes/estudiantes/", json={"nombre": "Ana", "cedula": "100", "correo": "ana@uni.edu", "semestre": 1})
+    cliente.post("/estudiantes/estudiantes/", json={"nombre": "Luis", "cedula": "200", "correo": "luis@uni.edu", "semestre": 2})
+    cliente.post("/materias/materias/", json={"nombre": "Cálculo", "codigo": "MAT-1", "creditos": 3})
+    cliente.post("/materias/materias/", json={"nombre": "Física", "codigo": "FIS-1", "creditos": 4})
+    cliente.post("/profesores/profesores/", json={"nombre": "Marta", "especialidad": "Matemáticas"})
+    cliente.post("/historiales/historiales/", json={"estudiante_id": 1})
+
+
+def _escrituras(cliente):
+    """
+    Escrituras cuyas consultas también deben usar índices.
+    """
+    cliente.post("/matriculas/matriculas/", json={"estudiante_id": 1, "materia_id": 1, "nota_final": 4.0, "profesores_ids": [1]})
+    cliente.post("/matriculas/matriculas/bulk", json=[{"estudiante_id": 1, "materia_id": 2, "nota_final": 3.5, "profesores_ids": [1]}])
+    cliente.put("/matriculas/matriculas/1", json={"estudiante_id": 1, "materia_id": 1, "nota_final": 4.5})
+    cliente.put("/materias/materias/1", json={"nombre": "Cálculo I", "codigo": "MAT-1", "creditos": 5})
+    cliente.post(
+        "/estudiantes/estudiantes/importar",
+        files={"archivo": ("e.csv", io.BytesIO(b"nombre,cedula,correo,semestre\nLuis,200,luis@uni.edu,3\nEva,300,eva@uni.edu,1\n"))},
+    )
+    cliente.delete("/matriculas/matriculas/2")
+    cliente.post("/archivo/ejecutar", params={"edad_dias": 0})
+    cliente.post("/matriculas/matriculas/2/restaurar")
+    cliente.delete("/matriculas/matriculas/2")
+    cliente.post("/matriculas/matriculas/", json={"estudiante_id": 2, "materia_id": 1, "nota_final": 3.0, "profesores_ids": [1]})
+    cliente.delete("/estudiantes/estudiantes/cohorte", params={"semestre": 3})
+
+
+def _lecturas(cliente, app):
+    """
+    Llama a cada GET declarado en OpenAPI; los listados se piden desde un cursor (after_id)
+    para medir la consulta de una página y no solo el LIMIT de la primera.
+    """
+    for ruta, operaciones in app.openapi()["paths"].items():
+        if "get" not in operaciones or ruta in RUTAS_SIN_FIN:
+            continue
+        declarados = {parametro["name"] for parametro in operaciones["get"].get("parameters", [])}
+        url = ruta.format(**{nombre: PARAMETROS_RUTA.get(nombre, 1) for nombre in re.findall(r"{(\w+)}", ruta)})
+        consulta = {nombre: valor for nombre, valor in PARAMETROS_CONSULTA.items() if nombre in declarados}
+        if "after_id" in declarados:
+            consulta["after_id"] = 0
+        cliente.get(url, params=consulta)
+        if "format" in declarados:
+            cliente.get(url, params={**consulta, "format": "ndjson"})
+
+
+def planes(args) -> int:
+    from fastapi.testclient import TestClient
+    from db import async_engine, engine
+    import main
+
+    if engine.dialect.name != "sqlite":
+        print("La verificación de planes usa EXPLAIN QUERY PLAN de SQLite; defina un DATABASE_URL sqlite.")
+        return 2
+
+    capturadas = {}
+
+    def capturar(conexion, cursor, sentencia, parametros, contexto, executemany):
+        if sentencia.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            capturadas.setdefault(sentencia, parametros[0] if executemany else parametros)
+
+    with TestClient(main.app) as cliente:
+        _sembrar(cliente)
+        for motor in (engine, async_engine.sync_engine):
+            event.listen(motor, "before_cursor_execute", capturar)
+        try:
+            _escrituras(cliente)
+            _lecturas(cliente, main.app)
+        finally:
+            for motor in (engine, async_engine.sync_engine):
+                event.remove(motor, "before_cursor_execute", capturar)
+
+    tablas = set(SQLModel.metadata.tables) - TABLAS_ACOTADAS
+    fallas = []
+    with engine.connect() as conexion:
+        for sentencia, parametros in capturadas.items():
+            plan = [fila[3] for fila in conexion.exec_driver_sql(f"EXPLAIN QUERY PLAN {sentencia}", parametros)]
+            escaneadas = [m.group(1) for m in map(ESCANEO_COMPLETO.match, plan) if m and m.group(1) in tablas]
+            if escaneadas:
+                fallas.append((sentencia, plan))
+
+    for sentencia, plan in fallas:
+        print("ESCANEO COMPLETO:", " ".join(sentencia.split()))
+        for paso in plan:
+            print("   ", paso)
+    print(f"{len(capturadas)} consultas verificadas, {len(fallas)} con escaneo completo.")
+    return 1 if fallas else 0
+
+
+def _sembrar_contrato(cliente):
+    """
+    Datos que ejercitan la serialización: textos no ASCII y con comillas, nulos, notas con decimales,
+    matrículas con varios profesores y sin profesor, bajas recientes y archivadas y resúmenes de analítica.
+    """
+    from sqlalchemy import update
+    from sqlmodel import Session
+    from db import engine
+    from models import Estudiante
+
+    cliente.post("/estudiantes/estudiantes/", json={"nombre": "Ñandú \"el\" Pérez 😀", "cedula": "300", "correo": None, "semestre": None})
+    cliente.post("/estudiantes/estudiantes/", json={"nombre": "Zoë Ångström\\", "cedula": "400", "correo": "zoe@uni.edu", "semestre": 1})
+    cliente.post("/profesores/profesores/", json={"nombre": "Jürgen", "especialidad": None})
+    for estudiante_id, materia_id, nota, profesores in [(2, 1, 3.75, [1, 2]), (3, 2, 0.1, []), (4, 1, None, [2]), (4, 2, 4.999999, [1, 2])]:
+        cliente.post("/matriculas/matriculas/", json={"estudiante_id": estudiante_id, "materia_id": materia_id, "nota_final": nota, "profesores_ids": profesores})
+    cliente.post("/historiales/historiales/", json={"estudiante_id": 4})
+    cliente.delete("/estudiantes/estudiantes/3")
+    # Materia 1 sin cupo libre: la siguiente solicitud queda en lista de espera.
+    cliente.put("/materias/materias/1", json={"nombre": "Cálculo I", "codigo": "MAT-1", "creditos": 5, "cupo": 3})
+    cliente.post("/estudiantes/estudiantes/", json={"nombre": "Iñaki", "cedula": "500", "correo": "inaki@uni.edu", "semestre": 2})
+    cliente.post("/matriculas/matriculas/", json={"estudiante_id": 5, "materia_id": 1, "profesores_ids": [1]})
+    cliente.post("/materias/materias/", json={"nombre": "Química", "codigo": "QUI-1", "creditos": 2})
+    cliente.delete("/materias/materias/3")
+    cliente.post("/profesores/profesores/", json={"nombre": "Renée", "especialidad": "Química"})
+    cliente.delete("/profesores/profesores/3")
+    # Bajas archivadas (la matrícula 2 con su enlace, la materia 3 y el profesor 3) y bajas recientes en la tabla viva.
+    cliente.post("/materias/materias/", json={"nombre": "Biología", "codigo": "BIO-1", "creditos": 3})
+    cliente.post("/profesores/profesores/", json={"nombre": "Óscar", "especialidad": "Biología"})
+    cliente.post("/archivo/ejecutar", params={"edad_dias": 0})
+    cliente.delete("/materias/materias/4")
+    cliente.delete("/profesores/profesores/4")
+    # Los estudiantes solo se borran físicamente por la API: una baja directa para el listado de eliminados.
+    with Session(engine) as session:
+        session.exec(update(Estudiante).where(Estudiante.id == 2).values(active=False))
+        session.commit()
+    cliente.post("/analitica/reconstruir", params={"forzar": True})
+
+
+def _valores(cuerpo: bytes):
+    """
+    JSON decodificado con cada número como su texto literal (4.0 y 4 no son iguales), sin importar el orden de claves.
+    """
+    return json.loads(cuerpo, parse_float=lambda texto: ("float", texto), parse_int=lambda texto: ("int", texto))
+
+
+def _esquema_respuesta(operacion: dict):
+    """
+    TypeAdapter del response_model de una operación, a partir de su esquema OpenAPI (modelo o lista de modelos de models.py).
+    """
+    from typing import List
+    from pydantic import TypeAdapter
+    import models
+
+    esquema = operacion["responses"].get("200", {}).get("content", {}).get("application/json", {}).get("schema", {})
+    referencia = esquema.get("items", {}).get("$ref") if esquema.get("type") == "array" else esquema.get("$ref")
+    modelo = getattr(models, referencia.rsplit("/", 1)[-1], None) if referencia else None
+    if modelo is None:
+        return None
+    return TypeAdapter(List[modelo] if esquema.get("type") == "array" else modelo)
+
+
+def contrato(args) -> int:
+    from fastapi.testclient import TestClient
+    import main
+    import paginacion
+
+    esquemas = {}
+    # El estudiante 4 tiene matrículas con varios profesores, sin profesor y sin nota.
+    parametros_ruta = {**PARAMETROS_RUTA, "estudiante_id": 4}
+
+    def pedir(cliente, url, consulta, rapido):
+        paginacion.RESPUESTAS_RAPIDAS = rapido
+        respuesta = cliente.get(url, params=consulta)
+        return respuesta.status_code, respuesta.headers.get(paginacion.CABECERA_CURSOR), respuesta.content
+
+    def diferencia(ruta, normal, rapida) -> str:
+        if normal[:2] != rapida[:2]:
+            return "status o cursor"
+        if normal[0] != 200 or normal[2] == rapida[2]:
+            return "" if normal[2] == rapida[2] else "cuerpo"
+        if _valores(normal[2]) != _valores(rapida[2]):
+            return "valores"
+        esquema = esquemas.get(ruta)
+        if esquema is not None and esquema.dump_json(esquema.validate_json(normal[2]), warnings=False) != rapida[2]:
+            return "bytes del response_model"
+        return ""
+
+    fallas, comparadas, variables = [], 0, []
+    with TestClient(main.app) as cliente:
+        _sembrar(cliente)
+        _escrituras(cliente)
+        _sembrar_contrato(cliente)
+        for ruta, operaciones in main.app.openapi()["paths"].items():
+            if "get" not in operaciones or ruta in RUTAS_SIN_FIN:
+                continue
+            esquemas[ruta] = _esquema_respuesta(operaciones["get"])
+            declarados = {parametro["name"] for parametro in operaciones["get"].get("parameters", [])}
+            url = ruta.format(**{nombre: parametros_ruta.get(nombre, 1) for nombre in re.findall(r"{(\w+)}", ruta)})
+            consultas = [{nombre: valor for nombre, valor in PARAMETROS_CONSULTA.items() if nombre in declarados}]
+            if "limit" in declarados:
+                # Página corta con cursor y página sin filtros, para comparar también X-Next-Cursor.
+                consultas += [{**consultas[0], "limit": 2}, {"limit": 2, "after_id": 1}]
+            for consulta in consultas:
+                normal = pedir(cliente, url, consulta, False)
+                rapida = pedir(cliente, url, consulta, True)
+                if rapida != normal and pedir(cliente, url, consulta, False) != normal:
+                    # Respuestas que cambian entre llamadas (métricas, contadores): no comparables.
+                    variables.append(url)
+                    continue
+                comparadas += 1
+                motivo = diferencia(ruta, normal, rapida)
+                if motivo:
+                    fallas.append((url, consulta, motivo, normal, rapida))
+    paginacion.RESPUESTAS_RAPIDAS = True
+
+    for url, consulta, motivo, normal, rapida in fallas:
+        print(f"DIFERENCIA ({motivo}): {url} {consulta}")
+        print("    response_model:", normal[0], normal[1], normal[2][:300])
+        print("    camino rápido: ", rapida[0], rapida[1], rapida[2][:300])
+    if variables:
+        print("Sin comparar (cambian entre llamadas):", ", ".join(sorted(set(variables))))
+    print(f"{comparadas} respuestas comparadas, {len(fallas)} diferentes.")
+    return 1 if fallas else 0
+
+
+def cupos(args) -> int:
+    import httpx
+    from sqlalchemy import func, insert
+    from sqlmodel import Session, select
+    from db import create_db_and_tables, engine
+    from models import Estudiante, ListaEspera, Materia, Matricula
+    import main
+
+    create_db_and_tables()
+    with Session(engine) as session:
+        session.execute(insert(Estudiante), [
+            {"nombre": f"Estudiante {i}", "cedula": str(i), "correo": f"e{i}@uni.edu", "semestre": 1}
+            for i in range(1, args.estudiantes + 1)
+        ])
+        session.execute(insert(Materia), [{"nombre": "Cálculo", "codigo": "MAT-1", "creditos": 3, "cupo": args.cupo, "cupos_disponibles": args.cupo}])
+        session.commit()
+        materia_id = session.exec(select(Materia.id)).one()
+
+    fallas = []
+    azar = random.Random(7)
+    solicitudes = [estudiante_id for estudiante_id in range(1, args.estudiantes + 1) for _ in range(2)]
+    azar.shuffle(solicitudes)
+
+    async def disparar(peticiones):
+        # Los endpoints síncronos corren en el threadpool: las transacciones compiten de verdad por la base.
+        transporte = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://verificacion", timeout=120) as cliente:
+            return await asyncio.gather(*[peticion(cliente) for peticion in peticiones])
+
+    def matricular(estudiante_id):
+        return lambda cliente: cliente.post("/matriculas/matriculas/", json={"estudiante_id": estudiante_id, "materia_id": materia_id})
+
+    def estado():
+        with Session(engine) as session:
+            activas = set(session.exec(select(Matricula.estudiante_id).where(Matricula.materia_id == materia_id, Matricula.active == True)).all())
+            en_espera = session.exec(select(ListaEspera.estudiante_id).where(ListaEspera.materia_id == materia_id).order_by(ListaEspera.id)).all()
+            disponibles = session.exec(select(Materia.cupos_disponibles).where(Materia.id == materia_id)).one()
+        return activas, en_espera, disponibles
+
+    inicio = time.perf_counter()
+    respuestas = asyncio.run(disparar([matricular(estudiante_id) for estudiante_id in solicitudes]))
+    duracion = time.perf_counter() - inicio
+    codigos = {}
+    for respuesta in respuestas:
+        codigos[respuesta.status_code] = codigos.get(respuesta.status_code, 0) + 1
+    print(f"{len(respuestas)} solicitudes de matrícula en {duracion:.2f} s ({len(respuestas) / duracion:.0f}/s): {dict(sorted(codigos.items()))}")
+
+    activas, en_espera, disponibles = estado()
+    if set(codigos) - {201, 202, 409}:
+        fallas.append(f"Códigos inesperados: {codigos}")
+    if codigos.get(201, 0) != args.cupo or len(activas) != args.cupo or disponibles != 0:
+        fallas.append(f"Sobrecupo o cupos perdidos: {codigos.get(201, 0)} creadas, {len(activas)} activas, {disponibles} disponibles (cupo {args.cupo})")
+    if len(en_espera) != args.estudiantes - args.cupo or len(set(en_espera)) != len(en_espera) or activas & set(en_espera):
+        fallas.append(f"Lista de espera inconsistente: {len(en_espera)} en espera para {args.estudiantes - args.cupo} sin cupo")
+
+    # Bajas simultáneas: cada cupo liberado debe pasar al siguiente de la lista, en orden de llegada.
+    bajas = azar.sample(sorted(activas), args.cupo // 2)
+    with Session(engine) as session:
+        ids_bajas = session.exec(select(Matricula.id).where(Matricula.materia_id == materia_id, Matricula.estudiante_id.in_(bajas))).all()
+    respuestas = asyncio.run(disparar([lambda cliente, matricula_id=matricula_id: cliente.delete(f"/matriculas/matriculas/{matricula_id}") for matricula_id in ids_bajas]))
+    if any(respuesta.status_code != 200 for respuesta in respuestas):
+        fallas.append(f"Bajas fallidas: {[respuesta.status_code for respuesta in respuestas if respuesta.status_code != 200]}")
+
+    activas_despues, en_espera_despues, disponibles = estado()
+    esperados = set(en_espera[:len(bajas)])
+    if len(activas_despues) != args.cupo or disponibles != 0:
+        fallas.append(f"Tras las bajas: {len(activas_despues)} activas y {disponibles} disponibles (cupo {args.cupo})")
+    if activas_despues != (activas - set(bajas)) | esperados or en_espera_despues != en_espera[len(bajas):]:
+        fallas.append("La lista de espera no se promovió en orden de llegada.")
+
+    with Session(engine) as session:
+        total = session.exec(select(func.count()).select_from(Matricula).where(Matricula.materia_id == materia_id)).one()
+    print(f"{len(bajas)} bajas simultáneas, {len(esperados)} promovidos; {len(activas_despues)} activas, {len(en_espera_despues)} en espera, {total} matrículas en total.")
+
+    for falla in fallas:
+        print("FALLA:", falla)
+    return 1 if fallas else 0
+
+
+def busqueda(args) -> int:
+    from fastapi.testclient import TestClient
+    from sqlalchemy import insert
+    from sqlmodel import Session
+    from db import engine
+    from models import Estudiante
+    from busqueda import normalizar
+    import main
+
+    nombres = ["José", "María", "Andrés", "Lucía", "Sebastián", "Camila", "Ángel", "Mariana", "Martín", "Sofía", "Nicolás", "Julián"]
+    apellidos = ["Pérez", "Gómez", "Rodríguez", "Martínez", "Núñez", "Muñoz", "Díaz", "Álvarez", "Ramírez", "López", "García", "Castaño"]
+    nombres += [f"Nombre{i}" for i in range(300)]
+    apellidos += [f"Apellido{i}" for i in range(3000)]
+    consultas = ["jose", "Maria Pérez", "mar", "ma", "munoz alv", "angel", "ANDRES gom", "nombre12 apellido29", "lucia castano", "zzz"]
+
+    fallas = []
+    azar = random.Random(7)
+    with TestClient(main.app) as cliente:
+        inicio = time.perf_counter()
+        with Session(engine) as session:
+            for desde in range(0, args.estudiantes, 50_000):
+                session.execute(insert(Estudiante), [
+                    {"nombre": f"{azar.choice(nombres)} {azar.choice(apellidos)} {azar.choice(apellidos)}", "cedula": str(i), "correo": f"e{i}@uni.edu", "semestre": 1}
+                    for i in range(desde, min(desde + 50_000, args.estudiantes))
+                ])
+            session.commit()
+        print(f"{args.estudiantes} estudiantes sembrados e indexados en {time.perf_counter() - inicio:.1f} s")
+
+        tiempos = []
+        for q in consultas:
+            palabras = normalizar(q)
+            for _ in range(args.repeticiones):
+                inicio = time.perf_counter()
+                respuesta = cliente.get("/busqueda/estudiantes", params={"q": q})
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+            for estudiante in respuesta.json():
+                encontradas = normalizar(estudiante["nombre"])
+                if not all(p in encontradas for p in palabras[:-1]) or not any(e.startswith(palabras[-1]) for e in encontradas):
+                    fallas.append(f"'{q}' devolvió '{estudiante['nombre']}'")
+            print(f"  {q!r}: {len(respuesta.json())} resultados")
+
+        # El índice sigue a las escrituras (triggers): renombrar y borrar.
+        cliente.put("/estudiantes/estudiantes/1", json={"nombre": "Xiomara Quintero", "cedula": "0", "correo": "e0@uni.edu", "semestre": 1})
+        if [e["id"] for e in cliente.get("/busqueda/estudiantes", params={"q": "xiomara quint"}).json()] != [1]:
+            fallas.append("El cambio de nombre no se reflejó en la búsqueda.")
+        cliente.delete("/estudiantes/estudiantes/1")
+        if cliente.get("/busqueda/estudiantes", params={"q": "xiomara"}).json():
+            fallas.append("El estudiante eliminado sigue apareciendo en la búsqueda.")
+
+    tiempos.sort()
+    p50, p95 = tiempos[len(tiempos) // 2], tiempos[int(len(tiempos) * 0.95)]
+    print(f"{len(tiempos)} búsquedas: p50 {p50:.1f} ms, p95 {p95:.1f} ms, máximo {tiempos[-1]:.1f} ms")
+    if p95 > args.umbral_ms:
+        fallas.append(f"p95 de {p95:.1f} ms supera el umbral de {args.umbral_ms} ms")
+
+    for falla in fallas[:20]:
+        print("FALLA:", falla)
+    return 1 if fallas else 0
+
+
+def _sembrar_reportes(session, materias: int, profesores: int, desde_estudiante: int, estudiantes: int):
+    """
+    Agrega `estudiantes` estudiantes, cada uno matriculado en las `materias` materias (las crea si faltan)
+    con dos profesores por matrícula. Devuelve el ID del primer estudiante agregado.
+    """
+    from sqlalchemy import func, insert
+    from sqlmodel import select
+    from models import Estudiante, Materia, Matricula, MatriculaProfesorLink, Profesor
+
+    existentes = session.exec(select(func.count()).select_from(Materia)).one()
+    if existentes < materias:
+        session.execute(insert(Materia), [
+            {"nombre": f"Materia {i}", "codigo": f"R-{i}", "creditos": 1 + i % 5} for i in range(existentes, materias)
+        ])
+    existentes = session.exec(select(func.count()).select_from(Profesor)).one()
+    if existentes < profesores:
+        session.execute(insert(Profesor), [{"nombre": f"Profesor {i}", "especialidad": "Reportes"} for i in range(existentes, profesores)])
+    materias_ids = session.exec(select(Materia.id).order_by(Materia.id).limit(materias)).all()
+    profesores_ids = session.exec(select(Profesor.id).order_by(Profesor.id).limit(profesores)).all()
+
+    session.execute(insert(Estudiante), [
+        {"nombre": f"Estudiante {i}", "cedula": f"R{i}", "correo": f"r{i}@uni.edu", "semestre": 1}
+        for i in range(desde_estudiante, desde_estudiante + estudiantes)
+    ])
+    primero = session.exec(select(Estudiante.id).where(Estudiante.cedula == f"R{desde_estudiante}")).one()
+    for estudiante_id in range(primero, primero + estudiantes):
+        session.execute(insert(Matricula), [
+            {"estudiante_id": estudiante_id, "materia_id": materia_id, "nota_final": 3.0} for materia_id in materias_ids
+        ])
+    matriculas = session.exec(select(Matricula.id).where(Matricula.estudiante_id >= primero)).all()
+    session.execute(insert(MatriculaProfesorLink), [
+        {"matricula_id": matricula_id, "profesor_id": profesores_ids[(matricula_id + k) % len(profesores_ids)]}
+        for matricula_id in matriculas for k in (0, 1)
+    ])
+    session.commit()
+    return primero
+
+
+def reportes(args) -> int:
+    from fastapi.testclient import TestClient
+    from sqlmodel import Session
+    from db import async_engine, engine
+    import main
+    import paginacion
+
+    sentencias = []
+
+    def contar(conexion, cursor, sentencia, parametros, contexto, executemany):
+        sentencias.append(sentencia)
+
+    def medir(cliente, estudiante_id) -> dict:
+        cuentas = {}
+        for rapidas in (True, False):
+            paginacion.RESPUESTAS_RAPIDAS = rapidas
+            camino = "rápido" if rapidas else "ORM"
+            for nombre, ruta, consulta in (
+                (f"estudiante ({camino})", f"/reporte/estudiante/{estudiante_id}", {}),
+                (f"profesores ({camino})", "/reporte/profesores", {}),
+                ("estudiante (ndjson)", f"/reporte/estudiante/{estudiante_id}", {"format": "ndjson"}),
+                ("profesores (ndjson)", "/reporte/profesores", {"format": "ndjson"}),
+            ):
+                sentencias.clear()
+                respuesta = cliente.get(ruta, params=consulta)
+                if respuesta.status_code != 200:
+                    raise RuntimeError(f"{ruta} respondió {respuesta.status_code}")
+                cuentas[nombre] = len(sentencias)
+        return cuentas
+
+    with TestClient(main.app) as cliente:
+        with Session(engine) as session:
+            chico = _sembrar_reportes(session, 2, 2, 0, 1)
+        for motor in (engine, async_engine.sync_engine):
+            event.listen(motor, "before_cursor_execute", contar)
+        try:
+            pocos = medir(cliente, chico)
+            with Session(engine) as session:
+                grande = _sembrar_reportes(session, args.matriculas, args.profesores, 1, args.estudiantes)
+            muchos = medir(cliente, grande)
+        finally:
+            for motor in (engine, async_engine.sync_engine):
+                event.remove(motor, "before_cursor_execute", contar)
+            paginacion.RESPUESTAS_RAPIDAS = True
+
+    fallas = []
+    for nombre in pocos:
+        print(f"{nombre}: {pocos[nombre]} sentencias con pocos datos, {muchos[nombre]} con {args.matriculas} matrículas por estudiante")
+        if pocos[nombre] != muchos[nombre] or muchos[nombre] > MAXIMO_SENTENCIAS_REPORTE:
+            fallas.append(nombre)
+    for nombre in fallas:
+        print("FALLA:", nombre, "no usa una cantidad fija de sentencias.")
+    return 1 if fallas else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subcomandos = parser.add_subparsers(dest="verificacion", required=True)
+    subcomandos.add_parser("planes", help="EXPLAIN QUERY PLAN de todas las consultas de los routers")
+    parser_cupos = subcomandos.add_parser("cupos", help="Matrículas concurrentes contra una materia con cupo")
+    parser_cupos.add_argument("--estudiantes", type=int, default=3000)
+    parser_cupos.add_argument("--cupo", type=int, default=100)
+    parser_busqueda = subcomandos.add_parser("busqueda", help="Búsqueda por nombre sobre un millón de estudiantes")
+    parser_busqueda.add_argument("--estudiantes", type=int, default=1_000_000)
+    parser_busqueda.add_argument("--repeticiones", type=int, default=20)
+    parser_busqueda.add_argument("--umbral-ms", type=float, default=50)
+    subcomandos.add_parser("contrato", help="Mismo JSON byte a byte con y sin el camino rápido de serialización")
+    parser_reportes = subcomandos.add_parser("reportes", help="Misma cantidad de sentencias por reporte con pocos y muchos datos")
+    parser_reportes.add_argument("--matriculas", type=int, default=300, help="Matrículas por estudiante en la base grande")
+    parser_reportes.add_argument("--profesores", type=int, default=200)
+    parser_reportes.add_argument("--estudiantes", type=int, default=20)
+    args = parser.parse_args()
+
+    sys.exit({"planes": planes, "cupos": cupos, "busqueda": busqueda, "contrato": contrato, "reportes": reportes}[args.verificacion](args))